@@ -0,0 +1,339 @@
+import json
+import logging
+from datetime import datetime, timedelta
+
+import click
+
+from ckan import model
+from ckan.model import Session
+
+from ckanext.harvest.model import (
+    HarvestJob, HarvestObject, HarvestObjectError, HarvestObjectExtra as HOExtra, HarvestSource,
+)
+
+from ckanext.geonode.harvesters.context import HarvestContext
+from ckanext.geonode.harvesters.geonode import GeoNodeHarvester
+from ckanext.geonode.harvesters.mappers.pool import MappingPool
+
+import ckanext.geonode.harvesters.bulk as bulk
+import ckanext.geonode.harvesters.metrics as metrics
+import ckanext.geonode.harvesters.report as report
+import ckanext.geonode.harvesters.scheduler as scheduler
+import ckanext.geonode.harvesters.simulate as simulate
+import ckanext.geonode.harvesters.snapshot as snapshot
+import ckanext.geonode.harvesters.storage as storage
+
+
+log = logging.getLogger(__name__)
+
+
+def get_commands():
+    return [geonode]
+
+
+@click.group()
+def geonode():
+    """GeoNode harvester management commands.
+    """
+    pass
+
+
+@geonode.command()
+@click.argument('source')
+@click.option('--compression', default=storage.COMPRESSION_ZLIB,
+              type=click.Choice([storage.COMPRESSION_ZLIB, storage.COMPRESSION_ZSTD]),
+              help='Compression used for the plain contents')
+@click.option('--batch-size', default=500, help='Number of objects updated in a single transaction')
+def compact(source, compression, batch_size):
+    """Compress the plain harvest object contents of a GeoNode SOURCE (id or name).
+    """
+    storage.check_compression(compression)
+    harvest_source = _get_source(source)
+
+    cnt = 0
+    size_before = size_after = 0
+    last_id = ''
+    while True:
+        objects = Session.query(HarvestObject). \
+            filter(HarvestObject.harvest_source_id == harvest_source.id). \
+            filter(HarvestObject.content != None). \
+            filter(HarvestObject.id > last_id). \
+            order_by(HarvestObject.id). \
+            limit(batch_size). \
+            all()
+        if not objects:
+            break
+
+        for ho in objects:
+            last_id = ho.id
+            ref = storage.get_ref(ho.content)
+            if ref and not any(extra.key == storage.EXTRA_CONTENT_REF for extra in ho.extras):
+                # deduplicated before the references were stored in the extras
+                Session.add(HOExtra(harvest_object_id=ho.id, key=storage.EXTRA_CONTENT_REF, value=ref))
+            if storage.is_encoded(ho.content):
+                continue
+            size_before += len(ho.content)
+            ho.content = storage.encode(ho.content, compression)
+            size_after += len(ho.content)
+            cnt += 1
+        Session.commit()
+
+    click.secho(f'Compacted {cnt} objects: {size_before} -> {size_after} bytes', fg='green')
+
+
+@geonode.command()
+@click.argument('source')
+@click.option('--keep-days', default=30, help='Keep the objects of the jobs finished in the last days')
+@click.option('--batch-size', default=500, help='Number of objects deleted in a single transaction')
+@click.option('--dry-run', is_flag=True, help='Only count the objects that would be deleted')
+def prune(source, keep_days, batch_size, dry_run):
+    """Delete the historic non-current harvest objects of a GeoNode SOURCE (id or name).
+    """
+    harvest_source = _get_source(source)
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+
+    # objects whose content is referenced by deduplicated contents, read once
+    referenced = set(ref for (ref,) in Session.query(HOExtra.value).
+                     join(HarvestObject, HOExtra.harvest_object_id == HarvestObject.id).
+                     filter(HarvestObject.harvest_source_id == harvest_source.id).
+                     filter(HOExtra.key == storage.EXTRA_CONTENT_REF))
+
+    query = Session.query(HarvestObject.id). \
+        join(HarvestJob, HarvestObject.harvest_job_id == HarvestJob.id). \
+        filter(HarvestObject.harvest_source_id == harvest_source.id). \
+        filter(HarvestObject.current == False). \
+        filter(HarvestJob.status == 'Finished'). \
+        filter(HarvestJob.finished < cutoff). \
+        order_by(HarvestObject.id)
+
+    if dry_run:
+        count = sum(1 for (ho_id,) in query.yield_per(batch_size) if ho_id not in referenced)
+        click.secho(f'{count} objects would be deleted', fg='yellow')
+        return
+
+    # the reports are computed from the harvest objects, so they are stored before deleting them
+    jobs = Session.query(HarvestJob). \
+        filter(HarvestJob.source_id == harvest_source.id). \
+        filter(HarvestJob.status == 'Finished'). \
+        filter(HarvestJob.finished < cutoff)
+    for harvest_job in jobs:
+        if not report.has_report(harvest_job):
+            report.save_report(harvest_job)
+
+    cnt = 0
+    last_id = ''
+    while True:
+        ids = [ho_id for (ho_id,) in query.filter(HarvestObject.id > last_id).limit(batch_size)]
+        if not ids:
+            break
+        last_id = ids[-1]
+        ids = [ho_id for ho_id in ids if ho_id not in referenced]
+        for cls, column in ((HOExtra, HOExtra.harvest_object_id),
+                            (HarvestObjectError, HarvestObjectError.harvest_object_id),
+                            (HarvestObject, HarvestObject.id)):
+            Session.query(cls).filter(column.in_(ids)).delete(synchronize_session=False)
+        Session.commit()
+        cnt += len(ids)
+        log.debug('Deleted %d objects', cnt)
+
+    click.secho(f'Deleted {cnt} objects', fg='green')
+
+
+@geonode.command()
+@click.option('--max-jobs', type=int, help='Maximum number of jobs running at the same time')
+@click.option('--max-jobs-per-host', type=int, help='Maximum number of jobs running on the same GeoNode host')
+@click.option('--min-interval', type=float, help='Hours to wait after a successful job before harvesting again')
+@click.option('--dry-run', is_flag=True, help='Only list the sources that would be harvested')
+def schedule(max_jobs, max_jobs_per_host, min_interval, dry_run):
+    """Start the harvest jobs of the most stale GeoNode sources, within the concurrency quotas.
+    """
+    chosen = scheduler.schedule(dry_run=dry_run, max_running=max_jobs, max_per_host=max_jobs_per_host,
+                                min_interval=timedelta(hours=min_interval) if min_interval is not None else None)
+
+    for status in chosen:
+        last_success = status.last_success.strftime('%Y-%m-%d %H:%M') if status.last_success else 'never'
+        click.echo(f'{status.title} ({status.host}): {status.size} objects, last harvested {last_success}')
+    click.secho(f'{len(chosen)} jobs ' + ('would be started' if dry_run else 'started'),
+                fg='yellow' if dry_run else 'green')
+
+
+@geonode.command('metrics')
+@click.option('--job', 'job_id', help='Print the metrics of a harvest job instead')
+def show_metrics(job_id):
+    """Print the metrics of the harvester processes in the Prometheus text format.
+    """
+    if job_id:
+        harvest_job = HarvestJob.get(job_id)
+        if harvest_job is None:
+            raise click.BadParameter(f'Harvest job "{job_id}" not found')
+        click.echo(json.dumps(metrics.get_job_metrics(harvest_job), indent=2))
+        return
+
+    click.echo(metrics.render(metrics.collect()), nl=False)
+
+
+@geonode.command('report')
+@click.argument('job_id')
+@click.option('--compare', 'other_job_id', help='Compare the report with the one of another job')
+@click.option('--previous', is_flag=True, help='Compare the report with the one of the previous job of the source')
+@click.option('--slowest', default=report.DEFAULT_SLOWEST, help='Number of slowest objects listed')
+def show_report(job_id, other_job_id, previous, slowest):
+    """Print the report of a harvest job as JSON, or its comparison with another job.
+    """
+    harvest_job = _get_job(job_id)
+    job_report = report.get_report(harvest_job, slowest)
+
+    other_job = None
+    if other_job_id:
+        other_job = _get_job(other_job_id)
+    elif previous:
+        other_job = HarvestJob.filter(source_id=harvest_job.source_id). \
+            filter(HarvestJob.created < harvest_job.created). \
+            order_by(HarvestJob.created.desc()).first()
+        if other_job is None:
+            raise click.ClickException(f'No previous job for the source of job "{job_id}"')
+
+    if other_job is None:
+        click.echo(json.dumps(job_report, indent=2))
+        return
+
+    comparison = report.compare(job_report, report.get_report(other_job, slowest))
+    click.echo(f'{"":<50} {harvest_job.id[:8]:>14} {other_job.id[:8]:>14} {"delta":>14}')
+    for path, values in comparison.items():
+        click.echo(f'{path:<50} ' + ' '.join(f'{_format_number(values[k]):>14}' for k in ('value', 'other', 'delta')))
+
+
+@geonode.command('simulate')
+@click.argument('source')
+@click.option('--config', 'source_config', help='Source config (JSON); by default the one of the source')
+@click.option('--limit', type=int, help='Maximum number of resources of each type; the results are projected')
+@click.option('--processes', type=int, help='Number of mapping processes')
+@click.option('--skip-groups', is_flag=True, help='Do not check that the mapped groups exist')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as JSON to a file')
+def run_simulation(source, source_config, limit, processes, skip_groups, output):
+    """Dry run of the gather and the mapping of a source, given by id, name or GeoNode URL.
+
+    Measures the timings, the payload sizes and the number of packages and resources
+    that would be created, without writing anything to the database, the queues or the storage.
+    """
+    harvester = GeoNodeHarvester()
+    url, harvest_context = _get_harvest_context(harvester, source, source_config)
+
+    with MappingPool(processes) as pool:
+        simulation = simulate.simulate(harvester, url, harvest_context.config, pool, limit=limit,
+                                       group_validator=None if skip_groups else harvest_context.is_valid_group)
+    results = simulation.as_dict()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    click.echo(f'{"":<12} {"total":>8} {"objects":>8} {"api s":>9} {"map s":>9} {"received":>12} '
+               f'{"stored":>12} {"packages":>9} {"resources":>9} {"errors":>7}')
+    for type_name, counts in list(results['types'].items()) + [('all', results['summary'])]:
+        click.echo(f'{type_name:<12} {_format_number(counts["total"]):>8} {counts["objects"]:>8} '
+                   f'{counts["api_seconds"]:>9.3f} {counts["mapping_seconds"]:>9.3f} {counts["received_bytes"]:>12} '
+                   f'{counts["stored_bytes"]:>12} {counts["packages"]:>9} {counts["resources"]:>9} '
+                   f'{counts["mapping_errors"]:>7}')
+    projected = results['projected']
+    if projected and projected['objects'] > results['summary']['objects']:
+        click.echo(f'Projected on {projected["objects"]} resources: {projected["api_seconds"]:.0f}s of API requests, '
+                   f'{projected["mapping_seconds"]:.0f}s of mapping, {projected["received_bytes"]} bytes received, '
+                   f'{projected["stored_bytes"]} bytes stored, {projected["packages"]} packages, '
+                   f'{projected["resources"]} resources')
+    click.echo(f'Done in {results["seconds"]:.1f}s')
+
+
+@geonode.command('record')
+@click.argument('source')
+@click.option('--config', 'source_config', help='Source config (JSON); by default the one of the source')
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='Path of the snapshot; by default the one recorded by the harvest of the source')
+def record_snapshot(source, source_config, output):
+    """Record a snapshot of the API pages of a source, given by id, name or GeoNode URL.
+
+    The snapshot can be replayed by the harvester with the `replay_snapshot` config.
+    """
+    harvester = GeoNodeHarvester()
+    url, harvest_context = _get_harvest_context(harvester, source, source_config)
+    if not output:
+        if harvest_context.source_id is None:
+            raise click.BadParameter('--output is needed when recording a GeoNode URL')
+        output = snapshot.get_snapshot_path(harvest_context.source_id)
+
+    client = snapshot.RecordingClient(harvester._get_client(url, harvest_context.config), output)
+    complete = False
+    try:
+        count = 0
+        for geonode_type in harvester._get_harvest_types(harvest_context.config):
+            client.get_total(geonode_type)
+            for page, _ in client.get_pages(geonode_type):
+                count += len(page)
+        complete = True
+    finally:
+        client.close(complete=complete)
+    click.secho(f'Recorded {count} resources in {output}', fg='green')
+
+
+@geonode.command('bulk')
+@click.argument('source')
+@click.option('--snapshot', 'snapshot_path', type=click.Path(exists=True, dir_okay=False),
+              help='Gather the resources from a snapshot instead of the GeoNode API')
+@click.option('--batch-size', default=bulk.DEFAULT_BATCH_SIZE, help='Number of objects mapped at once')
+@click.option('--processes', type=int, help='Number of mapping processes')
+def bulk_harvest(source, snapshot_path, batch_size, processes):
+    """Harvest a source in this process, without the harvest queues.
+
+    The job and the harvest objects are the ones a queued harvest would create, so the next harvests
+    of the source can be incremental.
+    """
+    harvest_source = _get_source(source)
+    harvester = GeoNodeHarvester()
+    with MappingPool(processes) as pool:
+        harvest_job, results = bulk.bulk_harvest(harvester, harvest_source, pool, snapshot_path=snapshot_path,
+                                                 batch_size=batch_size)
+
+    details = ', '.join(f'{count} {status}' for status, count in sorted(results.items())) or 'no objects'
+    click.secho(f'Job {harvest_job.id}: {details}', fg='red' if 'errored' in results or not results else 'green')
+
+
+def _get_harvest_context(harvester, source, source_config):
+    '''
+    Returns the URL and the HarvestContext of a source given by id, name or GeoNode URL
+    '''
+    if source.startswith(('http://', 'https://')):
+        url, source_id = source, None
+    else:
+        harvest_source = _get_source(source)
+        url, source_id = harvest_source.url, harvest_source.id
+        source_config = source_config or harvest_source.config
+    try:
+        source_config = harvester.validate_config(source_config)
+    except ValueError as e:
+        raise click.BadParameter(f'Bad config: {e}')
+    return url, HarvestContext(source_id, json.loads(source_config) if source_config else {})
+
+
+def _format_number(value):
+    if value is None:
+        return '-'
+    return f'{value:.3f}' if isinstance(value, float) else str(value)
+
+
+def _get_job(job_id):
+    harvest_job = HarvestJob.get(job_id)
+    if harvest_job is None:
+        raise click.BadParameter(f'Harvest job "{job_id}" not found')
+    return harvest_job
+
+
+def _get_source(source):
+    harvest_source = HarvestSource.get(source)
+    if harvest_source is None:
+        package = model.Package.get(source)
+        harvest_source = HarvestSource.get(package.id) if package else None
+    if harvest_source is None:
+        raise click.BadParameter(f'Harvest source "{source}" not found')
+    if harvest_source.type != 'geonode':
+        raise click.BadParameter(f'Harvest source "{source}" is not a GeoNode source')
+    return harvest_source
@@ -13,6 +13,7 @@ from enum import Enum
 GEONODE_JSON_TYPE = 'resource_type'
 
 RESOURCE_DOWNLOADER = 'DOWNLOADER__'
+NAME_FALLBACK = 'NAME_FALLBACK__'
 
 TEMP_FILE_THRESHOLD_SIZE = 5 * 1024 * 1024
 
@@ -29,6 +30,25 @@ CONFIG_IMPORT_TYPES = 'import'
 
 CONFIG_INCLUDE_ALL_LINKS = 'include_all_links'
 
+CONFIG_SPARSE_FIELDS = 'sparse_fields'
+CONFIG_PROJECT_CONTENT = 'project_content'
+CONFIG_CONTENT_COMPRESSION = 'content_compression'
+CONFIG_CONTENT_DEDUP = 'content_dedup'
+
+CONFIG_PIPELINED_GATHER = 'pipelined_gather'
+CONFIG_RESUMABLE_GATHER = 'resumable_gather'
+CONFIG_MAX_QUEUED_OBJECTS = 'max_queued_objects'
+CONFIG_MAX_OBJECTS_PER_JOB = 'max_objects_per_job'
+CONFIG_MAX_GATHER_SECONDS = 'max_gather_seconds'
+CONFIG_MAX_RETRIES = 'max_retries'
+CONFIG_RETRY_BACKOFF = 'retry_backoff'
+CONFIG_CONCURRENCY = 'concurrency'
+CONFIG_ASYNC_CLIENT = 'async_client'
+CONFIG_PROFILE_SAMPLE_RATE = 'profile_sample_rate'
+CONFIG_PROFILE_SLOWEST = 'profile_slowest'
+CONFIG_RECORD_SNAPSHOT = 'record_snapshot'
+CONFIG_REPLAY_SNAPSHOT = 'replay_snapshot'
+
 
 class GeoNodeType(Enum):
 
@@ -0,0 +1,290 @@
+import asyncio
+import atexit
+import json
+import logging
+import math
+import tempfile
+import threading
+from collections import deque
+from io import BytesIO
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from ckanext.geonode.harvesters import GeoNodeType, metrics
+from ckanext.geonode.harvesters.client import GeoNodeClient, DEFAULT_TIMEOUT, get_cached_version, cache_version
+from ckanext.geonode.harvesters.ratelimit import get_limiter, get_retry_after, get_status, THROTTLING_CODES
+from ckanext.geonode.harvesters.utils import get_wfs_getfeatures_url, WFS_VERSION_200, WFS_FORMAT_CSV
+
+log = logging.getLogger(__name__)
+
+# how many API pages are requested in advance while the previous ones are being processed
+DEFAULT_PREFETCH = 8
+
+CHUNK_SIZE = 64 * 1024
+
+
+def check_available():
+    if aiohttp is None:
+        raise ValueError('The asyncio client requires the "aiohttp" package to be installed')
+
+
+class AsyncGeoNodeClient(object):
+    """
+    asyncio implementation of GeoNodeClient.
+
+    Once the first page of a listing is read, the following pages are requested concurrently
+    (up to `prefetch` in advance, and within the limits of the host limiter), and yielded in order.
+    """
+
+    def __init__(self, baseurl, fields=None, retries=3, backoff=1.0, concurrency=None, timeout=DEFAULT_TIMEOUT,
+                 prefetch=DEFAULT_PREFETCH):
+        check_available()
+        self.baseurl = baseurl.rstrip('/')
+        self.fields = fields
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.prefetch = prefetch
+        self.limiter = get_limiter(self.baseurl, concurrency)
+        self.received_bytes = 0
+        self.retried = 0
+        self.version = None
+
+    async def open(self):
+        self.version = get_cached_version(self.baseurl)
+        if self.version is None:
+            self.version = await self._check_version()
+            cache_version(self.baseurl, self.version)
+            log.info(f'GeoNode version is {self.version}')
+
+    async def _check_version(self):
+        url = f'{self.baseurl}/api/v2/'
+        log.debug('Checking GeoNode version at %s', url)
+        json_content = await self._get_json(url)
+        return '3' if 'layers' in json_content else '4'
+
+    def get_list_url(self, res_type: GeoNodeType):
+        return GeoNodeClient.get_list_url(self, res_type)
+
+    async def get_pages(self, res_type: GeoNodeType, start_url=None):
+        '''
+        async generator of the geonode resources json, one list per API page, along with the URL of the next page
+        '''
+        if res_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.DATASET_TYPE):
+            res_type = GeoNodeType.LAYER_TYPE if self.version == '3' else GeoNodeType.DATASET_TYPE
+
+        url = start_url or self.get_list_url(res_type)
+        json_content = await self._get_json(url)
+
+        total = json_content.get('total')
+        page = json_content.get('page')
+        page_size = json_content.get('page_size')
+
+        if total is None or not page or not page_size:
+            # no pagination info: follow the next links
+            while True:
+                next_url = json_content['links']['next']
+                yield self._page_objects(res_type, json_content), next_url
+                if next_url is None:
+                    return
+                json_content = await self._get_json(next_url)
+
+        last_page = max(page, math.ceil(total / page_size))
+        urls = [_page_url(url, n, page_size) for n in range(page + 1, last_page + 1)]
+
+        yield self._page_objects(res_type, json_content), urls[0] if urls else None
+
+        pending = deque()
+        scheduled = 0
+        try:
+            for idx in range(len(urls)):
+                while scheduled < len(urls) and len(pending) < self.prefetch:
+                    pending.append(asyncio.ensure_future(self._get_json(urls[scheduled])))
+                    scheduled += 1
+                json_content = await pending.popleft()
+                next_url = urls[idx + 1] if idx + 1 < len(urls) else None
+                yield self._page_objects(res_type, json_content), next_url
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _page_objects(self, res_type, json_content):
+        objects = json_content[res_type.json_resource_list]
+        for res in objects:
+            log.debug(f'Found {res_type.json_resource_type} {res["uuid"]} id:{res["pk"]} "{res["title"]}"')
+        return objects
+
+    async def download_document(self, id, outputfile):
+        '''
+        Streams a document from geonode into the given file
+        '''
+        log.debug('Retrieve blob data for document #%d', id)
+        url = f'{self.baseurl}/documents/{id}/download'
+        await _stream(url, outputfile, self.limiter, self.timeout)
+        return outputfile
+
+    async def _get_json(self, url):
+        attempt = 0
+        while True:
+            try:
+                async with self.limiter.request_async():
+                    with metrics.timer('api_request', host=self.limiter.host) as timer:
+                        async with get_session().get(url, timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+                            resp.raise_for_status()
+                            response = await resp.read()
+                            timer.bytes = len(response)
+                self.received_bytes += len(response)
+                return json.loads(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                status = get_status(e)
+                if status and status < 500 and status not in THROTTLING_CODES:
+                    # client error, no point in retrying
+                    raise
+                if attempt >= self.retries:
+                    raise
+                delay = max(self.backoff * 2 ** attempt, get_retry_after(e) or 0)
+                attempt = attempt + 1
+                self.retried += 1
+                log.warning(f'Error retrieving {url}: {e!r}; retry {attempt}/{self.retries} in {delay}s')
+                await asyncio.sleep(delay)
+
+
+async def load_wfs_getfeatures(gsbaseurl, typename, outputfile=None, version=WFS_VERSION_200,
+                               output_format=WFS_FORMAT_CSV, timeout=None):
+    '''
+    asyncio version of utils.load_wfs_getfeatures, streaming the features into the output file
+    '''
+    check_available()
+    url = get_wfs_getfeatures_url(gsbaseurl, typename, version=version, output_format=output_format)
+    log.debug('Retrieve WFS GetFeature from %s into %s', url, outputfile)
+
+    if not outputfile:
+        outputfile = tempfile.TemporaryFile()
+
+    await _stream(url, outputfile, get_limiter(gsbaseurl), timeout)
+    outputfile.seek(0)
+    return outputfile
+
+
+async def _stream(url, outputfile, limiter, timeout):
+    async with limiter.request_async():
+        async with get_session().get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                outputfile.write(chunk)
+
+
+def _page_url(url, page, page_size):
+    parts = urlsplit(url)
+    params = [(k, v) for k, v in parse_qsl(parts.query) if k not in ('page', 'page_size')]
+    params.extend((('page', page), ('page_size', page_size)))
+    return urlunsplit(parts._replace(query=urlencode(params)))
+
+
+# All the coroutines run in a single event loop, in a dedicated thread, sharing the same HTTP session
+
+_loop = None
+_thread = None
+_session = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop, _thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name='geonode-asyncio', daemon=True)
+            _thread.start()
+        return _loop
+
+
+@atexit.register
+def shutdown():
+    '''
+    Closes the shared HTTP session and stops the event loop thread; they are created again by the next request
+    '''
+    global _loop, _thread, _session
+    with _loop_lock:
+        if _loop is None:
+            return
+        loop, thread, session = _loop, _thread, _session
+        _loop = _thread = _session = None
+
+    if session is not None and not session.closed:
+        asyncio.run_coroutine_threadsafe(session.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def get_session():
+    ''' Returns the HTTP session shared by all the requests; must be called in the event loop '''
+    global _session
+    if _session is None or _session.closed:
+        # concurrency is controlled by the host limiters
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+    return _session
+
+
+def run(coro):
+    '''
+    Runs a coroutine in the shared event loop, waiting for its result
+    '''
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+class SyncGeoNodeClient(GeoNodeClient):
+    """
+    Synchronous facade of AsyncGeoNodeClient, with the same interface as GeoNodeClient.
+
+    Requests from all the facades run in the same event loop thread.
+    """
+
+    def __init__(self, baseurl, fields=None, retries=3, backoff=1.0, concurrency=None, timeout=DEFAULT_TIMEOUT,
+                 prefetch=DEFAULT_PREFETCH):
+        self._client = AsyncGeoNodeClient(baseurl, fields=fields, retries=retries, backoff=backoff,
+                                          concurrency=concurrency, timeout=timeout, prefetch=prefetch)
+        run(self._client.open())
+        self.baseurl = self._client.baseurl
+        self.fields = fields
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = self._client.limiter
+        self.version = self._client.version
+
+    @property
+    def received_bytes(self):
+        return self._client.received_bytes
+
+    @property
+    def retried(self):
+        return self._client.retried
+
+    def get_pages(self, res_type: GeoNodeType, start_url=None):
+        pages = self._client.get_pages(res_type, start_url=start_url)
+        try:
+            while True:
+                try:
+                    yield run(pages.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            run(pages.aclose())
+
+    def get_document_download(self, id):
+        return run(self._client.download_document(id, BytesIO())).getvalue()
+
+    def _get_json(self, url):
+        return run(self._client._get_json(url))
+
+
+def load_wfs_getfeatures_sync(gsbaseurl, typename, outputfile=None, version=WFS_VERSION_200,
+                              output_format=WFS_FORMAT_CSV):
+    return run(load_wfs_getfeatures(gsbaseurl, typename, outputfile=outputfile,
+                                    version=version, output_format=output_format))
@@ -0,0 +1,140 @@
+import logging
+import time
+from datetime import datetime
+
+from ckan import model
+from ckan.model import Session
+from ckan.plugins import toolkit
+
+from ckanext.harvest.model import HarvestJob, HarvestObject
+
+from ckanext.geonode.harvesters import (
+    CONFIG_PIPELINED_GATHER, CONFIG_MAX_QUEUED_OBJECTS, CONFIG_MAX_OBJECTS_PER_JOB, CONFIG_MAX_GATHER_SECONDS,
+    CONFIG_RECORD_SNAPSHOT, CONFIG_REPLAY_SNAPSHOT,
+)
+from ckanext.geonode.harvesters.context import get_context, get_user
+from ckanext.geonode.harvesters.geonode import EXTRA_PRIORITY, PRIORITY_CHANGED, PRIORITY_NEW
+
+import ckanext.geonode.harvesters.report as report
+import ckanext.geonode.harvesters.storage as storage
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+
+# gather options that would send the objects to the queue or split the harvest over several jobs
+QUEUE_OPTIONS = (CONFIG_PIPELINED_GATHER, CONFIG_MAX_QUEUED_OBJECTS, CONFIG_MAX_OBJECTS_PER_JOB,
+                 CONFIG_MAX_GATHER_SECONDS)
+
+
+def bulk_harvest(harvester, harvest_source, pool, snapshot_path=None, batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Harvests a source in this process, without the gather and fetch queues.
+
+    A job is created and gathered as usual (from the API or from a snapshot), so the harvest objects are the
+    same a queued job would create and the next jobs can be incremental. The objects are then imported in
+    batches: the contents of each batch are mapped at once in the MappingPool, and the packages are written
+    one after the other in this process, in the order of priority returned by the gather.
+
+    :param snapshot_path: path of a snapshot to be gathered instead of the GeoNode API
+    :returns: a tuple (harvest job, dict report_status: count)
+    '''
+    source_config = {key: value for key, value in get_context(harvest_source).config.items()
+                     if key not in QUEUE_OPTIONS}
+    if snapshot_path:
+        source_config.pop(CONFIG_RECORD_SNAPSHOT, None)
+        source_config[CONFIG_REPLAY_SNAPSHOT] = snapshot_path
+
+    harvest_job = _start_job(harvest_source)
+    harvest_job.gather_started = datetime.utcnow()
+    try:
+        object_ids = harvester.gather_stage(harvest_job, source_config=source_config) or []
+    finally:
+        harvest_job.gather_finished = datetime.utcnow()
+        harvest_job.save()
+    log.info(f'Gathered {len(object_ids)} objects for job {harvest_job.id}')
+
+    results = {}
+    started = time.monotonic()
+    for start in range(0, len(object_ids), batch_size):
+        batch_ids = object_ids[start:start + batch_size]
+        for status in import_objects(harvester, _get_objects(batch_ids), pool):
+            results[status] = results.get(status, 0) + 1
+        done = start + len(batch_ids)
+        log.info(f'Imported {done}/{len(object_ids)} objects ({done / (time.monotonic() - started):.1f} objects/s)')
+
+    # marks the job as finished, as the harvest run command would
+    user_name, site_user_name = get_user()
+    context = {'model': model, 'session': Session, 'user': user_name, 'ignore_auth': user_name == site_user_name}
+    toolkit.get_action('harvest_jobs_run')(context, {'source_id': harvest_source.id})
+
+    return harvest_job, results
+
+
+def _start_job(harvest_source):
+    user_name, site_user_name = get_user()
+    context = {'model': model, 'session': Session, 'user': user_name, 'ignore_auth': user_name == site_user_name}
+    job_dict = toolkit.get_action('harvest_job_create')(context, {'source_id': harvest_source.id, 'run': False})
+    harvest_job = HarvestJob.get(job_dict['id'])
+    harvest_job.status = 'Running'
+    harvest_job.save()
+    return harvest_job
+
+
+def _get_objects(object_ids):
+    objects = {ho.id: ho for ho in Session.query(HarvestObject).filter(HarvestObject.id.in_(object_ids))}
+    return [objects[object_id] for object_id in object_ids if object_id in objects]
+
+
+def import_objects(harvester, harvest_objects, pool):
+    '''
+    Imports a batch of harvest objects of the same source, mapping the contents of the new and changed
+    ones at once in the MappingPool. The state and the report status of each object are updated as the
+    fetch consumer of ckanext-harvest does.
+
+    :returns: the list of the report statuses of the objects
+    '''
+    if not harvest_objects:
+        return []
+
+    # the deleted and unchanged objects do not need a mapping: the import stage skips the unchanged
+    # objects before building their package dict
+    to_map = [ho for ho in harvest_objects if _needs_mapping(harvester, ho)]
+    config = get_context(harvest_objects[0].source).config
+    mapped = dict(zip([ho.id for ho in to_map],
+                      pool.map([storage.load_content(ho) for ho in to_map], config)))
+
+    statuses = []
+    for harvest_object in harvest_objects:
+        harvest_object.fetch_started = harvest_object.fetch_finished = datetime.utcnow()
+        harvest_object.import_started = datetime.utcnow()
+        harvest_object.state = 'IMPORT'
+        harvest_object.save()
+
+        package_dict, extras, error = mapped.get(harvest_object.id, (None, None, None))
+        if error:
+            harvester._save_object_error(error, harvest_object, 'Import')
+            result = False
+        else:
+            try:
+                result = harvester.import_stage(harvest_object,
+                                                mapped=(package_dict, extras) if harvest_object.id in mapped else None)
+            except Exception as e:
+                # one failing object must not stop the import of the batch
+                log.exception(f'Error importing object {harvest_object.id}')
+                Session.rollback()
+                harvester._save_object_error(f'Error importing object: {e}', harvest_object, 'Import')
+                result = False
+
+        harvest_object.import_finished = datetime.utcnow()
+        harvest_object.state = 'COMPLETE' if result else 'ERROR'
+        harvest_object.report_status = report.get_report_status(harvest_object, result)
+        harvest_object.save()
+        statuses.append(harvest_object.report_status)
+
+    return statuses
+
+
+def _needs_mapping(harvester, harvest_object):
+    priority = harvester._get_object_extra(harvest_object, EXTRA_PRIORITY)
+    return priority in (str(PRIORITY_NEW), str(PRIORITY_CHANGED))
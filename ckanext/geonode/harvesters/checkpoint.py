@@ -0,0 +1,124 @@
+import logging
+from datetime import datetime, timedelta
+
+import ckanext.geonode.harvesters.state as state
+
+log = logging.getLogger(__name__)
+
+# Checkpoints not updated for this long are discarded, since the remote catalogue may have changed too much
+CHECKPOINT_MAX_AGE = timedelta(days=2)
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def get_checkpoint_source_ids():
+    '''
+    Returns the ids of the sources with a gather to be continued
+    '''
+    prefix = state.make_key('checkpoint') + '.'
+    return [key[len(prefix):] for key in state.find_keys('checkpoint')]
+
+
+class Checkpoint(object):
+    """
+    Pagination state of a gather, persisted after each API page so that a failed
+    or budgeted gather can be continued by the next job.
+
+    The GUIDs seen so far are the ones of the harvest objects gathered since `started`.
+    """
+
+    def __init__(self, source_id, config_hash, data):
+        self.source_id = source_id
+        self.config_hash = config_hash
+        self._data = data
+
+    @classmethod
+    def start(cls, harvest_job, config_hash):
+        '''
+        Creates the checkpoint for the given job, resuming the persisted one if it is still valid
+        '''
+        source_id = harvest_job.source.id
+        key = state.make_key('checkpoint', source_id)
+        data = state.load(key)
+
+        if data is not None and not cls._is_valid(data, config_hash):
+            log.info('Discarding checkpoint for source %s', source_id)
+            data = None
+
+        if data is None:
+            now = datetime.utcnow().strftime(DATE_FORMAT)
+            data = {
+                'config_hash': config_hash,
+                'created': now,
+                'updated': now,
+                'jobs': [],
+                'types': {},
+                'requeue': False,
+                'changed_layers': [],
+            }
+        else:
+            log.info('Resuming gather of source %s from checkpoint %r', source_id, data)
+
+        data['jobs'].append(harvest_job.id)
+
+        checkpoint = cls(source_id, config_hash, data)
+        checkpoint.save()
+        return checkpoint
+
+    @classmethod
+    def _is_valid(cls, data, config_hash):
+        if data.get('config_hash') != config_hash:
+            return False
+        updated = datetime.strptime(data.get('updated', data['created']), DATE_FORMAT)
+        return datetime.utcnow() - updated < CHECKPOINT_MAX_AGE
+
+    @property
+    def started(self):
+        ''' when the crawl started, in the first job of the chain '''
+        return datetime.strptime(self._data['created'], DATE_FORMAT)
+
+    @property
+    def previous_job_ids(self):
+        return self._data['jobs'][:-1]
+
+    @property
+    def requeue(self):
+        ''' True if the objects of the previous jobs have never been queued '''
+        return self._data['requeue']
+
+    @property
+    def changed_layers(self):
+        ''' keys of the new or changed layers found by the crawl '''
+        return self._data.get('changed_layers', [])
+
+    def add_changed_layers(self, keys):
+        ''' records the keys of new or changed layers; they are persisted by the next save '''
+        self._data['changed_layers'] = sorted(set(self.changed_layers).union(keys))
+
+    def is_done(self, type_name):
+        return self._data['types'].get(type_name, {}).get('done', False)
+
+    def next_url(self, type_name):
+        return self._data['types'].get(type_name, {}).get('next')
+
+    def page_done(self, type_name, next_url):
+        self._data['types'][type_name] = {
+            'next': next_url,
+            'done': next_url is None,
+        }
+        self.save()
+
+    def requeued(self):
+        self._data['requeue'] = False
+        self.save()
+
+    def failed(self, requeue):
+        self._data['requeue'] = requeue
+        self.save()
+
+    def save(self):
+        self._data['updated'] = datetime.utcnow().strftime(DATE_FORMAT)
+        state.save(state.make_key('checkpoint', self.source_id), self._data)
+
+    def clear(self):
+        state.clear(state.make_key('checkpoint', self.source_id))
@@ -1,26 +1,54 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+import time
 
+from urllib.error import HTTPError
+from urllib.parse import urlencode
 from urllib.request import urlopen
 
-from ckanext.geonode.harvesters import GeoNodeType
+from ckanext.geonode.harvesters import GeoNodeType, metrics
+from ckanext.geonode.harvesters.ratelimit import get_limiter, get_retry_after
 
 log = logging.getLogger(__name__)
 
+DEFAULT_TIMEOUT = 60  # seconds
+
+# how long the detected GeoNode version is reused by the clients of the same instance
+VERSION_CACHE_TTL = 3600  # seconds
+
 
 class GeoNodeClient(object):
 
-    def __init__(self, baseurl):
+    def __init__(self, baseurl, fields=None, retries=3, backoff=1.0, concurrency=None, timeout=DEFAULT_TIMEOUT):
+        '''
+        :param fields: optional list of the resource fields to be requested to the API;
+                       all the fields are returned if None
+        :param retries: how many times a failed API request is retried
+        :param backoff: seconds to wait before the first retry; the delay is doubled at each retry
+        :param concurrency: initial concurrency of the limiter shared by the requests to the GeoNode host
+        :param timeout: timeout of each request, in seconds
+        '''
         self.baseurl = baseurl.rstrip('/')
-        self.version = self._check_version()
-        log.info(f'GeoNode version is {self.version}')
+        self.fields = fields
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = get_limiter(self.baseurl, concurrency)
+        # bytes of the API responses read by this client
+        self.received_bytes = 0
+        # number of API requests retried by this client
+        self.retried = 0
+        self.version = get_cached_version(self.baseurl)
+        if self.version is None:
+            self.version = self._check_version()
+            cache_version(self.baseurl, self.version)
+            log.info(f'GeoNode version is {self.version}')
 
     def _check_version(self):
         url = f'{self.baseurl}/api/v2/'
         log.debug('Checking GeoNode version at %s', url)
-        response = urlopen(url).read()
-        json_content = json.loads(response)
+        json_content = self._get_json(url)
         return '3' if 'layers' in json_content else '4'
 
     def get_maps(self):
@@ -34,31 +62,77 @@ class GeoNodeClient(object):
 
     def get_resources(self, res_type: GeoNodeType):
         ''' return geonode resource json '''
+        for page, _ in self.get_pages(res_type):
+            for res in page:
+                yield res
+
+    def get_pages(self, res_type: GeoNodeType, start_url=None):
+        '''
+        return the geonode resources json, one list per API page, along with the URL of the next page
+
+        :param start_url: URL of the first page to be retrieved, as returned by a previous call
+        '''
 
         # adjust model according to version
         if res_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.DATASET_TYPE):
             res_type = GeoNodeType.LAYER_TYPE if self.version == '3' else GeoNodeType.DATASET_TYPE
 
-        url = f'{self.baseurl}/api/v2/{res_type.api_path}/'
+        url = start_url or self.get_list_url(res_type)
 
         while True:
             log.debug('Retrieving %s at GeoNode URL %s', res_type.api_path, url)
-            response = urlopen(url).read()
-            json_content = json.loads(response)
+            json_content = self._get_json(url)
 
             url = json_content['links']['next']
 
             objects = json_content[res_type.json_resource_list]
             for res in objects:
-                lid = res['pk']
-                luuid = res['uuid']
-                ltitle = res['title']
-                log.info(f'Found {res_type.json_resource_type} {luuid} id:{lid} "{ltitle}"')
-                yield res
+                log.debug(f'Found {res_type.json_resource_type} {res["uuid"]} id:{res["pk"]} "{res["title"]}"')
+            yield objects, url
 
             if url is None:
                 break
 
+    def get_total(self, res_type: GeoNodeType):
+        '''
+        Returns the number of resources of the given type, as reported by the API (None if not available)
+        '''
+        if res_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.DATASET_TYPE):
+            res_type = GeoNodeType.LAYER_TYPE if self.version == '3' else GeoNodeType.DATASET_TYPE
+
+        params = [('page_size', 1), ('exclude[]', '*'), ('include[]', 'pk')]
+        return self._get_json(f'{self.baseurl}/api/v2/{res_type.api_path}/?{urlencode(params)}').get('total')
+
+    def get_list_url(self, res_type: GeoNodeType):
+        url = f'{self.baseurl}/api/v2/{res_type.api_path}/'
+        if self.fields:
+            # sparse fieldset: exclude everything but the requested fields
+            params = [('exclude[]', '*')] + [('include[]', field) for field in self.fields]
+            url = f'{url}?{urlencode(params)}'
+        return url
+
+    def _get_json(self, url):
+        attempt = 0
+        while True:
+            try:
+                with self.limiter.request(), metrics.timer('api_request', host=self.limiter.host) as timer:
+                    response = urlopen(url, timeout=self.timeout).read()
+                    timer.bytes = len(response)
+                self.received_bytes += len(response)
+                return json.loads(response)
+            except (OSError, ValueError) as e:
+                if isinstance(e, HTTPError) and e.code < 500 and e.code != 429:
+                    # client error, no point in retrying
+                    raise
+                if attempt >= self.retries:
+                    raise
+                retry_after = get_retry_after(e) if isinstance(e, HTTPError) else None
+                delay = max(self.backoff * 2 ** attempt, retry_after or 0)
+                attempt = attempt + 1
+                self.retried += 1
+                log.warning(f'Error retrieving {url}: {e}; retry {attempt}/{self.retries} in {delay}s')
+                time.sleep(delay)
+
 
     # def get_layer_json(self, id):
     #     return self._get_resource_json(id, RESTYPE_LAYER)
@@ -91,5 +165,18 @@ class GeoNodeClient(object):
         log.debug('Retrieve blob data for document #%d', id)
 
         url = f'{self.baseurl}/documents/{id}/download'
-        response = urlopen(url)
-        return response.read()
+        with self.limiter.request():
+            response = urlopen(url, timeout=self.timeout)
+            return response.read()
+
+
+_versions = {}
+
+
+def get_cached_version(baseurl):
+    version, expiry = _versions.get(baseurl, (None, 0))
+    return version if expiry > time.monotonic() else None
+
+
+def cache_version(baseurl, version):
+    _versions[baseurl] = (version, time.monotonic() + VERSION_CACHE_TTL)
@@ -0,0 +1,96 @@
+import json
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from ckan import model, plugins as p
+
+from ckanext.geonode.harvesters.mappers.dynamic import _validate_group
+
+log = logging.getLogger(__name__)
+
+# how long the result of a group validation is reused
+GROUP_CACHE_TTL = 300  # seconds
+
+CONTEXT_CACHE_SIZE = 128
+
+
+class HarvestContext(object):
+    """
+    State of the harvest of a source: its parsed config, the harvesting user and some caches.
+
+    GeoNodeHarvester is a singleton, so all the per-source state is kept here and passed
+    explicitly to each call. Contexts are shared between threads: the config must not be modified,
+    and the caches are protected by a lock.
+    """
+
+    def __init__(self, source_id, config):
+        self.source_id = source_id
+        self.config = config
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def is_valid_group(self, name):
+        '''
+        Returns True if the group exists in CKAN; the answer is cached for GROUP_CACHE_TTL seconds
+        '''
+        now = time.monotonic()
+        with self._lock:
+            cached = self._groups.get(name)
+        if cached and cached[1] > now:
+            return cached[0]
+
+        valid = _validate_group(name)
+        with self._lock:
+            self._groups[name] = (valid, now + GROUP_CACHE_TTL)
+        return valid
+
+    @property
+    def user_name(self):
+        return get_user()[0]
+
+    @property
+    def ignore_auth(self):
+        user_name, site_user_name = get_user()
+        return user_name == site_user_name
+
+
+def get_context(source):
+    '''
+    Returns the HarvestContext for the given harvest source, reused as long as its config does not change
+    '''
+    return _get_context(source.id, source.config or '')
+
+
+@lru_cache(maxsize=CONTEXT_CACHE_SIZE)
+def _get_context(source_id, config_str):
+    config = json.loads(config_str) if config_str else {}
+    log.debug('Using config: %r' % config)
+    return HarvestContext(source_id, config)
+
+
+_user = None
+_user_lock = threading.Lock()
+
+
+def get_user():
+    '''
+    Returns the name of the user that will perform the harvesting actions
+    (deleting, updating and creating datasets), along with the name of the site user.
+
+    By default this will be the internal site admin user. This is the
+    recommended setting, but if necessary it can be overridden with the
+    `ckanext.spatial.harvest.user_name` config option, eg to support the
+    old hardcoded 'harvest' user:
+
+       ckanext.spatial.harvest.user_name = harvest
+
+    '''
+    global _user
+    with _user_lock:
+        if _user is None:
+            site_user = p.toolkit.get_action('get_site_user')({'model': model, 'ignore_auth': True}, {})
+            config_user_name = p.toolkit.config.get('ckanext.spatial.harvest.user_name')
+            _user = (config_user_name or site_user['name'], site_user['name'])
+        return _user
@@ -0,0 +1,45 @@
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+# JSON list of the keys of the layers used by a map
+EXTRA_DEPENDENCIES = 'dependencies'
+# set on a map object whose content did not change, but one of its layers did
+EXTRA_DEPENDENCY_CHANGED = 'dependency_changed'
+# alternate name of a layer object, used to find the layers referenced by GeoNode 3 maps
+EXTRA_ALTERNATE = 'alternate'
+
+
+def layer_keys(layer):
+    '''
+    Returns the keys a map may use to reference the given layer (or dataset) resource: its uuid and its alternate
+    '''
+    return [key for key in (layer.get('uuid'), layer.get('alternate')) if key]
+
+
+def map_dependencies(geomap):
+    '''
+    Returns the sorted keys of the layers used by a map resource, read from
+    `maplayers` (GeoNode 3 and 4) and `datasets` (GeoNode 4).
+    A layer is referenced by its uuid when available, else by its alternate name.
+    '''
+    keys = set()
+    for maplayer in geomap.get('maplayers') or []:
+        dataset = maplayer.get('dataset') or {}
+        key = dataset.get('uuid') or dataset.get('alternate') or maplayer.get('name')
+        if key:
+            keys.add(key)
+    for dataset in geomap.get('datasets') or []:
+        key = dataset.get('uuid') or dataset.get('alternate')
+        if key:
+            keys.add(key)
+    return sorted(keys)
+
+
+def encode(keys):
+    return json.dumps(keys)
+
+
+def decode(value):
+    return json.loads(value) if value else []
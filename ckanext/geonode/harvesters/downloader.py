@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 
-from ckanext.geonode.harvesters import utils
+from ckanext.geonode.harvesters import utils, aioclient, metrics
 from ckanext.geonode.harvesters.client import GeoNodeClient
 
 from cgi import FieldStorage
 import os
 import logging
 from io import StringIO
+from urllib.parse import urlparse
 
 log = logging.getLogger(__name__)
 
@@ -39,14 +40,20 @@ class Downloader(object):
 
 class GeonodeDataDownloader(Downloader):
 
-    def __init__(self, url, doc_id, filename):
+    def __init__(self, url, doc_id, filename, async_client=False):
         self.url = url
         self.doc_id = doc_id
         self.filename = filename
+        self.async_client = async_client
 
     def download(self, _file_unused):
-        client = GeoNodeClient(self.url)
-        doc_content = client.get_document_download(self.doc_id)
+        with metrics.timer('document_download', host=urlparse(self.url).netloc) as timer:
+            if self.async_client:
+                client = aioclient.SyncGeoNodeClient(self.url)
+            else:
+                client = GeoNodeClient(self.url)
+            doc_content = client.get_document_download(self.doc_id)
+            timer.bytes = len(doc_content)
 
         log.info('Downloaded document "%s" (size %d)', self.filename, len(doc_content))
 
@@ -57,14 +64,20 @@ class GeonodeDataDownloader(Downloader):
 
 class WFSCSVDownloader(Downloader):
 
-    def __init__(self, url, typename, filename):
+    def __init__(self, url, typename, filename, async_client=False):
         self.url = url
         self.typename = typename
         self.filename = filename
+        self.async_client = async_client
 
     def download(self, file):
 
-        utils.load_wfs_getfeatures(self.url, self.typename, outputfile=file)
+        with metrics.timer('wfs_download', host=urlparse(self.url).netloc) as timer:
+            if self.async_client:
+                aioclient.load_wfs_getfeatures_sync(self.url, self.typename, outputfile=file)
+            else:
+                utils.load_wfs_getfeatures(self.url, self.typename, outputfile=file)
+            timer.bytes = self._file_size(file)
         log.info('Downloaded document "%s" (size %d)', self.filename, self._file_size(file))
 
         storage = MockFieldStorage(self.filename, datafile=file)
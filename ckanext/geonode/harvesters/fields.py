@@ -0,0 +1,190 @@
+import json
+import logging
+from functools import lru_cache
+
+from jmespath import parser
+
+from ckanext.geonode.harvesters import (
+    CONFIG_GROUP_MAPPING,
+    CONFIG_GROUP_MAPPING_FIELDNAME,
+    CONFIG_IMPORT_FIELDS,
+    CONFIG_INCLUDE_ALL_LINKS,
+)
+
+log = logging.getLogger(__name__)
+p = parser.Parser()
+
+# Paths read by the client, by the harvester and by the static mappers
+# (mappers/base.py, mappers/dcatapit.py, model/types.py).
+# Nested keys are separated by dots; lists are transparent, so 'keywords.name'
+# selects the 'name' of each item in the 'keywords' list.
+BASE_PATHS = (
+    # client and harvester
+    'pk', 'uuid', 'title', 'resource_type', 'alternate',
+    # map dependencies
+    'maplayers.name', 'maplayers.dataset.uuid', 'maplayers.dataset.alternate', 'datasets.uuid', 'datasets.alternate',
+    # parse_common
+    'abstract', 'name', 'purpose', 'keywords.name',
+    'owner.first_name', 'owner.last_name', 'owner.username',
+    'poc.first_name', 'poc.last_name', 'poc.username',
+    'metadata_author.first_name', 'metadata_author.last_name', 'metadata_author.username',
+    'supplemental_information', 'temporal_extent_start', 'temporal_extent_end',
+    'doi', 'date', 'date_type', 'srid', 'thumbnail_url', 'll_bbox_polygon.coordinates',
+    # parse_layer / parse_map
+    'detail_url', 'link', 'embed_url', 'storeType', 'subtype',
+    # parse_dcatapit_info
+    'tkeywords.name', 'tkeywords.thesaurus.uri', 'tkeywords.i18n',
+    'last_updated', 'regions.name', 'regions.code', 'language', 'maintenance_frequency',
+)
+
+# Paths only needed when include_all_links is set
+LINKS_PATHS = (
+    'links.extension', 'links.link_type', 'links.mime', 'links.name', 'links.url',
+)
+
+
+def required_paths(config: dict):
+    '''
+    Returns the set of paths (as tuples of keys) of a GeoNode resource that are needed by
+    the mapping configured in the source config, or None if the whole resource is needed.
+    '''
+    paths = set(tuple(path.split('.')) for path in BASE_PATHS)
+
+    if config.get(CONFIG_INCLUDE_ALL_LINKS, False):
+        paths.update(tuple(path.split('.')) for path in LINKS_PATHS)
+
+    for field in config.get(CONFIG_IMPORT_FIELDS, []):
+        paths.add((field,))
+
+    if CONFIG_GROUP_MAPPING in config:
+        paths.add((config[CONFIG_GROUP_MAPPING_FIELDNAME],))
+
+    for rule in config.get('dynamic_mapping', []):
+        expressions = list(rule['filters'])
+        expressions.extend(action['source'] for action in rule['actions'] if 'source' in action)
+        for expression in expressions:
+            needed = set()
+            _need(needed, _walk(p.parse(expression).parsed, (), needed))
+            if () in needed:
+                log.debug('Expression "%s" needs the whole resource', expression)
+                return None
+            paths.update(needed)
+
+    return _minimize(paths)
+
+
+def api_fields(config: dict):
+    '''
+    Returns the sorted list of the top level fields to be requested to the GeoNode API,
+    or None if the whole resource is needed.
+    '''
+    paths = required_paths(config)
+    if paths is None:
+        return None
+    return sorted(set(path[0] for path in paths))
+
+
+def get_projection(config: dict):
+    '''
+    Returns the projection tree for the given source config, or None if the whole
+    resource is needed.
+
+    The tree is computed once for each distinct config.
+    '''
+    return _cached_projection(json.dumps(config, sort_keys=True))
+
+
+@lru_cache(maxsize=64)
+def _cached_projection(config_str):
+    paths = required_paths(json.loads(config_str))
+    if paths is None:
+        return None
+
+    # nested dicts of keys; None means the whole value is needed
+    tree = {}
+    for path in paths:
+        node = tree
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = None
+    return tree
+
+
+def project(value, tree):
+    '''
+    Trims a GeoNode resource (or any part of it) to the keys in the projection tree.
+    Lists are projected item by item; missing keys are not created.
+    '''
+    if tree is None:
+        return value
+    if isinstance(value, dict):
+        return {k: project(v, tree[k]) for k, v in value.items() if k in tree}
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    return value
+
+
+def _minimize(paths):
+    # drop the paths that are already covered by a shorter one
+    minimized = set()
+    for path in sorted(paths, key=len):
+        if not any(path[:i] in minimized for i in range(1, len(path) + 1)):
+            minimized.add(path)
+    return minimized
+
+
+def _need(needed, path):
+    if path is not None:
+        needed.add(path)
+
+
+def _walk(node, base, needed):
+    '''
+    Walks a JMESPath AST node evaluated against the value found at path `base`.
+    Paths whose whole content is used are added to `needed`.
+
+    Returns the path of the value the node evaluates to, or None if the node evaluates
+    to a computed value (literal, boolean, function result, ...).
+    '''
+    ntype = node['type']
+    children = node['children']
+
+    if base is None:
+        # evaluating against a computed value: nothing more is read from the resource
+        return None
+
+    if ntype == 'field':
+        return base + (node['value'],)
+    elif ntype in ('current', 'identity', 'index', 'slice'):
+        return base
+    elif ntype == 'literal':
+        return None
+    elif ntype in ('subexpression', 'index_expression', 'pipe', 'projection'):
+        # the right side is evaluated against the result of the left side
+        # (lists are transparent in our paths)
+        left = _walk(children[0], base, needed)
+        return _walk(children[1], left, needed)
+    elif ntype == 'filter_projection':
+        left = _walk(children[0], base, needed)
+        _need(needed, _walk(children[2], left, needed))
+        return _walk(children[1], left, needed)
+    elif ntype == 'flatten':
+        return _walk(children[0], base, needed)
+    elif ntype == 'value_projection':
+        # values of an object with unknown keys: the whole object is needed
+        _need(needed, _walk(children[0], base, needed))
+        return None
+    elif ntype == 'key_val_pair':
+        return _walk(children[0], base, needed)
+    elif ntype in ('comparator', 'and_expression', 'or_expression', 'not_expression',
+                   'multi_select_list', 'multi_select_dict', 'function_expression'):
+        # expressions references (as in sort_by(list, &field)) are evaluated on the items
+        # of the other arguments, which are fully required anyway
+        for child in children:
+            if child['type'] != 'expref':
+                _need(needed, _walk(child, base, needed))
+        return None
+    else:
+        log.warning('Unknown JMESPath node type "%s", requiring the whole value', ntype)
+        _need(needed, base)
+        return None
@@ -2,11 +2,16 @@ import json
 import shapely
 import shapely.wkt as wkt
 import logging
+import threading
+import time
 import uuid
 from tempfile import SpooledTemporaryFile
 from string import Template
 from datetime import datetime
 
+from sqlalchemy import and_, or_, exists
+from sqlalchemy.orm import aliased
+
 from ckan import logic
 from ckan.logic import NotFound, get_action
 from ckan import model
@@ -19,25 +24,54 @@ from ckanext.geonode.harvesters.utils import tags_trimmer
 
 from ckanext.harvest.interfaces import IHarvester
 from ckanext.harvest.harvesters.base import HarvesterBase
-from ckanext.harvest.model import HarvestObject, HarvestObjectExtra as HOExtra
+from ckanext.harvest.model import HarvestJob, HarvestObject, HarvestObjectExtra as HOExtra
+from ckanext.harvest.queue import get_fetch_publisher
 
+from ckanext.geonode.harvesters.checkpoint import Checkpoint
 from ckanext.geonode.harvesters.client import GeoNodeClient
-from ckanext.geonode.harvesters.mappers.base import parse
+from ckanext.geonode.harvesters.context import get_context
+from ckanext.geonode.harvesters.mappers.base import parse, finalize, get_bbox, get_extent
+from ckanext.geonode.harvesters.progress import GatherProgress, import_log
+from ckanext.geonode.harvesters.report import GatherReport
 from ckanext.geonode.harvesters.downloader import GeonodeDataDownloader, WFSCSVDownloader
 from ckanext.geonode.harvesters import (
     CONFIG_GEOSERVERURL, CONFIG_IMPORT_FIELDS, CONFIG_KEYWORD_MAPPING, CONFIG_GROUP_MAPPING,
-    CONFIG_GROUP_MAPPING_FIELDNAME, CONFIG_INCLUDE_ALL_LINKS, CONFIG_IMPORT_TYPES,
+    CONFIG_GROUP_MAPPING_FIELDNAME, CONFIG_INCLUDE_ALL_LINKS, CONFIG_IMPORT_TYPES, CONFIG_SPARSE_FIELDS,
+    CONFIG_PROJECT_CONTENT, CONFIG_CONTENT_COMPRESSION, CONFIG_CONTENT_DEDUP, CONFIG_PIPELINED_GATHER,
+    CONFIG_RESUMABLE_GATHER, CONFIG_MAX_QUEUED_OBJECTS, CONFIG_MAX_OBJECTS_PER_JOB, CONFIG_MAX_GATHER_SECONDS, CONFIG_MAX_RETRIES, CONFIG_RETRY_BACKOFF, CONFIG_CONCURRENCY, CONFIG_ASYNC_CLIENT,
+    CONFIG_PROFILE_SAMPLE_RATE, CONFIG_PROFILE_SLOWEST, CONFIG_RECORD_SNAPSHOT, CONFIG_REPLAY_SNAPSHOT,
     GeoNodeType,
     RESOURCE_DOWNLOADER, TEMP_FILE_THRESHOLD_SIZE,
     DEFAULT_HARVEST_TYPES_LIST,
 )
 
 import ckanext.geonode.harvesters.mappers.dynamic as dynamic
+import ckanext.geonode.harvesters.fields as fields
+import ckanext.geonode.harvesters.storage as storage
+import ckanext.geonode.harvesters.aioclient as aioclient
+import ckanext.geonode.harvesters.dependencies as dependencies
+import ckanext.geonode.harvesters.metrics as metrics
+import ckanext.geonode.harvesters.profiling as profiling
+import ckanext.geonode.harvesters.report as report
+import ckanext.geonode.harvesters.snapshot as snapshot
 
 
 log = logging.getLogger(__name__)
 config = p.toolkit.config
 
+DELETE_BATCH_SIZE = 1000
+
+# Import priority of the harvest objects (lower first), stored in the EXTRA_PRIORITY extra
+EXTRA_PRIORITY = 'priority'
+PRIORITY_NEW = 0
+PRIORITY_CHANGED = 1
+PRIORITY_DELETE = 2
+PRIORITY_UNCHANGED = 3
+
+# Import order of the types within a priority: the maps read the harvest objects of their layers
+TYPE_ORDER_LAYER = 0
+TYPE_ORDER_OTHER = 1
+
 
 class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
     """
@@ -45,11 +79,18 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
     """
     implements(IHarvester)
 
-    _user_name = None
-
-    source_config = {}
     geoserver_url = None
 
+    # config of the source handled by each thread, only kept for the deprecated `source_config` attribute
+    _current = threading.local()
+
+    @property
+    def source_config(self):
+        '''
+        Deprecated: the config of the source whose job or object is handled by the calling thread.
+        Use `get_context(source).config` instead.
+        '''
+        return getattr(self._current, 'config', {})
 
     def info(self):
         return {
@@ -95,6 +136,62 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
                                lambda x: x in (GeoNodeType.get_config_names()))
             self.check_mapping(CONFIG_INCLUDE_ALL_LINKS, source_config_obj, bool)
 
+            if CONFIG_CONTENT_COMPRESSION in source_config_obj:
+                storage.check_compression(source_config_obj[CONFIG_CONTENT_COMPRESSION])
+
+            for key in (CONFIG_SPARSE_FIELDS, CONFIG_PROJECT_CONTENT, CONFIG_CONTENT_DEDUP,
+                        CONFIG_PIPELINED_GATHER, CONFIG_RESUMABLE_GATHER, CONFIG_ASYNC_CLIENT, CONFIG_RECORD_SNAPSHOT):
+                if key in source_config_obj:
+                    if not isinstance(source_config_obj[key], bool):
+                        raise ValueError('%s should be either true or false' % key)
+
+            if source_config_obj.get(CONFIG_ASYNC_CLIENT, False):
+                aioclient.check_available()
+
+            if CONFIG_MAX_RETRIES in source_config_obj:
+                if type(source_config_obj[CONFIG_MAX_RETRIES]) != int or source_config_obj[CONFIG_MAX_RETRIES] < 0:
+                    raise ValueError('%s should be a non negative integer' % CONFIG_MAX_RETRIES)
+
+            if CONFIG_MAX_OBJECTS_PER_JOB in source_config_obj:
+                if type(source_config_obj[CONFIG_MAX_OBJECTS_PER_JOB]) != int or \
+                        source_config_obj[CONFIG_MAX_OBJECTS_PER_JOB] < 1:
+                    raise ValueError('%s should be a positive integer' % CONFIG_MAX_OBJECTS_PER_JOB)
+
+            if CONFIG_MAX_GATHER_SECONDS in source_config_obj:
+                if not isinstance(source_config_obj[CONFIG_MAX_GATHER_SECONDS], (int, float)) or \
+                        source_config_obj[CONFIG_MAX_GATHER_SECONDS] <= 0:
+                    raise ValueError('%s should be a positive number' % CONFIG_MAX_GATHER_SECONDS)
+
+            if CONFIG_MAX_QUEUED_OBJECTS in source_config_obj:
+                if type(source_config_obj[CONFIG_MAX_QUEUED_OBJECTS]) != int or \
+                        source_config_obj[CONFIG_MAX_QUEUED_OBJECTS] < 1:
+                    raise ValueError('%s should be a positive integer' % CONFIG_MAX_QUEUED_OBJECTS)
+
+            if CONFIG_PROFILE_SAMPLE_RATE in source_config_obj:
+                if not isinstance(source_config_obj[CONFIG_PROFILE_SAMPLE_RATE], (int, float)) or \
+                        not 0 <= source_config_obj[CONFIG_PROFILE_SAMPLE_RATE] <= 1:
+                    raise ValueError('%s should be a number between 0 and 1' % CONFIG_PROFILE_SAMPLE_RATE)
+
+            if CONFIG_PROFILE_SLOWEST in source_config_obj:
+                if type(source_config_obj[CONFIG_PROFILE_SLOWEST]) != int or \
+                        source_config_obj[CONFIG_PROFILE_SLOWEST] < 1:
+                    raise ValueError('%s should be a positive integer' % CONFIG_PROFILE_SLOWEST)
+
+            if CONFIG_CONCURRENCY in source_config_obj:
+                if type(source_config_obj[CONFIG_CONCURRENCY]) != int or source_config_obj[CONFIG_CONCURRENCY] < 1:
+                    raise ValueError('%s should be a positive integer' % CONFIG_CONCURRENCY)
+
+            if CONFIG_RETRY_BACKOFF in source_config_obj:
+                if not isinstance(source_config_obj[CONFIG_RETRY_BACKOFF], (int, float)):
+                    raise ValueError('%s should be a number' % CONFIG_RETRY_BACKOFF)
+
+            if CONFIG_REPLAY_SNAPSHOT in source_config_obj:
+                if not isinstance(source_config_obj[CONFIG_REPLAY_SNAPSHOT], str):
+                    raise ValueError('%s should be the path of a snapshot file' % CONFIG_REPLAY_SNAPSHOT)
+                if source_config_obj.get(CONFIG_RECORD_SNAPSHOT, False):
+                    raise ValueError('%s and %s can not be used together' % (CONFIG_RECORD_SNAPSHOT,
+                                                                            CONFIG_REPLAY_SNAPSHOT))
+
             if CONFIG_GROUP_MAPPING in source_config_obj and CONFIG_GROUP_MAPPING_FIELDNAME not in source_config_obj:
                 raise ValueError('%s needs also %s to be defined', CONFIG_GROUP_MAPPING, CONFIG_GROUP_MAPPING_FIELDNAME)
 
@@ -123,98 +220,455 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
                 if type(v) != datatype:
                     raise ValueError('%s values should be %r' % (key, datatype))
 
-    def gather_stage(self, harvest_job):
+    def gather_stage(self, harvest_job, source_config=None):
+        '''
+        :param source_config: parsed config replacing the one of the source (e.g. for the bulk harvest)
+        '''
+        # the metrics recorded by this process during the gather are summarized for the job
+        metrics_before = metrics.registry.snapshot()
+        started = time.perf_counter()
+        gather_report = GatherReport()
+        self._current.config = source_config if source_config is not None else \
+            get_context(harvest_job.source).config
+
+        try:
+            object_ids = self._gather(harvest_job, gather_report, source_config)
+        finally:
+            gather_report.save(harvest_job)
+
+        metrics.observe('gather', time.perf_counter() - started, source=harvest_job.source.id)
+        job_metrics = metrics.diff(metrics_before, metrics.registry.snapshot())
+        metrics.save_job_metrics(harvest_job, job_metrics)
+        metrics.flush(force=True)
+        log.info(f'Gather metrics: {metrics.summarize(job_metrics)}')
+
+        return object_ids
+
+    def _gather(self, harvest_job, gather_report, source_config=None):
         log = logging.getLogger(__name__ + '.geonode.gather')
         log.debug('GeoNode gather_stage for job: %r', harvest_job)
         # Get source URL
         url = harvest_job.source.url
 
-        self._set_source_config(harvest_job.source.config)
+        if source_config is None:
+            source_config = get_context(harvest_job.source).config
+
+        # In pipelined mode the objects are sent to the fetch queue as soon as each API page is processed,
+        # so they can be imported while the crawl goes on
+        pipelined = source_config.get(CONFIG_PIPELINED_GATHER, False)
+        publisher = get_fetch_publisher() if pipelined else None
+        # quota of the objects of the source waiting to be imported, so that a big source does not fill the queue:
+        # when it is exceeded the gather ends, and the next job continues the crawl
+        max_queued = source_config.get(CONFIG_MAX_QUEUED_OBJECTS) if pipelined else None
+
+        # A job may be limited to a slice of the catalogue; the crawl goes on in the next jobs
+        max_objects = source_config.get(CONFIG_MAX_OBJECTS_PER_JOB)
+        max_seconds = source_config.get(CONFIG_MAX_GATHER_SECONDS)
+        gather_started = time.monotonic()
+        sliced = False
+
+        # The pagination state is persisted after each page, so that a failed or sliced gather
+        # can be continued by the next job
+        checkpoint = None
+        if source_config.get(CONFIG_RESUMABLE_GATHER, False) or max_objects or max_seconds or max_queued:
+            config_hash = storage.content_hash(url + json.dumps(source_config, sort_keys=True))
+            checkpoint = Checkpoint.start(harvest_job, config_hash)
+        # the objects gathered since the crawl started are the ones seen by it
+        crawl_started = checkpoint.started if checkpoint else datetime.utcnow()
+        progress = None
+        client = None
+        # a snapshot is kept only if it contains the whole catalogue
+        resumed = recorded = False
 
         try:
             log.info('Connecting to GeoNode at %s', url)
 
-            query = model.Session.query(HarvestObject.guid, HarvestObject.package_id). \
-                filter(HarvestObject.current == True). \
-                filter(HarvestObject.harvest_source_id == harvest_job.source.id)
-
-            guid_to_package_id = {}
-            for guid, package_id in query:
-                guid_to_package_id[guid] = package_id
-
-            guids_in_db = list(guid_to_package_id.keys())
-
-            ho_ids = []
-
-            client = GeoNodeClient(url)
-
-            # dict guid: layer
-            harvested = []
-
+            # The current objects are looked up page by page, and the deletions are computed in the DB
+            # at the end of the crawl, so the memory used does not depend on the catalogue size
+            # (except for the list of ids to be returned when not in pipelined mode)
+            # The objects are queued by priority: new ones, then changed ones (layers before the other types,
+            # then most recently updated first), then deletions, then the ones with unchanged content.
+            # (priority, type order, last_updated, id) of the objects to be returned
+            queued = []
+            # ids of the unchanged objects, only sent at the end of the crawl in pipelined mode
+            deferred = []
+
+            client = self._get_client(url, source_config)
+            if source_config.get(CONFIG_RECORD_SNAPSHOT, False):
+                client = snapshot.RecordingClient(client, snapshot.get_snapshot_path(harvest_job.source.id))
+            throttled_before = client.limiter.throttled_count
+
+            # projection of the stored content
+            projection = None
+            if source_config.get(CONFIG_PROJECT_CONTENT, False):
+                projection = fields.get_projection(source_config)
+
+            compression = source_config.get(CONFIG_CONTENT_COMPRESSION, storage.COMPRESSION_NONE)
+            dedup = source_config.get(CONFIG_CONTENT_DEDUP, False)
+            cnt_dedup = 0
+
+            cnt_harvested = 0
             cnt_upd = 0
             cnt_add = 0
 
+            if checkpoint and checkpoint.requeue:
+                # the objects gathered by the failed jobs have never been queued
+                requeued = self._requeue_objects(checkpoint.previous_job_ids, harvest_job)
+                if publisher:
+                    for ho_id, _ in requeued:
+                        publisher.send({'harvest_object_id': ho_id})
+                else:
+                    queued.extend((priority, TYPE_ORDER_LAYER, '', ho_id) for ho_id, priority in requeued)
+                checkpoint.requeued()
+                cnt_harvested = cnt_harvested + len(requeued)
+                gather_report.requeued = len(requeued)
+                log.info(f'Requeued {len(requeued)} objects gathered by previous jobs')
+
             # choose the types to be harvested
-            harvest_types_list :list = DEFAULT_HARVEST_TYPES_LIST
+            harvest_types_list = self._get_harvest_types(source_config)
 
-            if CONFIG_IMPORT_TYPES in self.source_config:
-                # if import config is there, only import defined types
-                import_types = self.source_config[CONFIG_IMPORT_TYPES]
-                harvest_types_names = [cname for cname in import_types if import_types[cname]]
-                log.warning(f"IMPORT TYPES {harvest_types_names}")
-                harvest_types_list = [GeoNodeType.get_by_config_name(cname) for cname in harvest_types_names]
+            totals = [client.get_total(t) for t in harvest_types_list
+                      if not (checkpoint and checkpoint.is_done(t.config_name))]
+            progress = GatherProgress(harvest_job, None if None in totals else sum(totals))
+            progress.publish()
+            received_bytes = client.received_bytes
+
+            # keys of the new or changed layers
+            changed_layers = set(checkpoint.changed_layers) if checkpoint else set()
+
+            if max_queued and self._is_queue_full(harvest_job, max_queued, 0):
+                # the objects of the previous jobs are still waiting to be imported
+                log.info(f'More than {max_queued} objects of the source are queued, postponing the crawl')
+                sliced = True
 
             # harvest each configured type
             for geonode_type in harvest_types_list:
-                for obj in client.get_resources(geonode_type):
-                    uuid = obj['uuid']
-                    doc = json.dumps(obj)
-                    if uuid in guids_in_db:
-                        ho = HarvestObject(guid=uuid, job=harvest_job, content=doc,
-                                           package_id=guid_to_package_id[uuid],
-                                           extras=[HOExtra(key='status', value='change')])
-                        action = 'UPDATE'
-                        cnt_upd = cnt_upd + 1
+                if sliced:
+                    break
+                start_url = None
+                if checkpoint:
+                    if checkpoint.is_done(geonode_type.config_name):
+                        log.info(f'Skipping {geonode_type.config_name}, already gathered')
+                        continue
+                    start_url = checkpoint.next_url(geonode_type.config_name)
+                    resumed = resumed or start_url is not None
+
+                for page, next_url in client.get_pages(geonode_type, start_url=start_url):
+                    page_entries = []
+                    # guid: (id, package_id, content hash) of the current objects in this page
+                    previous = self._get_current_objects(harvest_job.source.id, [obj['uuid'] for obj in page])
+                    page_changed_layers = set()
+                    type_order = TYPE_ORDER_LAYER \
+                        if geonode_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.DATASET_TYPE) else TYPE_ORDER_OTHER
+                    for obj in page:
+                        uuid = obj['uuid']
+                        doc = json.dumps(fields.project(obj, projection))
+                        doc_hash = storage.content_hash(doc)
+                        ref_id = None
+                        if uuid in previous:
+                            prev_id, prev_package_id, prev_hash = previous[uuid]
+                            priority = PRIORITY_UNCHANGED if prev_hash == doc_hash else PRIORITY_CHANGED
+                            if dedup and prev_hash == doc_hash:
+                                # same content as the current object: only store a reference to it
+                                content = storage.encode_ref(prev_id)
+                                ref_id = prev_id
+                                cnt_dedup = cnt_dedup + 1
+                                gather_report.dedup += 1
+                            else:
+                                content = storage.encode(doc, compression)
+                            status = 'change'
+                            result = 'unchanged' if priority == PRIORITY_UNCHANGED else 'changed'
+                            action = 'UPDATE'
+                            cnt_upd = cnt_upd + 1
+                        else:
+                            prev_package_id = None
+                            priority = PRIORITY_NEW
+                            content = storage.encode(doc, compression)
+                            status = 'new'
+                            result = 'new'
+                            action = 'ADD'
+                            cnt_add = cnt_add + 1
+
+                        ho_extras = [HOExtra(key='status', value=status),
+                                     HOExtra(key=storage.EXTRA_CONTENT_HASH, value=doc_hash)]
+                        if ref_id:
+                            # the referenced object must not be pruned
+                            ho_extras.append(HOExtra(key=storage.EXTRA_CONTENT_REF, value=ref_id))
+                        if geonode_type == GeoNodeType.MAP_TYPE:
+                            layer_keys = dependencies.map_dependencies(obj)
+                            if layer_keys:
+                                ho_extras.append(HOExtra(key=dependencies.EXTRA_DEPENDENCIES,
+                                                         value=dependencies.encode(layer_keys)))
+                                if priority == PRIORITY_UNCHANGED and changed_layers.intersection(layer_keys):
+                                    # the map did not change, but some of its layers did
+                                    priority = PRIORITY_CHANGED
+                                    result = 'dependency_changed'
+                                    ho_extras.append(HOExtra(key=dependencies.EXTRA_DEPENDENCY_CHANGED, value='true'))
+                        elif geonode_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.DATASET_TYPE):
+                            if obj.get('alternate'):
+                                # GeoNode 3 maps reference their layers by alternate name
+                                ho_extras.append(HOExtra(key=dependencies.EXTRA_ALTERNATE, value=obj['alternate']))
+                            if priority != PRIORITY_UNCHANGED:
+                                page_changed_layers.update(dependencies.layer_keys(obj))
+                        ho_extras.append(HOExtra(key=EXTRA_PRIORITY, value=str(priority)))
+
+                        ho = HarvestObject(guid=uuid, job=harvest_job, content=content,
+                                           package_id=prev_package_id, extras=ho_extras)
+                        with metrics.timer('object_write', source=harvest_job.source.id) as timer:
+                            ho.save()
+                            timer.bytes = len(content)
+                        page_entries.append((priority, type_order, obj.get('last_updated') or '', ho.id))
+                        cnt_harvested = cnt_harvested + 1
+                        gather_report.add_object(geonode_type.config_name, result)
+                        log.debug(f'Queued {geonode_type.config_name} uuid {uuid} for {action}')
+
+                    if publisher:
+                        deferred.extend(entry[-1] for entry in page_entries if entry[0] == PRIORITY_UNCHANGED)
+                        page_ids = self._sort_by_priority(
+                            [entry for entry in page_entries if entry[0] != PRIORITY_UNCHANGED])
+                        # objects are already committed, so they can be fetched right away
+                        for ho_id in page_ids:
+                            publisher.send({'harvest_object_id': ho_id})
+                        log.debug(f'Sent {len(page_ids)} {geonode_type.config_name} to the fetch queue')
                     else:
-                        ho = HarvestObject(guid=uuid, job=harvest_job, content=doc,
-                                           extras=[HOExtra(key='status', value='new')])
-                        action = 'ADD'
-                        cnt_add = cnt_add + 1
-
-                    ho.save()
-                    ho_ids.append(ho.id)
-                    harvested.append(uuid)
-                    log.info(f'Queued {geonode_type.config_name} uuid {uuid} for {action}')
+                        queued.extend(page_entries)
+
+                    progress.page_done(len(page), client.received_bytes)
+                    gather_report.add_page(geonode_type.config_name, client.received_bytes - received_bytes)
+                    received_bytes = client.received_bytes
+
+                    changed_layers.update(page_changed_layers)
+                    if checkpoint:
+                        checkpoint.add_changed_layers(page_changed_layers)
+                        checkpoint.page_done(geonode_type.config_name, next_url)
+
+                    if (max_objects and cnt_harvested >= max_objects) or \
+                            (max_seconds and time.monotonic() - gather_started >= max_seconds):
+                        sliced = True
+                        break
+                    # the deferred objects are waiting too, but they have not been sent
+                    if max_queued and self._is_queue_full(harvest_job, max_queued, len(deferred)):
+                        log.info(f'More than {max_queued} objects of the source are queued, '
+                                 f'the next job will continue the crawl')
+                        sliced = True
+                        break
+
+            # the budget may have been reached on the last page
+            sliced = sliced and not all(checkpoint.is_done(t.config_name) for t in harvest_types_list)
+            recorded = not (sliced or resumed)
 
         except Exception as e:
             self._save_gather_error('Error harvesting GeoNode: %s' % e, harvest_job)
+            if publisher:
+                for ho_id in deferred:
+                    publisher.send({'harvest_object_id': ho_id})
+            if checkpoint:
+                # in pipelined mode the objects have already been queued
+                checkpoint.failed(requeue=not pipelined)
+            if progress:
+                progress.publish('failed')
+            gather_report.status = 'failed'
             return None
-
-        delete = set(guids_in_db) - set(harvested)
-
-        log.info(f'Found {len(harvested)} objects,  {cnt_add} new, {cnt_upd} to update, {len(delete)} to remove')
-
-        for guid in delete:
-            ho = HarvestObject(guid=guid, job=harvest_job,
-                               package_id=guid_to_package_id[guid],
-                               extras=[HOExtra(key='status', value='delete')])
+        finally:
+            if publisher:
+                publisher.close()
+            if client:
+                gather_report.retries = client.retried
+                gather_report.throttled = client.limiter.throttled_count - throttled_before
+            if isinstance(client, snapshot.RecordingClient):
+                client.close(complete=recorded)
+
+        if sliced:
+            # deletions can only be computed when the whole catalogue has been crawled
+            log.info(f'Job budget reached: found {cnt_harvested} objects, {cnt_add} new, {cnt_upd} to update; '
+                     f'the next job will continue the crawl')
+            progress.publish('sliced')
+            gather_report.status = 'sliced'
+            return self._sort_by_priority(queued) + deferred
+
+        # Deletions are computed when the whole catalogue has been crawled;
+        # in pipelined mode only the deleted and the deferred objects are returned to be queued
+        cnt_del = 0
+        while True:
+            # current objects not seen in this crawl; they are flagged as not current once processed,
+            # so each query returns the next batch
+            delete = self._get_unseen_objects(harvest_job, crawl_started, DELETE_BATCH_SIZE)
+            if not delete:
+                break
             model.Session.query(HarvestObject). \
-                filter_by(guid=guid). \
+                filter(HarvestObject.guid.in_([guid for guid, _ in delete])). \
                 update({'current': False}, False)
-            ho.save()
-            ho_ids.append(ho.id)
+            for guid, package_id in delete:
+                ho = HarvestObject(guid=guid, job=harvest_job,
+                                   package_id=package_id,
+                                   extras=[HOExtra(key='status', value='delete'),
+                                           HOExtra(key=EXTRA_PRIORITY, value=str(PRIORITY_DELETE))])
+                with metrics.timer('object_write', source=harvest_job.source.id):
+                    ho.save()
+                queued.append((PRIORITY_DELETE, TYPE_ORDER_OTHER, '', ho.id))
+            cnt_del = cnt_del + len(delete)
+
+        if checkpoint:
+            checkpoint.clear()
+        progress.publish('finished')
+        gather_report.status = 'finished'
+        gather_report.deleted = cnt_del
 
-        if len(harvested) == 0 and len(delete) == 0:
+        log.info(f'Found {cnt_harvested} objects,  {cnt_add} new, {cnt_upd} to update, {cnt_del} to remove')
+        if dedup:
+            log.info(f'{cnt_dedup} objects stored as references to the previous content')
+
+        if cnt_harvested == 0 and cnt_del == 0:
             self._save_gather_error('No records received from GeoNode', harvest_job)
             return None
 
-        return ho_ids
+        return self._sort_by_priority(queued) + deferred
+
+    def _get_client(self, url, source_config):
+        '''
+        Returns the GeoNode API client configured by the source config
+        '''
+        api_fields = None
+        if source_config.get(CONFIG_SPARSE_FIELDS, False):
+            api_fields = fields.api_fields(source_config)
+            log.info('Requesting fields %s', api_fields if api_fields else 'ALL')
+
+        if source_config.get(CONFIG_REPLAY_SNAPSHOT):
+            log.info('Replaying snapshot %s', source_config[CONFIG_REPLAY_SNAPSHOT])
+            return snapshot.ReplayGeoNodeClient(source_config[CONFIG_REPLAY_SNAPSHOT], fields=api_fields)
+
+        client_class = aioclient.SyncGeoNodeClient if source_config.get(CONFIG_ASYNC_CLIENT, False) \
+            else GeoNodeClient
+        return client_class(url, fields=api_fields,
+                            retries=source_config.get(CONFIG_MAX_RETRIES, 3),
+                            backoff=source_config.get(CONFIG_RETRY_BACKOFF, 1.0),
+                            concurrency=source_config.get(CONFIG_CONCURRENCY))
+
+    def _get_harvest_types(self, source_config) -> list:
+        '''
+        Returns the GeoNode types to be harvested, in gather order
+        '''
+        if CONFIG_IMPORT_TYPES not in source_config:
+            return DEFAULT_HARVEST_TYPES_LIST
+
+        # if import config is there, only import defined types
+        import_types = source_config[CONFIG_IMPORT_TYPES]
+        harvest_types_names = [cname for cname in import_types if import_types[cname]]
+        log.warning(f"IMPORT TYPES {harvest_types_names}")
+        # layers are always gathered before maps, to find the maps using changed layers
+        return [t for t in DEFAULT_HARVEST_TYPES_LIST if t.config_name in harvest_types_names]
+
+    def _sort_by_priority(self, entries):
+        '''
+        Returns the ids of the given (priority, type order, last_updated, id) entries, by priority,
+        then by type order (layers before the maps using them) and then by most recent update
+        '''
+        entries = sorted(entries, key=lambda entry: entry[2], reverse=True)
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+        return [ho_id for _, _, _, ho_id in entries]
+
+    def _get_current_objects(self, source_id, guids):
+        '''
+        Returns a dict guid: (id, package_id, content hash) of the current objects with the given guids
+        '''
+        query = model.Session.query(HarvestObject.guid, HarvestObject.id,
+                                    HarvestObject.package_id, HOExtra.value). \
+            outerjoin(HOExtra, and_(HOExtra.harvest_object_id == HarvestObject.id,
+                                    HOExtra.key == storage.EXTRA_CONTENT_HASH)). \
+            filter(HarvestObject.current == True). \
+            filter(HarvestObject.harvest_source_id == source_id). \
+            filter(HarvestObject.guid.in_(guids))
+
+        return {guid: (ho_id, package_id, content_hash) for guid, ho_id, package_id, content_hash in query}
+
+    def _get_unseen_objects(self, harvest_job, since, limit):
+        '''
+        Returns (guid, package_id) of at most `limit` current objects of the source
+        whose guid has not been gathered since the given time.
+
+        The gather time is used instead of the job, since the objects found unchanged by the
+        import stage are moved to the job of the previous object.
+        '''
+        seen = aliased(HarvestObject)
+        query = model.Session.query(HarvestObject.guid, HarvestObject.package_id). \
+            filter(HarvestObject.current == True). \
+            filter(HarvestObject.harvest_source_id == harvest_job.source.id). \
+            filter(~exists().where(and_(seen.harvest_source_id == harvest_job.source.id,
+                                        seen.guid == HarvestObject.guid,
+                                        seen.gathered >= since))). \
+            limit(limit)
+
+        return query.all()
+
+    def _is_queue_full(self, harvest_job, max_queued, unsent):
+        '''
+        True if at least `max_queued` objects of the source of the job (besides the `unsent` ones
+        not yet sent to the queue) are waiting to be fetched or imported
+
+        Only the objects of the unfinished jobs are counted: the ones left behind by a failed gather or
+        a crashed consumer are not in the queue, and would otherwise block the source forever.
+        '''
+        queued = model.Session.query(HarvestObject). \
+            join(HarvestJob, HarvestObject.harvest_job_id == HarvestJob.id). \
+            filter(HarvestObject.harvest_source_id == harvest_job.source.id). \
+            filter(HarvestJob.status.in_(('New', 'Running'))). \
+            filter(HarvestObject.state.in_(('WAITING', 'FETCH', 'IMPORT'))). \
+            count() - unsent
+        return queued >= max_queued
+
+    def _requeue_objects(self, job_ids, harvest_job):
+        '''
+        Moves the objects still waiting in the given jobs to the current job, and returns their (id, priority)
+        '''
+        model.Session.query(HarvestObject). \
+            filter(HarvestObject.harvest_job_id.in_(job_ids)). \
+            filter(HarvestObject.state == 'WAITING'). \
+            update({'harvest_job_id': harvest_job.id}, False)
+        model.Session.commit()
+
+        query = model.Session.query(HarvestObject.id, HOExtra.value). \
+            outerjoin(HOExtra, and_(HOExtra.harvest_object_id == HarvestObject.id,
+                                    HOExtra.key == EXTRA_PRIORITY)). \
+            filter(HarvestObject.harvest_job_id == harvest_job.id). \
+            filter(HarvestObject.state == 'WAITING')
+        return [(ho_id, int(priority) if priority else PRIORITY_UNCHANGED) for ho_id, priority in query]
 
     def fetch_stage(self, harvest_object):
 
         return True  # objects fetched in gather stage
 
-    def import_stage(self, harvest_object):
+    def import_stage(self, harvest_object, mapped=None):
+        '''
+        :param mapped: the (package_dict, extras) returned by `map_content` for the object, if already mapped
+        '''
+        started = time.perf_counter()
+        metrics_before = metrics.registry.snapshot()
+        # the unchanged objects are moved to the job of the previous object by the import
+        harvest_job_id = harvest_object.harvest_job_id if harvest_object else None
+
+        if harvest_object:
+            self._current.config = get_context(harvest_object.source).config
+            with profiling.profile_import(harvest_object, self._current.config):
+                result = self._import_object(harvest_object, mapped)
+        else:
+            result = self._import_object(harvest_object)
+
+        if harvest_object:
+            seconds = time.perf_counter() - started
+            metrics.observe('import', seconds, source=harvest_object.source.id)
+            HOExtra(harvest_object_id=harvest_object.id, key=metrics.EXTRA_IMPORT_SECONDS,
+                    value=f'{seconds:.3f}').save()
+            download_bytes = report.get_download_bytes(metrics_before, metrics.registry.snapshot())
+            if download_bytes:
+                HOExtra(harvest_object_id=harvest_object.id, key=report.EXTRA_DOWNLOAD_BYTES,
+                        value=str(download_bytes)).save()
+            report.object_imported(harvest_job_id, harvest_object, result)
+        metrics.flush()
+        import_log.object_done(result)
+
+        return result
+
+    def _import_object(self, harvest_object, mapped=None):
 
         log = logging.getLogger(__name__ + '.import')
         log.debug('Import stage for harvest object: %s' % harvest_object.id)
@@ -223,7 +677,7 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
             log.error('No harvest object received')
             return False
 
-        self._set_source_config(harvest_object.source.config)
+        harvest_context = get_context(harvest_object.source)
 
         status = self._get_object_extra(harvest_object, 'status')
 
@@ -235,7 +689,7 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
 
         if status == 'delete':
             # Delete package
-            context = {'model': model, 'session': model.Session, 'user': self._get_user_name()}
+            context = {'model': model, 'session': model.Session, 'user': harvest_context.user_name}
 
             p.toolkit.get_action('package_delete')(context, {'id': harvest_object.package_id})
             log.info('Deleted package {0} with guid {1}'.format(harvest_object.package_id, harvest_object.guid))
@@ -250,10 +704,7 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
             # Check if metadata was modified
             # GeoNode does not offer a "latest modified date".
             # Let's compare if any value changed
-            content_old = previous_object.content
-            content_new = harvest_object.content
-
-            is_modified = content_old != content_new
+            is_modified = self._is_modified(previous_object, harvest_object)
             prev_job_id = previous_object.job.id
         else:
             is_modified = True
@@ -265,7 +716,7 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
                                     .format(harvest_object.id), harvest_object, 'Import')
             return False
 
-        log.error('Object GUID:%s is modified: %s' % (harvest_object.guid, is_modified))
+        log.debug('Object GUID:%s is modified: %s' % (harvest_object.guid, is_modified))
 
         # Let's set the metadata date according to the import time. Not the best choice, since
         # we'd like to set the original metadata date.
@@ -273,8 +724,34 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
         harvest_object.metadata_modified_date = datetime.now()
         harvest_object.add()
 
+        # Check if the document has changed, before building the package dict
+        if status == 'change' and not is_modified:
+            # Flag this object as the current one
+            harvest_object.current = True
+
+            # Assign the previous job id to the new object to
+            # avoid losing history
+            harvest_object.harvest_job_id = prev_job_id
+            harvest_object.add()
+
+            harvest_object.metadata_modified_date = previous_object.metadata_modified_date
+
+            # The content may be a reference to the object that is going to be deleted
+            storage.resolve_ref(harvest_object)
+
+            # Delete the previous object to avoid cluttering the object table
+            previous_object.delete()
+
+            log.debug('Document with GUID %s unchanged, skipping...', harvest_object.guid)
+            model.Session.commit()
+            return "unchanged"
+
         # Build the package dict
-        package_dict = self.get_package_dict(harvest_object)
+        with metrics.timer('mapping', source=harvest_object.source.id):
+            if mapped is None:
+                package_dict = self.get_package_dict(harvest_object, harvest_context)
+            else:
+                package_dict = self._finalize_package_dict(harvest_object, *mapped, harvest_context)
         if not package_dict:
             log.error('No package dict returned, aborting import for object {0}'.format(harvest_object.id))
             return False
@@ -283,11 +760,11 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
 
         context = {'model': model,
                    'session': model.Session,
-                   'user': self._get_user_name(),
+                   'user': harvest_context.user_name,
                    'extras_as_string': True,
                    'api_version': '2',
                    'return_id_only': True}
-        if context['user'] == self._site_user['name']:
+        if harvest_context.ignore_auth:
             context['ignore_auth'] = True
 
         # The default package schema does not like Upper case tags
@@ -320,49 +797,45 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
             try:
                 # package_id = p.toolkit.get_action('package_create')(context, package_dict)
                 package_id = self._create_package(context, package_dict, harvest_object)
-                log.info('Created new package %s with guid %s' % (package_id, harvest_object.guid))
+                log.debug('Created new package %s with guid %s' % (package_id, harvest_object.guid))
                 self._post_package_create(package_id, harvest_object)
             except p.toolkit.ValidationError as e:
                 self._save_object_error('Validation Error: %s' % str(e.error_summary), harvest_object, 'Import')
                 return False
 
         elif status == 'change':
+            package_schema = logic.schema.default_update_package_schema()
+            package_schema['tags'] = tag_schema
+            context['schema'] = package_schema
 
-            # Check if the document has changed
-
-            if not is_modified:
+            package_dict['id'] = harvest_object.package_id
+            try:
+                # package_id = p.toolkit.get_action('package_update')(context, package_dict)
+                package_id = self._update_package(context, package_dict, harvest_object)
+                log.debug('Updated package %s with guid %s', package_id, harvest_object.guid)
+                self._post_package_update(package_id, harvest_object)
+            except p.toolkit.ValidationError as e:
+                self._save_object_error('Validation Error: %s' % str(e.error_summary), harvest_object, 'Import')
+                return False
 
-                # Assign the previous job id to the new object to
-                # avoid losing history
-                harvest_object.harvest_job_id = prev_job_id
-                harvest_object.add()
+        model.Session.commit()
 
-                harvest_object.metadata_modified_date = previous_object.metadata_modified_date
+        return True
 
-                # Delete the previous object to avoid cluttering the object table
-                previous_object.delete()
+    def _is_modified(self, previous_object, harvest_object):
+        if self._get_object_extra(harvest_object, dependencies.EXTRA_DEPENDENCY_CHANGED):
+            return True
 
-                log.info('Document with GUID %s unchanged, skipping...', harvest_object.guid)
-                model.Session.commit()
-                return "unchanged"
-            else:
-                package_schema = logic.schema.default_update_package_schema()
-                package_schema['tags'] = tag_schema
-                context['schema'] = package_schema
-
-                package_dict['id'] = harvest_object.package_id
-                try:
-                    # package_id = p.toolkit.get_action('package_update')(context, package_dict)
-                    package_id = self._update_package(context, package_dict, harvest_object)
-                    log.info('Updated package %s with guid %s', package_id, harvest_object.guid)
-                    self._post_package_update(package_id, harvest_object)
-                except p.toolkit.ValidationError as e:
-                    self._save_object_error('Validation Error: %s' % str(e.error_summary), harvest_object, 'Import')
-                    return False
+        if storage.get_ref(harvest_object.content) == previous_object.id:
+            return False
 
-        model.Session.commit()
+        hash_old = self._get_object_extra(previous_object, storage.EXTRA_CONTENT_HASH)
+        hash_new = self._get_object_extra(harvest_object, storage.EXTRA_CONTENT_HASH)
+        if hash_old and hash_new:
+            return hash_old != hash_new
 
-        return True
+        # objects harvested before the hash was stored
+        return storage.load_content(previous_object) != storage.load_content(harvest_object)
 
     def _create_package(self, context, package_dict, harvest_object):
 
@@ -380,7 +853,8 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
         if len(normal_resources):
             package_dict['resources'] = normal_resources
 
-        package_id = p.toolkit.get_action('package_create')(context, package_dict)
+        with metrics.timer('package_write', source=harvest_object.source.id):
+            package_id = p.toolkit.get_action('package_create')(context, package_dict)
 
         # Handle data downloads
         for resource in downloadable_resources:
@@ -393,7 +867,8 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
 
                 resource['upload'] = fieldStorage
                 log.info('Create resource %s in package %s', resource['name'], package_id)
-                created_resource = p.toolkit.get_action('resource_create')(context, resource)
+                with metrics.timer('resource_write', source=harvest_object.source.id):
+                    created_resource = p.toolkit.get_action('resource_create')(context, resource)
                 log.debug('Added resource %s to package %s with uuid %s', resource['name'], package_id,
                           created_resource['id'])
 
@@ -418,7 +893,8 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
         if len(normal_resources):
             package_dict['resources'] = normal_resources
 
-        package_id = p.toolkit.get_action('package_update')(context, package_dict)
+        with metrics.timer('package_write', source=harvest_object.source.id):
+            package_id = p.toolkit.get_action('package_update')(context, package_dict)
 
         # Handle data downloads
 
@@ -437,13 +913,14 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
                 fieldStorage = downloader.download(f)
                 resource['upload'] = fieldStorage
                 log.info('Create resource %s in package %s', resource['name'], package_id)
-                created_resource = p.toolkit.get_action('resource_create')(context, resource)
+                with metrics.timer('resource_write', source=harvest_object.source.id):
+                    created_resource = p.toolkit.get_action('resource_create')(context, resource)
                 log.debug('Added resource %s to package %s with uuid %s', resource['name'], package_id,
                           created_resource['id'])
 
         return package_id
 
-    def get_package_dict(self, harvest_object):
+    def get_package_dict(self, harvest_object, harvest_context=None):
         '''
         Constructs a package_dict suitable to be passed to package_create or
         package_update.
@@ -453,14 +930,96 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
         :param harvest_object: HarvestObject domain object (with access to job and source objects)
         :type harvest_object: HarvestObject
 
+        :param harvest_context: the state of the harvest of the object source; loaded if not given
+        :type harvest_context: HarvestContext
+
         :returns: A dataset dictionary (package_dict)
         :rtype: dict
         '''
+        if harvest_context is None:
+            harvest_context = get_context(harvest_object.source)
+
+        package_dict, extras = parse(harvest_object, harvest_context.config,
+                                     group_validator=harvest_context.is_valid_group)
+        self._add_dependency_extras(harvest_object, extras)
+        self._addExtras(package_dict, extras)
+        return package_dict
+
+    def map_objects(self, harvest_objects, pool):
+        '''
+        Constructs the package dicts of a batch of harvest objects (with content) of the same source.
+
+        The contents are mapped in the given MappingPool, while the steps needing the CKAN model
+        (group validation, package name, owner) run in this process.
+        Objects that can not be mapped get an import error.
+
+        :returns: a list of package dicts (or None), in the same order as the harvest objects
+        '''
+        if not harvest_objects:
+            return []
+
+        harvest_context = get_context(harvest_objects[0].source)
+        contents = [storage.load_content(ho) for ho in harvest_objects]
+
+        package_dicts = []
+        for harvest_object, (package_dict, extras, error) in zip(harvest_objects,
+                                                                   pool.map(contents, harvest_context.config)):
+            if error:
+                self._save_object_error(error, harvest_object, 'Import')
+                package_dict = None
+            else:
+                package_dict = self._finalize_package_dict(harvest_object, package_dict, extras, harvest_context)
+            package_dicts.append(package_dict)
 
-        package_dict, extras = parse(harvest_object, self.source_config)
+        return package_dicts
+
+    def _finalize_package_dict(self, harvest_object, package_dict, extras, harvest_context):
+        '''
+        Completes the output of `map_content` with the info requiring the CKAN model
+        '''
+        if package_dict is None:
+            return None
+        package_dict, extras = finalize(harvest_object, package_dict, extras,
+                                        group_validator=harvest_context.is_valid_group)
+        self._add_dependency_extras(harvest_object, extras)
         self._addExtras(package_dict, extras)
         return package_dict
 
+    def _add_dependency_extras(self, harvest_object, extras):
+        '''
+        Adds to the extras of a map the info about the layers it uses, read from their harvest objects:
+        the layer titles (`geonode_layers`) and their combined extent (`geonode_layers_extent`).
+
+        The objects gathered by the same job are preferred to the current ones, since they may
+        not have been imported yet; the layers are matched by guid or by alternate name.
+        '''
+        layer_keys = dependencies.decode(self._get_object_extra(harvest_object, dependencies.EXTRA_DEPENDENCIES))
+        if not layer_keys:
+            return
+
+        layers = {}
+        alternate = aliased(HOExtra)
+        query = model.Session.query(HarvestObject, alternate.value). \
+            outerjoin(alternate, and_(alternate.harvest_object_id == HarvestObject.id,
+                                      alternate.key == dependencies.EXTRA_ALTERNATE)). \
+            filter(HarvestObject.harvest_source_id == harvest_object.source.id). \
+            filter(or_(HarvestObject.current == True,
+                       HarvestObject.harvest_job_id == harvest_object.harvest_job_id)). \
+            filter(or_(HarvestObject.guid.in_(layer_keys), alternate.value.in_(layer_keys))). \
+            filter(HarvestObject.content != None). \
+            order_by(HarvestObject.gathered)
+        # the most recently gathered object of each layer wins
+        for layer_object, alternate_name in query:
+            key = layer_object.guid if layer_object.guid in layer_keys else alternate_name
+            layers[key] = json.loads(storage.load_content(layer_object))
+
+        # layers not harvested are listed by their key
+        extras['geonode_layers'] = [layers[key].get('title', key) if key in layers else key for key in layer_keys]
+
+        bbox_polys = [layer['ll_bbox_polygon'] for layer in layers.values() if layer.get('ll_bbox_polygon')]
+        if bbox_polys:
+            extras['geonode_layers_extent'] = get_extent(*get_bbox(bbox_polys))
+
     def _post_package_create(self, package_id, harvest_object):
         pass
 
@@ -478,28 +1037,6 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
 
         package_dict['extras'] = extras_as_dict
 
-    def _set_source_config(self, config_str):
-        '''
-        Loads the source configuration JSON object into a dict for
-        convenient access
-        '''
-        if config_str:
-            self.source_config = json.loads(config_str)
-            log.debug('Using config: %r' % self.source_config)
-        else:
-            self.source_config = {}
-
-    def _get_config_value(self, key, default):
-        if key in self.source_config:
-            # trivial heuristics
-            if 'true' == self.source_config[key]:
-                return True
-            if 'false' == self.source_config[key]:
-                return False
-            return self.source_config[key]
-        else:
-            return default
-
     def _get_object_extra(self, harvest_object, key):
         '''
         Helper function for retrieving the value from a harvest object extra,
@@ -509,29 +1046,3 @@ class GeoNodeHarvester(HarvesterBase, SingletonPlugin):
             if extra.key == key:
                 return extra.value
         return None
-
-    def _get_user_name(self):
-        '''
-        Returns the name of the user that will perform the harvesting actions
-        (deleting, updating and creating datasets)
-
-        By default this will be the internal site admin user. This is the
-        recommended setting, but if necessary it can be overridden with the
-        `ckanext.spatial.harvest.user_name` config option, eg to support the
-        old hardcoded 'harvest' user:
-
-           ckanext.spatial.harvest.user_name = harvest
-
-        '''
-        if self._user_name:
-            return self._user_name
-
-        self._site_user = p.toolkit.get_action('get_site_user')({'model': model, 'ignore_auth': True}, {})
-
-        config_user_name = config.get('ckanext.spatial.harvest.user_name')
-        if config_user_name:
-            self._user_name = config_user_name
-        else:
-            self._user_name = self._site_user['name']
-
-        return self._user_name
@@ -3,10 +3,8 @@ import logging
 from string import Template
 
 
-from ckan.logic import NotFound, get_action
 from ckan import model, plugins as p
 from ckan.plugins.toolkit import _
-from ckan.model import Session
 
 from ckanext.harvest.harvesters import HarvesterBase
 from ckanext.harvest.model import HarvestObject
@@ -17,10 +15,11 @@ from ckanext.geonode.harvesters import (
     CONFIG_IMPORT_FIELDS,
 
     GEONODE_JSON_TYPE,
-    GeoNodeType, CONFIG_INCLUDE_ALL_LINKS,
+    GeoNodeType, CONFIG_INCLUDE_ALL_LINKS, NAME_FALLBACK,
 )
 from ckanext.geonode.harvesters.mappers.dcatapit import parse_dcatapit_info
-from ckanext.geonode.harvesters.mappers.dynamic import parse_dynamic
+from ckanext.geonode.harvesters.mappers.dynamic import parse_dynamic, _validate_group
+from ckanext.geonode.harvesters.storage import load_content
 from ckanext.geonode.harvesters.utils import format_date
 from ckanext.geonode.model.types import Layer, Map, Doc, GeoNodeResource
 
@@ -28,26 +27,75 @@ from ckanext.geonode.model.types import Layer, Map, Doc, GeoNodeResource
 log = logging.getLogger(__name__)
 
 
-def parse(harvest_object, config):
-    json_dict = json.loads(harvest_object.content)
+def parse(harvest_object, config, group_validator=None):
+    package_dict, extras = map_content(load_content(harvest_object), config)
+    if package_dict is None:
+        return None, None
+    return finalize(harvest_object, package_dict, extras, group_validator=group_validator)
+
+
+def map_content(content, config):
+    '''
+    Maps the JSON content of a GeoNode resource into a (package_dict, extras) tuple.
+
+    This is the pure part of the mapping: it does not access the CKAN model nor call any action,
+    so it can run in a separate process. The groups are not validated and the package name
+    and owner are not set: `finalize` must be called on the result.
+    '''
+    json_dict = json.loads(content) if isinstance(content, str) else content
     res_type = json_dict[GEONODE_JSON_TYPE]
     parsed_type = GeoNodeType.parse_by_json_resource_type(res_type)
 
     if parsed_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.DATASET_TYPE):
-        return parse_layer(harvest_object, harvest_object.content, config)
+        return parse_layer(json_dict, config)
     elif parsed_type == GeoNodeType.MAP_TYPE:
-        return parse_map(harvest_object, harvest_object.content, config)
+        return parse_map(json_dict, config)
     elif parsed_type == GeoNodeType.DOC_TYPE:
-        return parse_doc(harvest_object, harvest_object.content, config)
+        return parse_doc(json_dict, config)
     else:
         log.error('Unknown GeoNode type %s' % res_type)
         return None, None
 
 
-def parse_layer(harvest_object, json_layer, config):
+def finalize(harvest_object, package_dict, extras, group_validator=None):
+    '''
+    Completes the output of `map_content` with the info requiring the CKAN model:
+    validates the groups, sets the owner organization and the package name.
+
+    :param group_validator: function telling whether a group name exists (default: a group_show call)
+    '''
+    package_dict['groups'] = validate_groups(package_dict['groups'], group_validator or _validate_group)
+
+    # We need to get the owner organization (if any) from the harvest
+    # source dataset
+    source_dataset = model.Package.get(harvest_object.source.id)
+    if source_dataset.owner_org:
+        package_dict['owner_org'] = source_dataset.owner_org
+
+    # Package name
+    fallback_name = package_dict.pop(NAME_FALLBACK, None)
+    package = harvest_object.package
+    if package is None or package.title != package_dict['title']:
+        name = HarvesterBase._gen_new_name(package_dict['title'])
+        if not name and fallback_name:
+            name = HarvesterBase._gen_new_name(fallback_name)
+        if not name:
+            raise Exception(
+                'Could not generate a unique name from the title or the resource name. '
+                'Please choose a more unique title.')
+        package_dict['name'] = name
+    else:
+        package_dict['name'] = package.name
+
+    extras['guid'] = harvest_object.guid
+
+    return package_dict, extras
+
+
+def parse_layer(json_layer, config):
     # log.debug(f'get_layer_package_dict --> {json_layer}')
     layer = Layer(json_layer)
-    package_dict, extras = parse_common(harvest_object, layer, config)
+    package_dict, extras = parse_common(layer, config)
 
     for resource in [
         {
@@ -82,9 +130,9 @@ def parse_layer(harvest_object, json_layer, config):
     return package_dict, extras
 
 
-def parse_map(harvest_object, json_map, config):
+def parse_map(json_map, config):
     geomap = Map(json_map)
-    package_dict, extras = parse_common(harvest_object, geomap, config)
+    package_dict, extras = parse_common(geomap, config)
 
     # Add main view
     for resource in (
@@ -117,9 +165,9 @@ def parse_map(harvest_object, json_map, config):
 
     return package_dict, extras
 
-def parse_doc(harvest_object, json_map, config):
+def parse_doc(json_map, config):
     doc = Doc(json_map)
-    package_dict, extras = parse_common(harvest_object, doc, config)
+    package_dict, extras = parse_common(doc, config)
 
     # # Add resource
     # resource = {}
@@ -141,11 +189,9 @@ def parse_doc(harvest_object, json_map, config):
     return package_dict, extras
 
 
-def parse_common(harvest_object, georesource: GeoNodeResource, config: dict) -> dict:
+def parse_common(georesource: GeoNodeResource, config: dict) -> dict:
     '''
     Create a package dict for a generic GeoNode resource
-    :param harvest_object: HarvestObject domain object (with access to job and source objects)
-    :type harvest_object: HarvestObject
 
     :param georesource: a resource (Layer or Map) from GeoNode
     :type georesource: a GeoResource (Map or Layer)
@@ -161,7 +207,7 @@ def parse_common(harvest_object, georesource: GeoNodeResource, config: dict) ->
         tags.append({'name': tag})
 
     # Infer groups
-    groups = handle_groups(harvest_object, georesource, config)
+    groups = handle_groups(georesource, config)
 
     resources = []
     pos = 0
@@ -192,31 +238,14 @@ def parse_common(harvest_object, georesource: GeoNodeResource, config: dict) ->
         'groups': groups,
     }
 
-    # We need to get the owner organization (if any) from the harvest
-    # source dataset
-    source_dataset = model.Package.get(harvest_object.source.id)
-    if source_dataset.owner_org:
-        package_dict['owner_org'] = source_dataset.owner_org
-
-    # Package name
-    package = harvest_object.package
-    if package is None or package.title != georesource.title():
-        name = HarvesterBase._gen_new_name(georesource.title())
-        if not name:
-            name = HarvesterBase._gen_new_name(georesource.name())
-        if not name:
-            raise Exception(
-                'Could not generate a unique name from the title or the resource name. '
-                'Please choose a more unique title.')
-        package_dict['name'] = name
-    else:
-        package_dict['name'] = package.name
+    # used by finalize() if no name can be generated from the title
+    package_dict[NAME_FALLBACK] = georesource.get('name')
 
     # Frequency TODO
     package_dict['frequency'] = "UNKNOWN"
 
     extras = {
-        'guid': harvest_object.guid,
+        'guid': georesource.get('uuid'),
         'geonode_uuid': georesource.get('uuid'),
         'geonode_owner': georesource.owner(),
         'geonode_author': georesource.md_author(),
@@ -263,17 +292,9 @@ def parse_common(harvest_object, georesource: GeoNodeResource, config: dict) ->
         if georesource.thumbnail():
             extras['graphic-preview-file'] = georesource.thumbnail()
 
-        x0 = x1 = y0 = y1 = None
-
         bbox_poly = georesource.get('ll_bbox_polygon')
         if bbox_poly:
-            bbox_list = bbox_poly['coordinates']
-            for bbox in bbox_list:
-                for point in bbox:
-                    x0 = point[0] if x0 is None or x0 > point[0] else x0
-                    x1 = point[0] if x1 is None or x1 < point[0] else x1
-                    y0 = point[1] if y0 is None or y0 > point[1] else y0
-                    y1 = point[1] if y1 is None or y1 < point[1] else y1
+            x0, y0, x1, y1 = get_bbox([bbox_poly])
 
             extras['bbox-east-long'] = x1
             extras['bbox-north-lat'] = y1
@@ -281,31 +302,55 @@ def parse_common(harvest_object, georesource: GeoNodeResource, config: dict) ->
             extras['bbox-west-long'] = x0
 
             # Construct a GeoJSON extent so ckanext-spatial can register the extent geometry
-
-            # Some publishers define the same two corners for the bbox (ie a point),
-            # that causes problems in the search if stored as polygon
-            if x0 == x1 or y0 == y1:
-                log.warning(f'Point extent defined instead of polygon`')
-                extent_string = Template('{"type": "Point", "coordinates": [$x, $y]}').\
-                    substitute(x=x0, y=y0)
-            else:
-                extent_string = Template('{"type": "Polygon", '
-                                         '"coordinates": [['
-                                         '[$xmin, $ymin], [$xmax, $ymin], '
-                                         '[$xmax, $ymax], [$xmin, $ymax], '
-                                         '[$xmin, $ymin]]]}').\
-                    substitute(xmin=x0, ymin=y0, xmax=x1, ymax=y1)
-
-            extras['spatial'] = extent_string.strip()
+            extras['spatial'] = get_extent(x0, y0, x1, y1)
 
     package_dict, extras = parse_dcatapit_info(georesource, package_dict, extras)
-    package_dict, extras = parse_dynamic(config, georesource, package_dict, extras)
+    package_dict, extras = parse_dynamic(config, georesource, package_dict, extras, validate_groups=False)
 
     return package_dict, extras
 
 
-def handle_groups(harvest_object, georesource, config):
-    validated_groups = []
+def get_bbox(bbox_polys):
+    '''
+    Returns the (xmin, ymin, xmax, ymax) bounding box of a list of GeoJSON polygons
+    '''
+    x0 = x1 = y0 = y1 = None
+    for bbox_poly in bbox_polys:
+        for bbox in bbox_poly['coordinates']:
+            for point in bbox:
+                x0 = point[0] if x0 is None or x0 > point[0] else x0
+                x1 = point[0] if x1 is None or x1 < point[0] else x1
+                y0 = point[1] if y0 is None or y0 > point[1] else y0
+                y1 = point[1] if y1 is None or y1 < point[1] else y1
+    return x0, y0, x1, y1
+
+
+def get_extent(x0, y0, x1, y1):
+    '''
+    Returns the GeoJSON extent of a bounding box
+    '''
+    # Some publishers define the same two corners for the bbox (ie a point),
+    # that causes problems in the search if stored as polygon
+    if x0 == x1 or y0 == y1:
+        log.warning(f'Point extent defined instead of polygon`')
+        extent_string = Template('{"type": "Point", "coordinates": [$x, $y]}').\
+            substitute(x=x0, y=y0)
+    else:
+        extent_string = Template('{"type": "Polygon", '
+                                 '"coordinates": [['
+                                 '[$xmin, $ymin], [$xmax, $ymin], '
+                                 '[$xmax, $ymax], [$xmin, $ymax], '
+                                 '[$xmin, $ymin]]]}').\
+            substitute(xmin=x0, ymin=y0, xmax=x1, ymax=y1)
+
+    return extent_string.strip()
+
+
+def handle_groups(georesource, config):
+    '''
+    Returns the groups mapped from the `group_mapping` config; they are validated in `finalize`
+    '''
+    groups = []
 
     if CONFIG_GROUP_MAPPING in config:
         source_name = config[CONFIG_GROUP_MAPPING_FIELDNAME]
@@ -319,13 +364,22 @@ def handle_groups(harvest_object, georesource, config):
             if local_group:
                 # remote attribute is mapped to a group
                 log.info('Adding group %s ', local_group)
+                groups.append({'name': local_group})
 
-                try:
-                    context = {'model': model, 'session': Session, 'user': 'harvest'}
-                    data_dict = {'id': local_group}
-                    get_action('group_show')(context, data_dict)
-                    validated_groups.append({'name': local_group})
-                except NotFound:
-                    log.warning('Group %s is not available', local_group)
+    return groups
 
+
+def validate_groups(groups, group_validator=_validate_group):
+    '''
+    Returns the given groups that exist in CKAN, without duplicates
+    '''
+    validated_groups = []
+    names = set()
+    for group in groups:
+        name = group['name']
+        if name in names:
+            continue
+        names.add(name)
+        if group_validator(name):
+            validated_groups.append(group)
     return validated_groups
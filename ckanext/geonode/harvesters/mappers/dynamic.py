@@ -1,4 +1,5 @@
 import logging
+from functools import lru_cache
 
 import jmespath
 from jmespath import parser
@@ -64,31 +65,43 @@ def validate_config(config):
                     raise ValueError(f'Rule #{rule_idx}: "source" not parsable SOURCE:[{action["source"]}] ERR:[{str(e)}]')
 
 
-def parse_dynamic(config, obj, package_dict, extras):
+def parse_dynamic(config, obj, package_dict, extras, validate_groups=True):
+    '''
+    Applies the dynamic mapping rules to the package dict and extras.
+    If `validate_groups` is False, the groups are added without checking they exist in CKAN.
+    '''
     rules = config.get('dynamic_mapping', [])
 
     for rx, rule in enumerate(rules):
         if _evaluate_filters(rule['filters'], obj, rx):
             log.debug(f'Rule #{rx}: Filters passed for rule {rule}')
-            _apply_actions(rule['actions'], obj, package_dict, extras, rx)
+            _apply_actions(rule['actions'], obj, package_dict, extras, rx, validate_groups)
 
     return package_dict, extras
 
 
+@lru_cache(maxsize=1024)
+def compile_expression(expression):
+    '''
+    Returns the compiled JMESPath expression; compiled expressions are shared by all the sources and threads
+    '''
+    return jmespath.compile(expression)
+
+
 def _evaluate_filters(filters, obj, rx):
     # returns True if all filters are satisfied
     for filter in filters:
-        if not jmespath.search(filter, obj):
+        if not compile_expression(filter).search(obj):
             log.debug(f'Rule #{rx}: Filter failed: {filter}')
             return False
 
     return True
 
 
-def _apply_actions(actions, obj, package_dict, extras, rx):
+def _apply_actions(actions, obj, package_dict, extras, rx, validate_groups=True):
     for action in actions:
         if 'source' in action:
-            value = jmespath.search(action['source'], obj)
+            value = compile_expression(action['source']).search(obj)
             if not value:
                 log.debug(f'Rule #{rx}: Source selected no data: {action["source"]}')
                 continue
@@ -103,7 +116,7 @@ def _apply_actions(actions, obj, package_dict, extras, rx):
         else:
             raise ValueError(f'Rule #{rx}: Missing source info for action {action}')  # should not happen
         dst = action['destination']
-        set_value(value, dst, package_dict, extras, rx=rx)
+        set_value(value, dst, package_dict, extras, rx=rx, validate_groups=validate_groups)
 
 
 def _apply_mapping(mapping: dict, value, rx: int):
@@ -127,7 +140,7 @@ def _apply_single_mapping(mapping: dict, value, rx: int):
         return None
 
 
-def set_value(value, dst, package_dict, extras, rx=-1):
+def set_value(value, dst, package_dict, extras, rx=-1, validate_groups=True):
     if isinstance(value, str):
         values = [value]
     elif isinstance(value, list):
@@ -140,7 +153,7 @@ def set_value(value, dst, package_dict, extras, rx=-1):
         package_dict['tags'].extend([{'name': v} for v in values])
     elif dst == 'group':
         for g in values:
-            if _validate_group(g):
+            if not validate_groups or _validate_group(g):
                 package_dict['groups'].append({'name': g})
     else:
         set_extra(dst, value, extras)
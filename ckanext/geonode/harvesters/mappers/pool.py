@@ -0,0 +1,68 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from ckan.plugins import toolkit
+
+from ckanext.geonode.harvesters.mappers.base import map_content
+
+log = logging.getLogger(__name__)
+
+CONFIG_MAPPING_PROCESSES = 'ckanext.geonode.mapping_processes'
+
+# contents sent to a worker process at a time
+DEFAULT_CHUNKSIZE = 16
+
+
+class MappingPool(object):
+    """
+    Maps batches of GeoNode resources in a pool of worker processes.
+
+    Only the pure part of the mapping (`map_content`) runs in the workers: each result
+    must be completed by `finalize` in the parent process, which has access to the CKAN model.
+    """
+
+    def __init__(self, processes=None, chunksize=DEFAULT_CHUNKSIZE):
+        if not processes:
+            processes = toolkit.asint(toolkit.config.get(CONFIG_MAPPING_PROCESSES, 0)) or os.cpu_count() or 1
+        self.processes = processes
+        self.chunksize = chunksize
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def map(self, contents, config):
+        '''
+        Maps a list of JSON contents with the given source config.
+
+        :returns: a list of (package_dict, extras, error) in the same order as the contents;
+                  `error` is a message if the mapping failed, else None
+        '''
+        func = partial(_map_content, config=config)
+        if self.processes == 1 or len(contents) < 2:
+            return [func(content) for content in contents]
+
+        if self._executor is None:
+            log.debug('Starting %d mapping processes', self.processes)
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        chunksize = max(1, min(self.chunksize, len(contents) // self.processes))
+        return list(self._executor.map(func, contents, chunksize=chunksize))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def _map_content(content, config):
+    try:
+        package_dict, extras = map_content(content, config)
+        return package_dict, extras, None
+    except Exception as e:
+        log.exception('Error mapping content')
+        return None, None, f'Error mapping content: {e!r}'
@@ -0,0 +1,327 @@
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import Float, cast, func
+
+from ckan.model import Session
+from ckan.plugins import toolkit
+
+from ckanext.harvest.model import HarvestObject, HarvestObjectExtra as HOExtra
+
+import ckanext.geonode.harvesters.state as state
+
+log = logging.getLogger(__name__)
+
+CONFIG_METRICS_DIR = 'ckanext.geonode.metrics_dir'
+# bearer token allowing the scrapers to read the metrics endpoint without a sysadmin user
+CONFIG_METRICS_TOKEN = 'ckanext.geonode.metrics_token'
+
+# minimum seconds between two writes of the metrics file of a process
+FLUSH_INTERVAL = 10
+
+# metrics files not written for this long are merged into the compacted file and removed
+STALE_AFTER = 24 * 3600  # seconds
+COMPACTED_FILE = 'geonode-compacted.json'
+LOCK_FILE = '.lock'
+
+METRIC_PREFIX = 'ckanext_geonode'
+
+# duration of the import of a harvest object, in seconds
+EXTRA_IMPORT_SECONDS = 'import_seconds'
+
+# name, help and value index of the exported metrics
+METRICS = (
+    ('calls_total', 'Number of operations of the stage', 0),
+    ('seconds_total', 'Time spent in the stage, in seconds', 1),
+    ('bytes_total', 'Bytes transferred or stored by the stage', 2),
+)
+
+
+class Timer(object):
+    """
+    Returned by `Registry.timer`; the number of items and bytes processed can be set before the timer ends.
+    """
+    __slots__ = ('count', 'bytes')
+
+    def __init__(self):
+        self.count = 1
+        self.bytes = 0
+
+
+class Registry(object):
+    """
+    Thread safe accumulator of the count, duration and bytes of the harvest stages,
+    labelled by stage and by source or host.
+    """
+
+    def __init__(self):
+        self._values = defaultdict(lambda: [0, 0.0, 0])
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, count=1, nbytes=0, **labels):
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            values = self._values[key]
+            values[0] += count
+            values[1] += seconds
+            values[2] += nbytes
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        '''
+        Times the enclosed block; the exceptions are propagated, and the time is recorded anyway
+        '''
+        timer = Timer()
+        start = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            self.observe(stage, time.perf_counter() - start, timer.count, timer.bytes, **labels)
+
+    def snapshot(self):
+        '''
+        Returns a JSON serializable copy of the values, as a list of [stage, labels, [count, seconds, bytes]]
+        '''
+        with self._lock:
+            return [[stage, dict(labels), list(values)] for (stage, labels), values in self._values.items()]
+
+
+registry = Registry()
+
+observe = registry.observe
+timer = registry.timer
+
+
+def merge(*snapshots):
+    '''
+    Sums the values of the given snapshots
+    '''
+    merged = Registry()
+    for snapshot in snapshots:
+        for stage, labels, (count, seconds, nbytes) in snapshot:
+            merged.observe(stage, seconds, count, nbytes, **labels)
+    return merged.snapshot()
+
+
+def diff(before, after):
+    '''
+    Returns the values accumulated between two snapshots of the same registry
+    '''
+    previous = {(stage, tuple(sorted(labels.items()))): values for stage, labels, values in before}
+    result = []
+    for stage, labels, values in after:
+        prev = previous.get((stage, tuple(sorted(labels.items()))), (0, 0.0, 0))
+        delta = [value - prev_value for value, prev_value in zip(values, prev)]
+        if delta[0]:
+            result.append([stage, labels, delta])
+    return result
+
+
+def summarize(snapshot):
+    '''
+    Returns a dict stage: {count, seconds, bytes} with the values of all the labels summed
+    '''
+    summary = {}
+    for stage, labels, (count, seconds, nbytes) in snapshot:
+        stage_summary = summary.setdefault(stage, {'count': 0, 'seconds': 0.0, 'bytes': 0})
+        stage_summary['count'] += count
+        stage_summary['seconds'] += seconds
+        stage_summary['bytes'] += nbytes
+    for stage_summary in summary.values():
+        stage_summary['seconds'] = round(stage_summary['seconds'], 3)
+    return summary
+
+
+def render(snapshot):
+    '''
+    Returns the snapshot in the Prometheus text exposition format
+    '''
+    lines = []
+    rows = sorted(snapshot, key=lambda row: (row[0], sorted(row[1].items())))
+    for name, help_text, index in METRICS:
+        metric = f'{METRIC_PREFIX}_stage_{name}'
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for stage, labels, values in rows:
+            label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in
+                                  [('stage', stage)] + sorted(labels.items()))
+            lines.append(f'{metric}{{{label_text}}} {values[index]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def get_metrics_dir():
+    return toolkit.config.get(CONFIG_METRICS_DIR)
+
+
+def get_metrics_token():
+    return toolkit.config.get(CONFIG_METRICS_TOKEN)
+
+
+_last_flush = 0
+# (pid, name) of the metrics file of this process
+_process_file = None
+# values of this process already counted in the compacted file, and the ones written in its own file
+_compacted = []
+_flushed = None
+
+
+def _get_process_file(new=False):
+    global _process_file
+    if new or _process_file is None or _process_file[0] != os.getpid():
+        # the pids are not unique among the hosts or containers sharing the metrics dir, and are reused
+        _process_file = (os.getpid(), f'geonode-{socket.gethostname()}-{uuid.uuid4().hex}.json')
+    return _process_file[1]
+
+
+@contextmanager
+def _locked(metrics_dir):
+    '''
+    Holds the lock of the metrics dir, shared by the processes writing their files and the ones compacting them
+    '''
+    with open(os.path.join(metrics_dir, LOCK_FILE), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write(path, snapshot):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning('Could not read the metrics file %s: %s', path, e)
+        return None
+
+
+def _check_compacted(metrics_dir):
+    '''
+    Returns the path of the metrics file of this process; if the file was compacted by another process while
+    this one was idle, the values written in it are counted in the compacted file and a new file is started
+    '''
+    global _compacted
+    path = os.path.join(metrics_dir, _get_process_file())
+    if _flushed is not None and not os.path.exists(path):
+        _compacted = _flushed
+        path = os.path.join(metrics_dir, _get_process_file(new=True))
+    return path
+
+
+def flush(force=False):
+    '''
+    Writes the metrics of this process in the metrics dir (if configured), at most every FLUSH_INTERVAL seconds
+    '''
+    global _last_flush, _flushed
+    metrics_dir = get_metrics_dir()
+    if not metrics_dir or (not force and time.monotonic() - _last_flush < FLUSH_INTERVAL):
+        return
+    _last_flush = time.monotonic()
+
+    try:
+        os.makedirs(metrics_dir, exist_ok=True)
+        with _locked(metrics_dir):
+            path = _check_compacted(metrics_dir)
+            snapshot = registry.snapshot()
+            _write(path, diff(_compacted, snapshot))
+            _flushed = snapshot
+    except OSError as e:
+        log.warning('Could not write the metrics files in %s: %s', metrics_dir, e)
+
+
+def _compact(metrics_dir, own_file, stale_after):
+    '''
+    Merges the metrics files not written in the last `stale_after` seconds (e.g. of the processes that ended)
+    into the compacted file and removes them, so that the totals never decrease
+    '''
+    now = time.time()
+    stale = []
+    for filename in os.listdir(metrics_dir):
+        path = os.path.join(metrics_dir, filename)
+        if filename.startswith('geonode-') and filename.endswith('.json') and \
+                filename not in (own_file, COMPACTED_FILE) and now - os.path.getmtime(path) > stale_after:
+            stale.append(path)
+    if not stale:
+        return
+
+    compacted_path = os.path.join(metrics_dir, COMPACTED_FILE)
+    _write(compacted_path, merge(*[_read(path) or [] for path in [compacted_path] + stale]))
+    for path in stale:
+        os.remove(path)
+    log.info('Compacted %d metrics files', len(stale))
+
+
+def collect(stale_after=STALE_AFTER):
+    '''
+    Returns the snapshot of the metrics of all the processes, read from the metrics dir, plus this process.
+    The files not written in the last `stale_after` seconds are compacted.
+    '''
+    metrics_dir = get_metrics_dir()
+    if not metrics_dir or not os.path.isdir(metrics_dir):
+        return registry.snapshot()
+
+    with _locked(metrics_dir):
+        own_file = os.path.basename(_check_compacted(metrics_dir))
+        try:
+            _compact(metrics_dir, own_file, stale_after)
+        except OSError as e:
+            log.warning('Could not compact the metrics files: %s', e)
+
+        # the values of this process not counted in the compacted file
+        snapshots = [diff(_compacted, registry.snapshot())]
+        for filename in os.listdir(metrics_dir):
+            if filename.startswith('geonode-') and filename.endswith('.json') and filename != own_file:
+                snapshots.append(_read(os.path.join(metrics_dir, filename)) or [])
+    return merge(*snapshots)
+
+
+def save_job_metrics(harvest_job, snapshot):
+    '''
+    Persists the summary of the metrics recorded by the gather stage of a job
+    '''
+    state.save(state.make_key('job', harvest_job.id, 'metrics'), summarize(snapshot))
+
+
+def get_job_metrics(harvest_job):
+    '''
+    Returns the metrics of a job: the summary saved by the gather stage, and the `import` stage
+    computed from the import time stored in the harvest objects gathered by the job
+    (the unchanged objects are moved to a previous job by the import stage, so they are looked up by gather time)
+    '''
+    summary = state.load(state.make_key('job', harvest_job.id, 'metrics'), {})
+
+    if harvest_job.gather_started:
+        query = Session.query(func.count(HOExtra.id), func.sum(cast(HOExtra.value, Float)),
+                              func.max(cast(HOExtra.value, Float))). \
+            join(HarvestObject, HOExtra.harvest_object_id == HarvestObject.id). \
+            filter(HOExtra.key == EXTRA_IMPORT_SECONDS). \
+            filter(HarvestObject.harvest_source_id == harvest_job.source_id). \
+            filter(HarvestObject.gathered >= harvest_job.gather_started)
+        if harvest_job.gather_finished:
+            query = query.filter(HarvestObject.gathered <= harvest_job.gather_finished)
+        count, seconds, max_seconds = query.one()
+        if count:
+            summary['import'] = {'count': count, 'seconds': round(seconds, 3), 'max_seconds': round(max_seconds, 3)}
+
+    return summary
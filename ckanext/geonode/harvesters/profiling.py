@@ -0,0 +1,202 @@
+import cProfile
+import heapq
+import json
+import logging
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from ckan.plugins import toolkit
+
+from ckanext.geonode.harvesters import CONFIG_PROFILE_SAMPLE_RATE, CONFIG_PROFILE_SLOWEST
+
+log = logging.getLogger(__name__)
+
+CONFIG_PROFILE_DIR = 'ckanext.geonode.profile_dir'
+CONFIG_PROFILE_TOP = 'ckanext.geonode.profile_top'
+
+DEFAULT_PROFILE_TOP = 20
+# number of allocation sites stored for each profile
+ALLOCATIONS_TOP = 10
+# number of jobs whose slowest profiles are tracked by a process
+SLOWEST_JOBS = 16
+
+
+class SlowestProfiles(object):
+    """
+    Keeps the profile files of the N slowest objects of each job, deleting the ones pushed out.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def offer(self, job_id, size, seconds):
+        '''
+        Returns True if a profile lasting `seconds` is among the `size` slowest ones of the job.
+        The profile files of the slowest ones must be written with `keep`.
+        '''
+        with self._lock:
+            heap = self._jobs.get(job_id, [])
+            return len(heap) < size or seconds > heap[0][0]
+
+    def keep(self, job_id, size, seconds, path):
+        with self._lock:
+            if job_id not in self._jobs:
+                # only the last jobs are tracked
+                if len(self._jobs) >= SLOWEST_JOBS:
+                    self._jobs.pop(next(iter(self._jobs)))
+                self._jobs[job_id] = []
+            heap = self._jobs[job_id]
+            heapq.heappush(heap, (seconds, path))
+            while len(heap) > size:
+                _, evicted = heapq.heappop(heap)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+
+
+_slowest = SlowestProfiles()
+
+
+class MemoryTracing(object):
+    """
+    Shares tracemalloc among the profiled imports running in the threads of the process.
+
+    Tracing is started by the first profiled import and stopped after the last one, unless it was
+    already started by someone else. Since tracemalloc is process-wide, the memory is measured for
+    one import at a time: the imports running meanwhile are profiled without memory info.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = 0
+        self._started = False
+        self._measuring = False
+
+    def enter(self):
+        '''
+        Returns the traced memory at the start of the measure, or None if another import is being measured
+        '''
+        with self._lock:
+            if self._users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+            self._users += 1
+            if self._measuring:
+                return None
+            self._measuring = True
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+
+    def exit(self, start, snapshot=False):
+        '''
+        Ends a measure started by `enter`, returning the peak of the memory allocated meanwhile and
+        the top allocation sites (if `snapshot`), or (None, None) if the memory was not measured
+        '''
+        with self._lock:
+            peak = allocations = None
+            if start is not None:
+                peak = max(0, tracemalloc.get_traced_memory()[1] - start)
+                if snapshot:
+                    allocations = tracemalloc.take_snapshot().statistics('lineno')[:ALLOCATIONS_TOP]
+                self._measuring = False
+            self._users -= 1
+            if self._users == 0 and self._started:
+                tracemalloc.stop()
+                self._started = False
+            return peak, allocations
+
+
+_tracing = MemoryTracing()
+
+
+def get_profile_dir():
+    return toolkit.config.get(CONFIG_PROFILE_DIR) or os.path.join(tempfile.gettempdir(), 'ckanext-geonode-profiles')
+
+
+def is_sampled(source_config):
+    '''
+    Tells whether the next import of the source should be profiled
+    '''
+    if source_config.get(CONFIG_PROFILE_SLOWEST):
+        return True
+    rate = source_config.get(CONFIG_PROFILE_SAMPLE_RATE)
+    return bool(rate) and random.random() < rate
+
+
+@contextmanager
+def profile_import(harvest_object, source_config):
+    '''
+    Profiles the enclosed import of the harvest object, if it is sampled according to the source config.
+
+    The top functions by cumulative time and the peak of the allocated memory are written as JSON in
+    `<profile dir>/<job id>/<guid>.json`. With `profile_slowest` every import is profiled, and only
+    the N slowest profiles of the job are kept.
+    '''
+    if not is_sampled(source_config):
+        yield
+        return
+
+    # the import stage may move the object to a previous job
+    job_id = harvest_object.harvest_job_id
+    slowest = source_config.get(CONFIG_PROFILE_SLOWEST)
+    memory_start = _tracing.enter()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - start
+        keep = not slowest or _slowest.offer(job_id, slowest, seconds)
+        peak, allocations = _tracing.exit(memory_start, snapshot=keep)
+        if keep:
+            try:
+                _save_profile(harvest_object, job_id, slowest, profiler, seconds, peak, allocations)
+            except Exception as e:
+                log.warning('Could not save the profile of object %s: %s', harvest_object.id, e)
+
+
+def _save_profile(harvest_object, job_id, slowest, profiler, seconds, peak, allocations):
+    top = toolkit.asint(toolkit.config.get(CONFIG_PROFILE_TOP, DEFAULT_PROFILE_TOP))
+    stats = pstats.Stats(profiler)
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+
+    profile = {
+        'guid': harvest_object.guid,
+        'harvest_object_id': harvest_object.id,
+        'harvest_job_id': job_id,
+        'harvest_source_id': harvest_object.harvest_source_id,
+        'seconds': round(seconds, 6),
+        'peak_allocated_bytes': peak,
+        'functions': [{
+            'function': f'{filename}:{line}({name})',
+            'calls': calls,
+            'total_seconds': round(total_time, 6),
+            'cumulative_seconds': round(cumulative_time, 6),
+        } for (filename, line, name), (_, calls, total_time, cumulative_time, _) in functions],
+        'allocations': [{
+            'line': str(stat.traceback[0]),
+            'bytes': stat.size,
+            'count': stat.count,
+        } for stat in allocations] if allocations is not None else None,
+    }
+
+    profile_dir = os.path.join(get_profile_dir(), job_id or 'nojob')
+    os.makedirs(profile_dir, exist_ok=True)
+    filename = (harvest_object.guid or harvest_object.id).replace(os.sep, '_')
+    path = os.path.join(profile_dir, f'{filename}.json')
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    log.info('Profiled import of object %s (%.3fs, peak %s bytes) in %s', harvest_object.guid, seconds, peak, path)
+
+    if slowest:
+        _slowest.keep(job_id, slowest, seconds, path)
@@ -0,0 +1,172 @@
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import func
+
+from ckan.model import Session
+
+from ckanext.harvest.model import HarvestObject
+
+import ckanext.geonode.harvesters.state as state
+
+log = logging.getLogger(__name__)
+
+# minimum seconds between two saves of the gather progress
+PUBLISH_INTERVAL = 5
+# minimum seconds between two progress log messages
+LOG_INTERVAL = 30
+
+STATES_DONE = ('COMPLETE', 'ERROR')
+
+
+def _key(job_id):
+    return state.make_key('job', job_id, 'progress')
+
+
+class GatherProgress(object):
+    """
+    Progress of the gather stage of a job: the counts are updated after each API page, and they are
+    persisted (for the `geonode_harvest_progress` action) and logged at most every few seconds.
+    """
+
+    def __init__(self, harvest_job, total=None):
+        '''
+        :param total: number of resources to be gathered, as reported by the API; None if unknown
+        '''
+        self.job_id = harvest_job.id
+        self.source_id = harvest_job.source_id
+        self.total = total
+        self.pages = 0
+        self.objects = 0
+        self.received_bytes = 0
+        self.started = datetime.utcnow()
+        self._start = time.monotonic()
+        self._last_publish = self._last_log = self._start
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self._start
+
+    @property
+    def rate(self):
+        '''
+        Objects gathered per second
+        '''
+        elapsed = self.elapsed
+        return self.objects / elapsed if elapsed else None
+
+    @property
+    def eta(self):
+        '''
+        Estimated seconds to the end of the crawl, if the total is known
+        '''
+        rate = self.rate
+        if not self.total or not rate:
+            return None
+        return max(0, self.total - self.objects) / rate
+
+    def page_done(self, objects, received_bytes):
+        self.pages += 1
+        self.objects += objects
+        self.received_bytes = received_bytes
+
+        now = time.monotonic()
+        if now - self._last_publish >= PUBLISH_INTERVAL:
+            self.publish()
+        if now - self._last_log >= LOG_INTERVAL:
+            self._last_log = now
+            log.info(self.message())
+
+    def message(self):
+        total = f'/{self.total}' if self.total else ''
+        eta = f', ETA {self.eta:.0f}s' if self.eta is not None else ''
+        return (f'Gathered {self.objects}{total} objects in {self.pages} pages '
+                f'({self.rate or 0:.1f} objects/s, {self.received_bytes} bytes){eta}')
+
+    def as_dict(self, status='running'):
+        return {
+            'status': status,
+            'total': self.total,
+            'pages': self.pages,
+            'objects': self.objects,
+            'received_bytes': self.received_bytes,
+            'objects_per_second': round(self.rate, 2) if self.rate else None,
+            'eta_seconds': round(self.eta) if self.eta is not None else None,
+            'started': self.started.isoformat(),
+            'updated': datetime.utcnow().isoformat(),
+        }
+
+    def publish(self, status='running'):
+        self._last_publish = time.monotonic()
+        state.save(_key(self.job_id), self.as_dict(status))
+
+
+class ImportProgressLog(object):
+    """
+    Aggregates the per-object import messages of a process into a progress message every LOG_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self._last_log = time.monotonic()
+
+    def object_done(self, result):
+        result = 'unchanged' if result == 'unchanged' else 'imported' if result else 'failed'
+        self.counts[result] = self.counts.get(result, 0) + 1
+
+        now = time.monotonic()
+        elapsed = now - self._last_log
+        if elapsed >= LOG_INTERVAL:
+            done = sum(self.counts.values())
+            details = ', '.join(f'{count} {name}' for name, count in sorted(self.counts.items()))
+            log.info(f'Processed {done} objects in the last {elapsed:.0f}s ({details}, {done / elapsed:.1f} objects/s)')
+            self.counts = {}
+            self._last_log = now
+
+
+import_log = ImportProgressLog()
+
+
+def get_gather_progress(harvest_job):
+    return state.load(_key(harvest_job.id))
+
+
+def get_import_progress(harvest_job):
+    '''
+    Returns the import progress of the objects gathered by a job, computed from the harvest object table
+    (the unchanged objects are moved to a previous job by the import stage, so they are looked up by gather time)
+    '''
+    if not harvest_job.gather_started:
+        return None
+
+    query = Session.query(HarvestObject.state, func.count(HarvestObject.id),
+                          func.min(HarvestObject.import_started), func.max(HarvestObject.import_finished)). \
+        filter(HarvestObject.harvest_source_id == harvest_job.source_id). \
+        filter(HarvestObject.gathered >= harvest_job.gather_started)
+    if harvest_job.gather_finished:
+        query = query.filter(HarvestObject.gathered <= harvest_job.gather_finished)
+
+    states = {}
+    first_started = last_finished = None
+    for object_state, count, started, finished in query.group_by(HarvestObject.state):
+        states[object_state] = count
+        if started and (first_started is None or started < first_started):
+            first_started = started
+        if finished and (last_finished is None or finished > last_finished):
+            last_finished = finished
+
+    total = sum(states.values())
+    done = sum(states.get(object_state, 0) for object_state in STATES_DONE)
+    rate = eta = None
+    if first_started and last_finished and last_finished > first_started:
+        rate = done / (last_finished - first_started).total_seconds()
+        eta = (total - done) / rate if rate else None
+
+    return {
+        'total': total,
+        'done': done,
+        'states': states,
+        'objects_per_second': round(rate, 2) if rate else None,
+        'eta_seconds': round(eta) if eta is not None else None,
+    }
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+
+from ckan.plugins import toolkit
+
+log = logging.getLogger(__name__)
+
+CONFIG_CONCURRENCY = 'ckanext.geonode.concurrency'
+CONFIG_MAX_CONCURRENCY = 'ckanext.geonode.max_concurrency'
+CONFIG_TARGET_LATENCY = 'ckanext.geonode.target_latency'
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_TARGET_LATENCY = 2.0  # seconds
+
+THROTTLING_CODES = (429, 503)
+
+# weight of the last sample in the latency moving average
+LATENCY_ALPHA = 0.2
+
+
+class HostLimiter(object):
+    """
+    Limits the concurrent requests to a remote host.
+
+    The concurrency limit is adapted AIMD-style: it is increased by about one request per
+    round trip while the latency stays below the target, and halved when the host
+    throttles us (429/503) or times out. A Retry-After delay blocks new requests until it expires.
+    """
+
+    def __init__(self, host, concurrency=DEFAULT_CONCURRENCY, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 target_latency=DEFAULT_TARGET_LATENCY):
+        self.host = host
+        self.limit = float(min(concurrency, max_concurrency))
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.latency = None
+        self.blocked_until = 0
+        self.throttled_count = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self):
+        '''
+        Returns 0 if a request slot has been acquired, else the suggested time to wait before retrying
+        '''
+        with self._cond:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return 0
+            return 0.05
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    self._cond.wait(self.blocked_until - now)
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                else:
+                    self._cond.wait()
+
+    async def acquire_async(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def success(self, latency):
+        with self._cond:
+            self.latency = latency if self.latency is None else \
+                LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency
+            if self.latency <= self.target_latency:
+                # additive increase: about +1 once every `limit` requests
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def throttled(self, retry_after=None):
+        with self._cond:
+            self.throttled_count += 1
+            self.limit = max(1.0, self.limit / 2)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            log.info(f'Host {self.host} throttled: concurrency now {int(self.limit)}'
+                     + (f', waiting {retry_after}s' if retry_after else ''))
+
+    def on_error(self, error):
+        ''' Handles a failed request, returning the Retry-After seconds (if any) '''
+        if get_status(error) in THROTTLING_CODES:
+            retry_after = get_retry_after(error)
+            self.throttled(retry_after)
+            return retry_after
+        elif is_timeout(error):
+            self.throttled()
+        return None
+
+    @contextmanager
+    def request(self):
+        '''
+        Context manager wrapping a request to the host
+        '''
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.on_error(e)
+            raise
+        else:
+            self.success(time.monotonic() - start)
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def request_async(self):
+        '''
+        Async context manager wrapping a request to the host
+        '''
+        await self.acquire_async()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.on_error(e)
+            raise
+        else:
+            self.success(time.monotonic() - start)
+        finally:
+            self.release()
+
+
+def get_status(error):
+    '''
+    Returns the HTTP status of a failed request, from either urllib (`code`) or aiohttp (`status`) errors
+    '''
+    if isinstance(error, HTTPError):
+        return error.code
+    return getattr(error, 'status', None)
+
+
+def get_retry_after(error):
+    headers = getattr(error, 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # HTTP date format
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_timeout(error):
+    if isinstance(error, (socket.timeout, TimeoutError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, URLError) and isinstance(error.reason, (socket.timeout, TimeoutError))
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(url, concurrency=None):
+    '''
+    Returns the limiter shared by all the requests to the host of the given URL.
+
+    :param concurrency: initial concurrency, only used when the limiter is created
+    '''
+    host = urlparse(url).netloc
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            config = toolkit.config
+            limiter = HostLimiter(
+                host,
+                concurrency=concurrency or toolkit.asint(config.get(CONFIG_CONCURRENCY, DEFAULT_CONCURRENCY)),
+                max_concurrency=toolkit.asint(config.get(CONFIG_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY)),
+                target_latency=float(config.get(CONFIG_TARGET_LATENCY, DEFAULT_TARGET_LATENCY)))
+            _limiters[host] = limiter
+        return limiter
@@ -0,0 +1,282 @@
+from datetime import datetime
+
+from sqlalchemy import Float, cast, func
+
+from ckan.model import Session
+
+from ckanext.harvest.model import HarvestJob, HarvestObject, HarvestObjectExtra as HOExtra
+
+import ckanext.geonode.harvesters.metrics as metrics
+import ckanext.geonode.harvesters.state as state
+
+# bytes downloaded (documents, WFS) during the import of a harvest object
+EXTRA_DOWNLOAD_BYTES = 'download_bytes'
+
+DOWNLOAD_STAGES = ('document_download', 'wfs_download')
+
+DEFAULT_SLOWEST = 10
+# slowest objects kept in the stored reports
+STORED_SLOWEST = 100
+
+# states of the harvest objects still to be imported
+PENDING_STATES = ('WAITING', 'FETCH', 'IMPORT')
+
+# version of the report layout, stored in the reports to compare only compatible ones
+REPORT_VERSION = 1
+
+
+class GatherReport(object):
+    """
+    Counts collected by the gather stage of a job, stored at the end of the gather.
+    """
+
+    def __init__(self):
+        # type: {new, changed, unchanged, dependency_changed, pages, bytes}
+        self.types = {}
+        self.deleted = 0
+        self.requeued = 0
+        self.dedup = 0
+        self.retries = 0
+        self.throttled = 0
+        self.status = 'running'
+
+    def _type(self, type_name):
+        if type_name not in self.types:
+            self.types[type_name] = {'new': 0, 'changed': 0, 'unchanged': 0, 'dependency_changed': 0,
+                                     'pages': 0, 'bytes': 0}
+        return self.types[type_name]
+
+    def add_object(self, type_name, result):
+        '''
+        :param result: `new`, `changed`, `unchanged` or `dependency_changed`
+        '''
+        self._type(type_name)[result] += 1
+
+    def add_page(self, type_name, nbytes):
+        counts = self._type(type_name)
+        counts['pages'] += 1
+        counts['bytes'] += nbytes
+
+    def as_dict(self):
+        gathered = sum(counts[result] for counts in self.types.values()
+                       for result in ('new', 'changed', 'unchanged', 'dependency_changed'))
+        unchanged = sum(counts['unchanged'] for counts in self.types.values())
+        return {
+            'status': self.status,
+            'types': self.types,
+            'gathered': gathered,
+            'deleted': self.deleted,
+            'requeued': self.requeued,
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'caches': {
+                # resources whose content hash matched the current object, skipped by the import
+                'content_hash': _ratio(unchanged, gathered),
+                # contents stored as references to the previous object
+                'content_dedup': _ratio(self.dedup, gathered),
+            },
+        }
+
+    def save(self, harvest_job):
+        state.save(_key(harvest_job.id, 'gather'), self.as_dict())
+
+
+def _ratio(hits, total):
+    return {'hits': hits, 'total': total, 'rate': round(hits / total, 4) if total else None}
+
+
+def _key(job_id, part):
+    return state.make_key('job', job_id, 'report', part)
+
+
+def get_download_bytes(before, after):
+    '''
+    Returns the bytes downloaded between two snapshots of the metrics registry
+    '''
+    return sum(nbytes for stage, _, (_, _, nbytes) in metrics.diff(before, after) if stage in DOWNLOAD_STAGES)
+
+
+def _gathered_objects(query, harvest_job):
+    # the unchanged objects are moved to a previous job by the import stage, so they are looked up by gather time
+    query = query.filter(HarvestObject.harvest_source_id == harvest_job.source_id). \
+        filter(HarvestObject.gathered >= harvest_job.gather_started)
+    if harvest_job.gather_finished:
+        query = query.filter(HarvestObject.gathered <= harvest_job.gather_finished)
+    return query
+
+
+def _extra_value(key):
+    return Session.query(HarvestObject.guid, cast(HOExtra.value, Float)). \
+        join(HOExtra, HOExtra.harvest_object_id == HarvestObject.id). \
+        filter(HOExtra.key == key)
+
+
+def get_report_status(harvest_object, result):
+    '''
+    Returns the report status of an object given the result of its import stage,
+    as set by ckanext-harvest
+    '''
+    if not result:
+        return 'errored'
+    if result == 'unchanged':
+        return 'not modified'
+    if not harvest_object.current:
+        return 'deleted'
+    if Session.query(HarvestObject).filter_by(package_id=harvest_object.package_id).limit(2).count() == 2:
+        return 'updated'
+    return 'added'
+
+
+def build_import_report(harvest_job, slowest=DEFAULT_SLOWEST, last_status=None):
+    '''
+    Returns the import part of the report, computed from the harvest objects gathered by the job
+
+    :param last_status: report status of the object being imported, not stored yet
+    '''
+    results = dict(_gathered_objects(
+        Session.query(HarvestObject.report_status, func.count(HarvestObject.id)), harvest_job).
+        group_by(HarvestObject.report_status))
+    results = {status or 'pending': count for status, count in results.items()}
+    if last_status and results.get('pending'):
+        results['pending'] -= 1
+        if not results['pending']:
+            del results['pending']
+        results[last_status] = results.get(last_status, 0) + 1
+    imported = sum(count for status, count in results.items() if status != 'pending')
+
+    value = cast(HOExtra.value, Float)
+    slowest_objects = _gathered_objects(_extra_value(metrics.EXTRA_IMPORT_SECONDS), harvest_job). \
+        order_by(value.desc()).limit(slowest).all()
+
+    downloads = _gathered_objects(
+        Session.query(func.count(HOExtra.id), func.sum(value), func.max(value)).
+        join(HarvestObject, HOExtra.harvest_object_id == HarvestObject.id).
+        filter(HOExtra.key == EXTRA_DOWNLOAD_BYTES), harvest_job).one()
+
+    return {
+        'results': results,
+        'caches': {
+            # objects found unchanged by the import
+            'not_modified': _ratio(results.get('not modified', 0), imported),
+        },
+        'slowest': [{'guid': guid, 'seconds': seconds} for guid, seconds in slowest_objects],
+        'downloads': {
+            'count': downloads[0] or 0,
+            'bytes': int(downloads[1] or 0),
+            'max_bytes': int(downloads[2] or 0),
+        },
+    }
+
+
+def _job_fields(harvest_job):
+    return {
+        'status': harvest_job.status,
+        'created': _isoformat(harvest_job.created),
+        'gather_started': _isoformat(harvest_job.gather_started),
+        'gather_finished': _isoformat(harvest_job.gather_finished),
+        'finished': _isoformat(harvest_job.finished),
+    }
+
+
+def build_report(harvest_job, slowest=DEFAULT_SLOWEST, last_status=None):
+    '''
+    Returns the report of a job, computed from its harvest objects
+    '''
+    report = {
+        'version': REPORT_VERSION,
+        'job_id': harvest_job.id,
+        'source_id': harvest_job.source_id,
+    }
+    report.update(_job_fields(harvest_job))
+    report.update({
+        'gather': state.load(_key(harvest_job.id, 'gather')),
+        'stages': metrics.get_job_metrics(harvest_job),
+        'import': build_import_report(harvest_job, slowest, last_status) if harvest_job.gather_started else None,
+        'generated': datetime.utcnow().isoformat(),
+    })
+    return report
+
+
+def save_report(harvest_job, last_status=None):
+    '''
+    Stores the report of a job whose objects have all been imported, so that it is not affected
+    by the later changes to the harvest objects (e.g. by `ckan geonode prune`)
+    '''
+    state.save(_key(harvest_job.id, 'final'), build_report(harvest_job, STORED_SLOWEST, last_status))
+
+
+def has_report(harvest_job):
+    return state.load(_key(harvest_job.id, 'final')) is not None
+
+
+def object_imported(harvest_job_id, harvest_object, result):
+    '''
+    Stores the report of a job when the given object, just imported, was the last one of the job
+
+    :param result: the value returned by the import stage for the object
+    '''
+    harvest_job = HarvestJob.get(harvest_job_id)
+    if harvest_job is None or not harvest_job.gather_finished:
+        # in pipelined mode more objects may still be gathered
+        return
+    pending = Session.query(HarvestObject.id). \
+        filter(HarvestObject.harvest_job_id == harvest_job_id). \
+        filter(HarvestObject.state.in_(PENDING_STATES)). \
+        filter(HarvestObject.id != harvest_object.id). \
+        first()
+    if pending is None:
+        # the report status of the object is set once the import stage returns
+        save_report(harvest_job, get_report_status(harvest_object, result))
+
+
+def get_report(harvest_job, slowest=DEFAULT_SLOWEST):
+    '''
+    Returns the stored report of a job, or the one computed from its harvest objects if the job
+    has not been completely imported yet
+    '''
+    stored = state.load(_key(harvest_job.id, 'final'))
+    if not stored:
+        return build_report(harvest_job, slowest)
+
+    # the report is stored before the job is flagged as finished
+    stored.update(_job_fields(harvest_job))
+    if stored.get('import'):
+        stored['import']['slowest'] = stored['import']['slowest'][:slowest]
+    return stored
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def compare(report, other):
+    '''
+    Compares the numeric values of two reports.
+
+    :returns: a dict path: {value, other, delta} for each numeric value found in either report,
+              where path is the dotted path of the value
+    '''
+    values = _flatten(report)
+    other_values = _flatten(other)
+    comparison = {}
+    for path in sorted(set(values) | set(other_values)):
+        value = values.get(path)
+        other_value = other_values.get(path)
+        delta = value - other_value if value is not None and other_value is not None else None
+        comparison[path] = {'value': value, 'other': other_value, 'delta': delta}
+    return comparison
+
+
+def _flatten(value, path=''):
+    if isinstance(value, bool):
+        return {}
+    if isinstance(value, (int, float)):
+        return {path: value}
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            if key in ('version', 'slowest'):
+                continue
+            flat.update(_flatten(item, f'{path}.{key}' if path else key))
+        return flat
+    return {}
@@ -0,0 +1,161 @@
+import logging
+import math
+from collections import namedtuple, defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from sqlalchemy import and_, exists, func
+
+from ckan import model
+from ckan.model import Session
+from ckan.plugins import toolkit
+
+from ckanext.harvest.logic import HarvestJobExists, HarvestSourceInactiveError
+from ckanext.harvest.model import HarvestGatherError, HarvestJob, HarvestObject, HarvestSource
+
+from ckanext.geonode.harvesters.checkpoint import get_checkpoint_source_ids
+from ckanext.geonode.harvesters.context import get_user
+
+log = logging.getLogger(__name__)
+
+CONFIG_MAX_RUNNING_JOBS = 'ckanext.geonode.scheduler.max_running_jobs'
+CONFIG_MAX_JOBS_PER_HOST = 'ckanext.geonode.scheduler.max_jobs_per_host'
+CONFIG_MIN_INTERVAL = 'ckanext.geonode.scheduler.min_interval'
+
+DEFAULT_MAX_RUNNING_JOBS = 4
+DEFAULT_MAX_JOBS_PER_HOST = 1
+DEFAULT_MIN_INTERVAL = 24  # hours
+
+RUNNING_STATUSES = ('New', 'Running')
+
+SourceStatus = namedtuple('SourceStatus', ['source_id', 'title', 'host', 'last_success', 'size', 'running',
+                                           'resuming', 'last_attempt'], defaults=[False, None])
+
+
+def get_sources_status():
+    '''
+    Returns the SourceStatus of all the active GeoNode sources, computed from the harvest tables:
+    - `last_success`: end time of the last finished job without gather errors (None if there is none)
+    - `size`: number of current harvest objects
+    - `running`: True if the source has a new or running job
+    - `resuming`: True if the last job stopped before the end of the crawl, which the next job continues
+    - `last_attempt`: end time of the last finished job, successful or not (None if there is none)
+    '''
+    gather_error = exists().where(HarvestGatherError.harvest_job_id == HarvestJob.id)
+    last_success = dict(
+        Session.query(HarvestJob.source_id, func.max(HarvestJob.finished)).
+        filter(HarvestJob.status == 'Finished').
+        filter(~gather_error).
+        group_by(HarvestJob.source_id))
+
+    last_attempt = dict(
+        Session.query(HarvestJob.source_id, func.max(HarvestJob.finished)).
+        filter(~HarvestJob.status.in_(RUNNING_STATUSES)).
+        group_by(HarvestJob.source_id))
+
+    sizes = dict(
+        Session.query(HarvestObject.harvest_source_id, func.count(HarvestObject.id)).
+        filter(HarvestObject.current == True).
+        group_by(HarvestObject.harvest_source_id))
+
+    running = set(
+        source_id for (source_id,) in
+        Session.query(HarvestJob.source_id).filter(HarvestJob.status.in_(RUNNING_STATUSES)).distinct())
+
+    resuming = set(get_checkpoint_source_ids())
+
+    sources = Session.query(HarvestSource). \
+        filter(and_(HarvestSource.type == 'geonode', HarvestSource.active == True))
+
+    return [SourceStatus(source.id, source.title, urlparse(source.url).netloc,
+                         last_success.get(source.id), sizes.get(source.id, 0), source.id in running,
+                         source.id in resuming, last_attempt.get(source.id))
+            for source in sources]
+
+
+def priority(status, now):
+    '''
+    Scheduling priority of a source: the time since its last successful job, scaled down
+    by the order of magnitude of its size, so that small sources are not starved by big ones.
+    Sources never harvested successfully are ranked by the time since their last attempt;
+    sources never harvested at all come first.
+    '''
+    since = status.last_success or status.last_attempt
+    if since is None:
+        return math.inf
+    staleness = (now - since).total_seconds()
+    return staleness / (1 + math.log10(1 + status.size))
+
+
+def plan(statuses, now, max_running=DEFAULT_MAX_RUNNING_JOBS, max_per_host=DEFAULT_MAX_JOBS_PER_HOST,
+         min_interval=timedelta(hours=DEFAULT_MIN_INTERVAL)):
+    '''
+    Chooses the sources to be harvested now.
+
+    The sources whose last job, successful or not, finished in the last `min_interval` are skipped, so that
+    failing sources do not take all the slots, unless their crawl has to be continued (e.g. it was stopped by
+    the job budget or by the queue quota); the others are taken by
+    decreasing priority (smaller first when tied), as long as there are less than `max_running` jobs
+    overall and `max_per_host` jobs on the host of the source.
+
+    :returns: the list of the chosen SourceStatus
+    '''
+    running = sum(1 for status in statuses if status.running)
+    per_host = defaultdict(int)
+    for status in statuses:
+        if status.running:
+            per_host[status.host] += 1
+
+    candidates = [status for status in statuses
+                  if not status.running and (status.resuming or _last_finished(status) is None or
+                                             now - _last_finished(status) >= min_interval)]
+    candidates.sort(key=lambda status: (-priority(status, now), status.size))
+
+    chosen = []
+    for status in candidates:
+        if running >= max_running:
+            break
+        if per_host[status.host] >= max_per_host:
+            continue
+        chosen.append(status)
+        running += 1
+        per_host[status.host] += 1
+
+    return chosen
+
+
+def _last_finished(status):
+    return max(filter(None, (status.last_success, status.last_attempt)), default=None)
+
+
+def schedule(dry_run=False, max_running=None, max_per_host=None, min_interval=None):
+    '''
+    Creates the jobs for the GeoNode sources chosen by `plan`; the missing limits are read from the CKAN config.
+
+    :returns: the list of the chosen SourceStatus
+    '''
+    config = toolkit.config
+    if max_running is None:
+        max_running = toolkit.asint(config.get(CONFIG_MAX_RUNNING_JOBS, DEFAULT_MAX_RUNNING_JOBS))
+    if max_per_host is None:
+        max_per_host = toolkit.asint(config.get(CONFIG_MAX_JOBS_PER_HOST, DEFAULT_MAX_JOBS_PER_HOST))
+    if min_interval is None:
+        min_interval = timedelta(hours=float(config.get(CONFIG_MIN_INTERVAL, DEFAULT_MIN_INTERVAL)))
+
+    chosen = plan(get_sources_status(), datetime.utcnow(), max_running=max_running,
+                  max_per_host=max_per_host, min_interval=min_interval)
+    if dry_run:
+        return chosen
+
+    user_name, site_user_name = get_user()
+    context = {'model': model, 'session': Session, 'user': user_name, 'ignore_auth': user_name == site_user_name}
+    started = []
+    for status in chosen:
+        try:
+            toolkit.get_action('harvest_job_create')(context.copy(), {'source_id': status.source_id, 'run': True})
+            log.info('Started harvest job for source %s (%s)', status.title, status.source_id)
+            started.append(status)
+        except (HarvestJobExists, HarvestSourceInactiveError) as e:
+            log.warning('Could not start a job for source %s: %s', status.source_id, e)
+
+    return started
@@ -0,0 +1,188 @@
+import json
+import logging
+import time
+
+from ckanext.geonode.harvesters import CONFIG_CONTENT_COMPRESSION, CONFIG_PROJECT_CONTENT
+from ckanext.geonode.harvesters.mappers.base import validate_groups
+
+import ckanext.geonode.harvesters.fields as fields
+import ckanext.geonode.harvesters.storage as storage
+
+log = logging.getLogger(__name__)
+
+
+class Simulation(object):
+    """
+    Counts and timings collected by a dry run of the gather and mapping of a source.
+    """
+
+    def __init__(self):
+        self.types = {}
+        self.started = time.perf_counter()
+        self.seconds = None
+
+    def _type(self, type_name):
+        if type_name not in self.types:
+            self.types[type_name] = {
+                'total': None,
+                'objects': 0,
+                'pages': 0,
+                'api_seconds': 0.0,
+                'received_bytes': 0,
+                'content_bytes': 0,
+                'stored_bytes': 0,
+                'mapping_seconds': 0.0,
+                'mapping_errors': 0,
+                'packages': 0,
+                'resources': 0,
+                'package_bytes': 0,
+                'groups': 0,
+                'invalid_groups': 0,
+            }
+        return self.types[type_name]
+
+    def set_total(self, type_name, total):
+        self._type(type_name)['total'] = total
+
+    def page_done(self, type_name, seconds, received_bytes):
+        counts = self._type(type_name)
+        counts['pages'] += 1
+        counts['api_seconds'] += seconds
+        counts['received_bytes'] += received_bytes
+
+    def object_stored(self, type_name, content, stored):
+        counts = self._type(type_name)
+        counts['objects'] += 1
+        counts['content_bytes'] += len(content)
+        counts['stored_bytes'] += len(stored)
+
+    def objects_mapped(self, type_name, seconds, results, group_validator=None):
+        '''
+        :param results: list of (package_dict, extras, error) as returned by `MappingPool.map`
+        :param group_validator: function telling whether a group exists; if None, the groups are not checked
+        '''
+        counts = self._type(type_name)
+        counts['mapping_seconds'] += seconds
+        for package_dict, extras, error in results:
+            if error or package_dict is None:
+                counts['mapping_errors'] += 1
+                continue
+            counts['packages'] += 1
+            counts['resources'] += len(package_dict.get('resources', []))
+            counts['package_bytes'] += len(json.dumps([package_dict, extras]))
+            groups = package_dict.get('groups', [])
+            counts['groups'] += len(groups)
+            if group_validator:
+                counts['invalid_groups'] += len(groups) - len(validate_groups(groups, group_validator))
+
+    def done(self):
+        self.seconds = time.perf_counter() - self.started
+
+    def as_dict(self):
+        '''
+        Returns the counts of each type and of the whole run, and their projection on the total number
+        of resources reported by the API when only a part of them has been processed
+        '''
+        types = {}
+        for type_name, counts in self.types.items():
+            types[type_name] = dict(counts, **_rounded(counts))
+            types[type_name]['projected'] = _project(counts)
+
+        summary = {}
+        for counts in self.types.values():
+            for key, value in counts.items():
+                if key != 'total':
+                    summary[key] = summary.get(key, 0) + value
+        summary['total'] = None if any(c['total'] is None for c in self.types.values()) else \
+            sum(c['total'] for c in self.types.values())
+
+        return {
+            'seconds': round(self.seconds, 3) if self.seconds is not None else None,
+            'types': types,
+            'summary': dict(summary, **_rounded(summary)),
+            'projected': _sum_projections([t['projected'] for t in types.values()]),
+        }
+
+
+def _rounded(counts):
+    return {key: round(value, 3) for key, value in counts.items() if isinstance(value, float)}
+
+
+def _project(counts):
+    objects = counts['objects']
+    total = counts['total']
+    if not objects or total is None:
+        return None
+    factor = total / objects
+    projected = {key: counts[key] * factor for key in (
+        'api_seconds', 'received_bytes', 'stored_bytes', 'mapping_seconds', 'packages', 'resources', 'package_bytes')}
+    projected = {key: round(value, 3) if key.endswith('seconds') else round(value) for key, value in projected.items()}
+    projected['objects'] = total
+    return projected
+
+
+def _sum_projections(projections):
+    if not projections or None in projections:
+        return None
+    return {key: round(sum(p[key] for p in projections), 3) for key in projections[0]}
+
+
+def simulate(harvester, url, source_config, pool, limit=None, group_validator=None):
+    '''
+    Runs the gather and the mapping of a GeoNode catalogue without writing anything: no harvest objects,
+    packages, queue messages or files are created.
+
+    The contents are projected and compressed as they would be stored, and mapped by `map_content`
+    (including the group mapping and the dynamic rules). The steps needing the stored harvest objects
+    (package names, dependencies of the maps) are skipped.
+
+    :param harvester: the GeoNodeHarvester whose API client is used
+    :param pool: the MappingPool mapping the contents
+    :param limit: maximum number of resources processed for each type; the results are projected on the totals
+    :param group_validator: function telling whether a group exists; if None, the groups are not checked
+    :returns: a Simulation
+    '''
+    simulation = Simulation()
+    client = harvester._get_client(url, source_config)
+
+    projection = None
+    if source_config.get(CONFIG_PROJECT_CONTENT, False):
+        projection = fields.get_projection(source_config)
+    compression = source_config.get(CONFIG_CONTENT_COMPRESSION, storage.COMPRESSION_NONE)
+
+    for geonode_type in harvester._get_harvest_types(source_config):
+        type_name = geonode_type.config_name
+        simulation.set_total(type_name, client.get_total(geonode_type))
+        processed = 0
+
+        pages = client.get_pages(geonode_type)
+        while not limit or processed < limit:
+            received_bytes = client.received_bytes
+            started = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                break
+            page = page[0]
+            simulation.page_done(type_name, time.perf_counter() - started, client.received_bytes - received_bytes)
+
+            if limit:
+                page = page[:limit - processed]
+            contents = []
+            for obj in page:
+                content = json.dumps(fields.project(obj, projection))
+                simulation.object_stored(type_name, content, storage.encode(content, compression))
+                contents.append(content)
+
+            started = time.perf_counter()
+            results = pool.map(contents, source_config)
+            simulation.objects_mapped(type_name, time.perf_counter() - started, results, group_validator)
+            processed += len(page)
+
+        log.info(f'Simulated {type_name}: {processed} resources')
+        # stop the prefetching of the async client
+        close = getattr(pages, 'close', None)
+        if close:
+            close()
+
+    simulation.done()
+    return simulation
@@ -0,0 +1,200 @@
+"""
+Snapshots of a GeoNode catalogue: the API pages fetched by a crawl, stored as gzipped JSON lines.
+
+The first line is a header (base URL, GeoNode version, requested fields); each following line is either
+the total number of resources of a type or an API page with its URL and the URL of the next page.
+A snapshot can be replayed by `ReplayGeoNodeClient` in place of the API client, offline and deterministically.
+"""
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import closing
+from datetime import datetime
+
+from ckan.plugins import toolkit
+
+from ckanext.geonode.harvesters import GeoNodeType
+from ckanext.geonode.harvesters.ratelimit import get_limiter
+
+log = logging.getLogger(__name__)
+
+CONFIG_SNAPSHOT_DIR = 'ckanext.geonode.snapshot_dir'
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSION = '.jsonl.gz'
+
+
+class DocumentNotInSnapshot(LookupError):
+    '''
+    Raised when the file of a document is requested from a snapshot, which only stores the API pages
+    '''
+
+
+def get_snapshot_dir():
+    return toolkit.config.get(CONFIG_SNAPSHOT_DIR) or os.path.join(tempfile.gettempdir(), 'ckanext-geonode-snapshots')
+
+
+def get_snapshot_path(source_id):
+    '''
+    Returns the path of the snapshot recorded for a harvest source
+    '''
+    return os.path.join(get_snapshot_dir(), f'{source_id}{SNAPSHOT_EXTENSION}')
+
+
+def _api_type(res_type: GeoNodeType, version):
+    # adjust model according to version
+    if res_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.DATASET_TYPE):
+        return GeoNodeType.LAYER_TYPE if version == '3' else GeoNodeType.DATASET_TYPE
+    return res_type
+
+
+class RecordingClient(object):
+    """
+    Wraps a GeoNode client, writing the totals and the pages it returns into a snapshot.
+
+    The snapshot is written to a temporary file, which replaces the one at `path` only when
+    the recording is closed as complete.
+    """
+
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._tmp_path = f'{path}.{os.getpid()}.partial'
+        self._file = gzip.open(self._tmp_path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._write({
+            'snapshot': SNAPSHOT_VERSION,
+            'baseurl': client.baseurl,
+            'version': client.version,
+            'fields': client.fields,
+            'created': datetime.utcnow().isoformat(),
+        })
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+
+    def get_resources(self, res_type: GeoNodeType):
+        for page, _ in self.get_pages(res_type):
+            for res in page:
+                yield res
+
+    def get_pages(self, res_type: GeoNodeType, start_url=None):
+        api_type = _api_type(res_type, self._client.version)
+        url = start_url
+        for objects, next_url in self._client.get_pages(res_type, start_url=start_url):
+            self._write({'type': api_type.api_path, 'url': url, 'next': next_url, 'objects': objects})
+            url = next_url
+            yield objects, next_url
+
+    def get_total(self, res_type: GeoNodeType):
+        total = self._client.get_total(res_type)
+        self._write({'type': _api_type(res_type, self._client.version).api_path, 'total': total})
+        return total
+
+    def close(self, complete=True):
+        '''
+        Closes the snapshot; it is kept only if it is `complete`
+        '''
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        if complete:
+            os.replace(self._tmp_path, self.path)
+            log.info('Recorded snapshot %s', self.path)
+        else:
+            os.remove(self._tmp_path)
+
+
+class ReplayGeoNodeClient(object):
+    """
+    Serves the resources of a snapshot with the interface of GeoNodeClient, without any network access.
+    """
+
+    def __init__(self, path, fields=None):
+        '''
+        :param fields: the fields requested; only checked against the ones recorded in the snapshot
+        '''
+        self.path = path
+        # bytes of the snapshot lines read by this client
+        self.received_bytes = 0
+        self.retried = 0
+        with closing(self._records()) as records:
+            header = next(records)
+        if header.get('snapshot') != SNAPSHOT_VERSION:
+            raise ValueError(f'{path} is not a GeoNode snapshot')
+        self.baseurl = header['baseurl']
+        self.version = header['version']
+        self.fields = header['fields']
+        if fields != self.fields:
+            log.warning('Replaying snapshot %s recorded with fields %s', path, self.fields or 'ALL')
+        self.limiter = get_limiter(self.baseurl)
+
+    def _records(self, api_path=None):
+        '''
+        Yields the records of the snapshot; with `api_path`, only the ones of that type
+        '''
+        # the type is the first key of the records, so the other types are skipped without parsing them
+        prefix = json.dumps({'type': api_path})[:-1] if api_path else ''
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith(prefix):
+                    self.received_bytes += len(line)
+                    yield json.loads(line)
+
+    def get_maps(self):
+        return self.get_resources(GeoNodeType.MAP_TYPE)
+
+    def get_layers(self):
+        return self.get_resources(GeoNodeType.LAYER_TYPE if self.version == '3' else GeoNodeType.DATASET_TYPE)
+
+    def get_documents(self):
+        return self.get_resources(GeoNodeType.DOC_TYPE)
+
+    def get_resources(self, res_type: GeoNodeType):
+        for page, _ in self.get_pages(res_type):
+            for res in page:
+                yield res
+
+    def get_pages(self, res_type: GeoNodeType, start_url=None):
+        '''
+        Yields the recorded pages of a type, along with the URL of the next page
+
+        :param start_url: URL of the first page to be returned, as returned by a previous call
+        '''
+        api_path = _api_type(res_type, self.version).api_path
+        started = start_url is None
+        with closing(self._records(api_path)) as records:
+            for record in records:
+                if 'objects' not in record:
+                    continue
+                if not started:
+                    if record['url'] != start_url:
+                        continue
+                    started = True
+                yield record['objects'], record['next']
+                if record['next'] is None:
+                    break
+
+    def get_total(self, res_type: GeoNodeType):
+        '''
+        Returns the total recorded before the pages of the type (None if not recorded)
+        '''
+        api_path = _api_type(res_type, self.version).api_path
+        with closing(self._records(api_path)) as records:
+            for record in records:
+                return record.get('total')
+        return None
+
+    def get_document_download(self, id):
+        # only the API pages are recorded
+        raise DocumentNotInSnapshot(f'Document {id} can not be downloaded: documents are not stored in the snapshots')
@@ -0,0 +1,46 @@
+import json
+import logging
+
+from ckan.model import Session
+from ckan.model.system_info import SystemInfo, get_system_info, set_system_info, delete_system_info
+
+log = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ckanext.geonode'
+
+
+def make_key(*parts):
+    return '.'.join((KEY_PREFIX,) + tuple(str(p) for p in parts))
+
+
+def load(key, default=None):
+    '''
+    Loads a JSON value persisted in the system_info table
+    '''
+    value = get_system_info(key)
+    if value is None:
+        return default
+    try:
+        return json.loads(value)
+    except ValueError:
+        log.warning('Bad value stored for key %s, ignoring it', key)
+        return default
+
+
+def save(key, value):
+    '''
+    Persists a JSON serializable value in the system_info table (the session is committed)
+    '''
+    set_system_info(key, json.dumps(value))
+
+
+def find_keys(*parts):
+    '''
+    Returns the persisted keys starting with the key made of the given parts
+    '''
+    prefix = make_key(*parts) + '.'
+    return [key for (key,) in Session.query(SystemInfo.key).filter(SystemInfo.key.like(f'{prefix}%'))]
+
+
+def clear(key):
+    delete_system_info(key)
@@ -0,0 +1,130 @@
+import base64
+import hashlib
+import logging
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ckan.model import Session
+
+from ckanext.harvest.model import HarvestObject, HarvestObjectExtra as HOExtra
+
+log = logging.getLogger(__name__)
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_ZSTD = 'zstd'
+
+COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD)
+
+# Encoded contents start with one of these prefixes; plain JSON contents start with '{'
+PREFIX_ZLIB = 'zlib:'
+PREFIX_ZSTD = 'zstd:'
+PREFIX_REF = 'ref:'
+
+EXTRA_CONTENT_HASH = 'content_hash'
+# id of the object whose content is referenced by a deduplicated content
+EXTRA_CONTENT_REF = 'content_ref'
+
+
+def content_hash(doc: str) -> str:
+    return hashlib.sha1(doc.encode('utf-8')).hexdigest()
+
+
+def check_compression(compression):
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression "{compression}", should be one of {COMPRESSIONS}')
+    if compression == COMPRESSION_ZSTD and zstandard is None:
+        raise ValueError('zstd compression requires the "zstandard" package to be installed')
+
+
+def encode(doc: str, compression=COMPRESSION_NONE) -> str:
+    '''
+    Encodes a JSON document for storing it in a HarvestObject content.
+    '''
+    if compression == COMPRESSION_ZLIB:
+        return PREFIX_ZLIB + base64.b64encode(zlib.compress(doc.encode('utf-8'), 9)).decode('ascii')
+    elif compression == COMPRESSION_ZSTD:
+        compressed = zstandard.ZstdCompressor(level=10).compress(doc.encode('utf-8'))
+        return PREFIX_ZSTD + base64.b64encode(compressed).decode('ascii')
+    else:
+        return doc
+
+
+def encode_ref(harvest_object_id: str) -> str:
+    return PREFIX_REF + harvest_object_id
+
+
+def is_encoded(content: str) -> bool:
+    return content.startswith((PREFIX_ZLIB, PREFIX_ZSTD, PREFIX_REF))
+
+
+def get_ref(content: str):
+    '''
+    Returns the id of the referenced HarvestObject, or None if the content is not a reference.
+    '''
+    if content and content.startswith(PREFIX_REF):
+        return content[len(PREFIX_REF):]
+    return None
+
+
+def decode(content: str) -> str:
+    '''
+    Decodes a stored content. References should be resolved before, see `load_content()`.
+    '''
+    if content is None:
+        return None
+    if content.startswith(PREFIX_ZLIB):
+        return zlib.decompress(base64.b64decode(content[len(PREFIX_ZLIB):])).decode('utf-8')
+    elif content.startswith(PREFIX_ZSTD):
+        if zstandard is None:
+            raise ValueError('zstd compressed content found, but the "zstandard" package is not installed')
+        compressed = base64.b64decode(content[len(PREFIX_ZSTD):])
+        return zstandard.ZstdDecompressor().decompress(compressed).decode('utf-8')
+    elif content.startswith(PREFIX_REF):
+        raise ValueError(f'Unresolved content reference {content}')
+    else:
+        return content
+
+
+def get_raw_content(harvest_object):
+    '''
+    Returns the stored (maybe compressed) content of the object, following the references to
+    other objects.
+    '''
+    content = harvest_object.content
+    seen = set()
+    ref = get_ref(content)
+    while ref:
+        if ref in seen:
+            raise ValueError(f'Circular content reference in object {harvest_object.id}')
+        seen.add(ref)
+        referenced = HarvestObject.get(ref)
+        if referenced is None:
+            raise ValueError(f'Object {harvest_object.id} references missing object {ref}')
+        content = referenced.content
+        ref = get_ref(content)
+    return content
+
+
+def load_content(harvest_object) -> str:
+    '''
+    Returns the JSON document stored in the object, transparently handling compressed
+    and deduplicated contents.
+    '''
+    return decode(get_raw_content(harvest_object))
+
+
+def resolve_ref(harvest_object):
+    '''
+    Replaces a reference with the content it points to, so that the referenced object can be deleted.
+    '''
+    if get_ref(harvest_object.content):
+        harvest_object.content = get_raw_content(harvest_object)
+        Session.query(HOExtra). \
+            filter(HOExtra.harvest_object_id == harvest_object.id). \
+            filter(HOExtra.key == EXTRA_CONTENT_REF). \
+            delete(synchronize_session=False)
@@ -1,8 +1,11 @@
 import datetime
 import logging
 import tempfile
+from functools import lru_cache
 from urllib.request import urlopen
 
+from ckanext.geonode.harvesters.ratelimit import get_limiter
+
 log = logging.getLogger(__name__)
 
 WFS_FORMAT_CSV = "csv"
@@ -32,9 +35,9 @@ def load_wfs_getfeatures(gsbaseurl, typename, outputfile=None, version=WFS_VERSI
     # TODO: loop to retrieve all the features
     # TODO: stream the output to the file
 
-    http_response = urlopen(url)
-
-    content = http_response.read()
+    with get_limiter(gsbaseurl).request():
+        http_response = urlopen(url)
+        content = http_response.read()
 
     if not outputfile:
         outputfile = tempfile.TemporaryFile()
@@ -45,33 +48,67 @@ def load_wfs_getfeatures(gsbaseurl, typename, outputfile=None, version=WFS_VERSI
     return outputfile
 
 
+# number of (value, format) pairs whose result is reused by format_date
+DATE_CACHE_SIZE = 4096
+
+# formats tried when a value is not ISO 8601
+DATE_FORMATS = (
+    '%Y-%m-%d',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M:%SZ',
+    '%Y-%m-%dT%H:%M:%S.%f%z',
+    '%Y-%m-%dT%H:%M:%S.%f%zZ',
+    '%Y-%m-%d %H:%M:%S',
+    # '%d-%m-%Y %H:%M:%S',
+)
+
+
 def format_date(value, format='%Y-%m-%d'):
-    dateformats = (
-        '%Y-%m-%d',
-        '%Y-%m-%dT%H:%M:%S',
-        '%Y-%m-%dT%H:%M:%SZ',
-        '%Y-%m-%dT%H:%M:%S.%f%z',
-        '%Y-%m-%dT%H:%M:%S.%f%zZ',
-        '%Y-%m-%d %H:%M:%S',
-        # '2021-12-17T11:41:54.854696+00:00Z'
-        # '%d-%m-%Y %H:%M:%S',
-    )
-
-    date = None
-    for dateformat in dateformats:
+    '''
+    Reformats a date string from the GeoNode API; returns None if it can not be parsed or reformatted
+    '''
+    if not isinstance(value, str):
+        raise TypeError(f'format_date() argument must be str, not {type(value).__name__}')
+    # the same dates recur in a catalogue (e.g. the last_updated of resources uploaded together)
+    return _format_date(value, format)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _format_date(value, format):
+    date = parse_date(value)
+    if date is None:
+        log.error(f'Cannot parse "{value}"')
+        return None
+
+    try:
+        return date.strftime(format)
+    except ValueError:
+        log.error(f'Cannot reformat "{date}" using format "{format}"')
+        return None
+
+
+def parse_date(value):
+    '''
+    Returns the datetime of a date string from the GeoNode API, or None if it can not be parsed.
+
+    ISO 8601 values are parsed by `datetime.fromisoformat`, the other ones are tried against DATE_FORMATS.
+    '''
+    iso_value = value
+    if iso_value.endswith('Z'):
+        iso_value = iso_value[:-1]
+        # '2021-12-17T11:41:54.854696+00:00Z': an offset followed by a Z
+        if '+' not in iso_value[10:] and '-' not in iso_value[10:]:
+            iso_value += '+00:00'
+    try:
+        return datetime.datetime.fromisoformat(iso_value)
+    except ValueError:
+        pass
+
+    for dateformat in DATE_FORMATS:
         try:
-            date = datetime.datetime.strptime(value, dateformat)
+            return datetime.datetime.strptime(value, dateformat)
         except ValueError:
             continue
-
-        try:
-            date = date.strftime(format)
-            return date
-        except ValueError as err:
-            log.error(f'Cannot reformat "{date}" using format "{format}"')
-            return None
-
-    log.error(f'Cannot parse "{value}"')
     return None
 
 
@@ -0,0 +1,115 @@
+from ckan.plugins import toolkit
+
+from ckanext.harvest.model import HarvestJob
+
+import ckanext.geonode.harvesters.progress as progress
+import ckanext.geonode.harvesters.report as report
+
+
+def get_actions():
+    return {
+        'geonode_harvest_progress': geonode_harvest_progress,
+        'geonode_harvest_report': geonode_harvest_report,
+    }
+
+
+def get_auth_functions():
+    return {
+        'geonode_harvest_progress': geonode_harvest_progress_auth,
+        'geonode_harvest_report': geonode_harvest_report_auth,
+    }
+
+
+@toolkit.side_effect_free
+def geonode_harvest_progress(context, data_dict):
+    '''
+    Returns the progress of a GeoNode harvest job: the counts of the gather stage (objects and pages
+    gathered, total reported by the API, bytes received, rate and ETA) and of the import stage
+    (objects by state, rate and ETA).
+
+    :param id: the id of the harvest job (optional if `source_id` is given)
+    :type id: string
+    :param source_id: the id of a harvest source, whose last job is returned
+    :type source_id: string
+
+    :returns: a dict with `job_id`, `source_id`, `status`, `gather` and `import`
+    :rtype: dict
+    '''
+    harvest_job = _get_job(data_dict)
+    toolkit.check_access('geonode_harvest_progress', context, {'id': harvest_job.id})
+
+    return {
+        'job_id': harvest_job.id,
+        'source_id': harvest_job.source_id,
+        'status': harvest_job.status,
+        'gather': progress.get_gather_progress(harvest_job),
+        'import': progress.get_import_progress(harvest_job),
+    }
+
+
+@toolkit.side_effect_free
+def geonode_harvest_report(context, data_dict):
+    '''
+    Returns the report of a GeoNode harvest job: objects gathered per type and result, bytes received
+    per type, retries, content hash and dedup hit rates, import results, slowest objects, downloads
+    and the time spent in each stage. The report is stored when the last object of the job is imported.
+
+    :param id: the id of the harvest job (optional if `source_id` is given)
+    :type id: string
+    :param source_id: the id of a harvest source, whose last job is returned
+    :type source_id: string
+    :param compare_id: the id of another harvest job whose report is compared (optional)
+    :type compare_id: string
+
+    :returns: the report; with `compare_id`, a dict with `report`, `other` and `comparison`
+    :rtype: dict
+    '''
+    harvest_job = _get_job(data_dict)
+    toolkit.check_access('geonode_harvest_report', context, {'id': harvest_job.id})
+    job_report = report.get_report(harvest_job)
+
+    compare_id = data_dict.get('compare_id')
+    if not compare_id:
+        return job_report
+
+    other_job = _get_job({'id': compare_id})
+    toolkit.check_access('geonode_harvest_report', context, {'id': other_job.id})
+    other_report = report.get_report(other_job)
+    return {
+        'report': job_report,
+        'other': other_report,
+        'comparison': report.compare(job_report, other_report),
+    }
+
+
+def geonode_harvest_progress_auth(context, data_dict):
+    # same permissions needed to see the job
+    try:
+        toolkit.check_access('harvest_job_show', context, data_dict)
+        return {'success': True}
+    except toolkit.NotAuthorized:
+        return {'success': False, 'msg': toolkit._('Not authorized to see this harvest job')}
+
+
+def geonode_harvest_report_auth(context, data_dict):
+    # same permissions needed to see the job
+    try:
+        toolkit.check_access('harvest_job_show', context, data_dict)
+        return {'success': True}
+    except toolkit.NotAuthorized:
+        return {'success': False, 'msg': toolkit._('Not authorized to see the report of this harvest job')}
+
+
+def _get_job(data_dict):
+    job_id = data_dict.get('id')
+    source_id = data_dict.get('source_id')
+    if job_id:
+        harvest_job = HarvestJob.get(job_id)
+    elif source_id:
+        harvest_job = HarvestJob.filter(source_id=source_id).order_by(HarvestJob.created.desc()).first()
+    else:
+        raise toolkit.ValidationError({'id': [toolkit._('Missing value')]})
+
+    if harvest_job is None:
+        raise toolkit.ObjectNotFound(toolkit._('Harvest job not found'))
+    return harvest_job
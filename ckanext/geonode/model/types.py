@@ -10,7 +10,13 @@ class GeoNodeResource(object):
     """"
     Generic resource from GeoNode.
     Can be a Layer, a Map or a Document.
+
+    The resource wraps the dict returned by the API without copying it; the derived values (users, links)
+    are computed on each call, as the mappers read each of them once.
     """
+    # no per instance __dict__: a mapping worker may hold a whole batch of resources at once
+    __slots__ = ('_dict',)
+
     def __init__(self, obj):
         if isinstance(obj, str):
             self._dict = json.loads(obj)
@@ -96,6 +102,7 @@ class GeoResource(GeoNodeResource):
     """
     A spatial resource from GeoNode, i.e. a Layer or a Map.
     """
+    __slots__ = ()
 
     def __init__(self, json_string):
         super(GeoResource, self).__init__(json_string)
@@ -123,6 +130,7 @@ class GeoResource(GeoNodeResource):
 
 
 class Layer(GeoResource):
+    __slots__ = ()
 
     def __init__(self, json_string):
         super(Layer, self).__init__(json_string)
@@ -142,6 +150,7 @@ class Layer(GeoResource):
 
 
 class Map(GeoResource):
+    __slots__ = ()
 
     def __init__(self, json_string):
         super(Map, self).__init__(json_string)
@@ -162,6 +171,7 @@ class Map(GeoResource):
 
 
 class Doc(GeoNodeResource):
+    __slots__ = ()
 
     def __init__(self, json_string):
         super(Doc, self).__init__(json_string)
@@ -185,6 +195,7 @@ class GeoNodeResourceLink(object):
     #   "name": "Atom",
     #   "url": the URL :)
     # },
+    __slots__ = ('_dict',)
 
     def __init__(self, obj):
         if isinstance(obj, str):
@@ -1,10 +1,61 @@
+import hmac
+
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as plugins_toolkit
+from ckan import authz
 from ckan.lib.plugins import DefaultTranslation
+from flask import Blueprint, Response, request
+
+from ckanext.geonode import cli, logic
+import ckanext.geonode.harvesters.metrics as metrics
+
 
 class GeoNodePlugin(plugins.SingletonPlugin, DefaultTranslation):
     """
-    At the moment this plugin is only used to translate the labels in the imported resources
+    Translates the labels in the imported resources, provides the `geonode` CLI commands
+    and exposes the harvest metrics and progress.
     """
     # ITranslation
-    plugins.implements(plugins.ITranslation)
\ No newline at end of file
+    plugins.implements(plugins.ITranslation)
+    # IClick
+    plugins.implements(plugins.IClick)
+    # IBlueprint
+    plugins.implements(plugins.IBlueprint)
+    # IActions
+    plugins.implements(plugins.IActions)
+    # IAuthFunctions
+    plugins.implements(plugins.IAuthFunctions)
+
+    def get_commands(self):
+        return cli.get_commands()
+
+    def get_actions(self):
+        return logic.get_actions()
+
+    def get_auth_functions(self):
+        return logic.get_auth_functions()
+
+    def get_blueprint(self):
+        blueprint = Blueprint('geonode', self.__module__)
+        blueprint.add_url_rule('/geonode/metrics', view_func=metrics_view)
+        return blueprint
+
+
+def metrics_view():
+    '''
+    Metrics of the harvester processes, in the Prometheus text format; only available if a metrics dir is configured.
+    They are served to the sysadmins and to the requests with the configured bearer token.
+    '''
+    if not metrics.get_metrics_dir():
+        plugins_toolkit.abort(404)
+    if not _can_read_metrics():
+        plugins_toolkit.abort(403, plugins_toolkit._('Not authorized to see the harvest metrics'))
+    return Response(metrics.render(metrics.collect()), mimetype='text/plain; version=0.0.4')
+
+
+def _can_read_metrics():
+    token = metrics.get_metrics_token()
+    auth_type, _, value = request.headers.get('Authorization', '').partition(' ')
+    if token and auth_type.lower() == 'bearer' and hmac.compare_digest(value.strip(), token):
+        return True
+    return authz.is_sysadmin(plugins_toolkit.g.user)
@@ -0,0 +1,13 @@
+import os
+
+import pytest
+
+from ckanext.geonode.tests.benchmark.results import BenchmarkResults, DEFAULT_OUTPUT, ENV_OUTPUT
+
+
+@pytest.fixture(scope='session')
+def benchmark_results():
+    results = BenchmarkResults()
+    yield results
+    if results.results:
+        results.dump(os.environ.get(ENV_OUTPUT, DEFAULT_OUTPUT))
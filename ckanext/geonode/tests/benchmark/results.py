@@ -0,0 +1,56 @@
+"""
+Settings and results of the benchmarks.
+"""
+import json
+import os
+import platform
+import sys
+from datetime import datetime
+
+ENV_ENABLED = 'GEONODE_BENCHMARK'
+ENV_SIZES = 'GEONODE_BENCHMARK_SIZES'
+ENV_OUTPUT = 'GEONODE_BENCHMARK_OUTPUT'
+
+DEFAULT_SIZES = '1000,10000,100000'
+DEFAULT_OUTPUT = 'geonode-benchmark.json'
+
+
+def get_sizes():
+    return [int(size) for size in os.environ.get(ENV_SIZES, DEFAULT_SIZES).split(',') if size.strip()]
+
+
+def is_enabled():
+    return bool(os.environ.get(ENV_ENABLED))
+
+
+class BenchmarkResults(object):
+    """
+    Collects the timings of the benchmarks, written as JSON at the end of the session.
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def record(self, benchmark, size, seconds, **info):
+        result = {
+            'benchmark': benchmark,
+            'size': size,
+            'seconds': round(seconds, 6),
+            'objects_per_second': round(size / seconds, 2) if seconds else None,
+        }
+        result.update(info)
+        self.results.append(result)
+        return result
+
+    def dump(self, path):
+        content = {
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'results': self.results,
+        }
+        with open(path, 'w') as f:
+            json.dump(content, f, indent=2)
@@ -0,0 +1,275 @@
+"""
+Local stand-in for the GeoNode API v2 and the GeoServer WFS, serving synthetic resources.
+
+Resources are generated on demand from the `map01.json` fixture, so the memory used does not depend
+on the catalogue size.
+"""
+import copy
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+DEFAULT_PAGE_SIZE = 100
+
+# namespace of the synthetic uuids, so that they are stable between runs
+UUID_NAMESPACE = uuid.UUID('9c1b5c40-1f7e-4a4b-8f7a-4c2d6d1c0e11')
+
+LAYERS_PER_MAP = 3
+
+
+class StandInServer(object):
+    """
+    Serves `layers` layers (or datasets), `maps` maps and `docs` documents.
+
+    :param version: '3' to serve the GeoNode 3 API shape (`layers`), '4' for GeoNode 4 (`datasets`)
+    :param wfs_rows: number of rows returned by a WFS GetFeature request
+    :param revision: changes the title of the resources with a pk multiple of `revision_every`,
+                     to simulate an updated catalogue
+    :param delay: seconds waited before answering each request
+    :param throttled: number of the first requests answered with a 429 status
+    """
+
+    def __init__(self, layers=0, maps=0, docs=0, version='4', page_size=DEFAULT_PAGE_SIZE, wfs_rows=1000,
+                 revision=0, revision_every=10, delay=0, throttled=0):
+        self.counts = {'layer': layers, 'map': maps, 'document': docs}
+        self.version = version
+        self.page_size = page_size
+        self.wfs_rows = wfs_rows
+        self.revision = revision
+        self.revision_every = revision_every
+        self.delay = delay
+        self.throttled = throttled
+        self.requests = 0
+        # requests being served, and the maximum served at the same time
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._template = _load_template()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        if self._httpd is None:
+            # resources can be generated without starting the server
+            return 'http://geonode.example.org'
+        host, port = self._httpd.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        server = self
+
+        class Handler(StandInHandler):
+            stand_in = server
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    @property
+    def layer_type(self):
+        return 'layer' if self.version == '3' else 'dataset'
+
+    def resource(self, res_type, pk):
+        '''
+        Returns the synthetic resource of the given type ('layer', 'map' or 'document') and pk (starting from 1)
+        '''
+        res = copy.deepcopy(self._template)
+        res_uuid = get_uuid(res_type, pk)
+        json_type = self.layer_type if res_type == 'layer' else res_type
+        path = {'layer': 'layers' if self.version == '3' else 'datasets', 'map': 'maps', 'document': 'documents'}
+
+        title = f'{res_type.capitalize()} {pk}'
+        if self.revision and pk % self.revision_every == 0:
+            title = f'{title} (rev {self.revision})'
+
+        # spread the extents over the world
+        x = -180 + (pk * 7) % 350
+        y = -80 + (pk * 3) % 150
+
+        res.update({
+            'pk': str(pk),
+            'uuid': res_uuid,
+            'resource_type': json_type,
+            'title': title,
+            'abstract': f'Synthetic {res_type} #{pk} for the benchmarks',
+            'alternate': f'geonode:{res_type}_{pk}' if res_type == 'layer' else None,
+            'name': f'{res_type}_{pk}',
+            'detail_url': f'{self.url}/{path[res_type]}/{pk}',
+            'link': f'{self.url}/api/v2/{path[res_type]}/{pk}',
+            'embed_url': f'{self.url}/{path[res_type]}/{pk}/embed',
+            'thumbnail_url': f'{self.url}/uploaded/thumbs/{res_type}-{res_uuid}-thumb.png',
+            'last_updated': f'2021-02-{1 + pk % 28:02d}T14:21:14.576521Z',
+            'll_bbox_polygon': {
+                'type': 'Polygon',
+                'coordinates': [[[x, y], [x + 10, y], [x + 10, y + 10], [x, y + 10], [x, y]]]
+            },
+        })
+
+        if res_type == 'layer':
+            res['storeType'] = 'dataStore' if pk % 2 else 'coverageStore'
+            res['subtype'] = 'vector' if pk % 2 else 'raster'
+            res['workspace'] = 'geonode'
+            res['store'] = 'data'
+        elif res_type == 'map':
+            layer_pks = [1 + (pk * LAYERS_PER_MAP + i) % self.counts['layer']
+                         for i in range(LAYERS_PER_MAP)] if self.counts['layer'] else []
+            res['maplayers'] = [self._maplayer(layer_pk) for layer_pk in layer_pks]
+            if self.version == '4':
+                res['datasets'] = [{'pk': str(layer_pk), 'uuid': get_uuid('layer', layer_pk),
+                                    'alternate': f'geonode:layer_{layer_pk}'} for layer_pk in layer_pks]
+        elif res_type == 'document':
+            res['doc_file'] = f'/uploaded/documents/doc_{pk}.pdf'
+            res['doc_type'] = 'document'
+            res['extension'] = 'pdf'
+
+        res['links'] = [
+            {'extension': 'html', 'link_type': 'html', 'mime': 'text/html', 'name': f'{res_type}_{pk}',
+             'url': res['detail_url']},
+            {'extension': 'csv', 'link_type': 'data', 'mime': 'text/csv', 'name': 'CSV',
+             'url': f'{self.url}/geoserver/ows?service=WFS&request=GetFeature&typeName=geonode:{res_type}_{pk}'},
+        ]
+        return res
+
+    def _maplayer(self, layer_pk):
+        maplayer = {'pk': layer_pk, 'name': f'geonode:layer_{layer_pk}', 'order': 0, 'visibility': True}
+        if self.version == '4':
+            maplayer['dataset'] = {'pk': str(layer_pk), 'uuid': get_uuid('layer', layer_pk),
+                                   'alternate': f'geonode:layer_{layer_pk}'}
+        return maplayer
+
+    def page(self, res_type, page, page_size, include=None):
+        total = self.counts[res_type]
+        start = (page - 1) * page_size
+        objects = []
+        for pk in range(start + 1, min(total, start + page_size) + 1):
+            res = self.resource(res_type, pk)
+            if include is not None:
+                res = {k: v for k, v in res.items() if k in include}
+            objects.append(res)
+        return total, objects
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    stand_in = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.stand_in
+        with server._lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            throttled = server.requests <= server.throttled
+        try:
+            if server.delay:
+                time.sleep(server.delay)
+            if throttled:
+                self.send_response(429)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self._get()
+        finally:
+            with server._lock:
+                server.active -= 1
+
+    def _get(self):
+        server = self.stand_in
+        parts = urlsplit(self.path)
+        path = parts.path.rstrip('/')
+        params = parse_qsl(parts.query)
+
+        if path == '/api/v2':
+            layer_list = 'layers' if server.version == '3' else 'datasets'
+            return self._json({name: f'{server.url}/api/v2/{name}/'
+                               for name in (layer_list, 'maps', 'documents', 'users', 'groups')})
+
+        list_types = {'/api/v2/maps': 'map', '/api/v2/documents': 'document',
+                      '/api/v2/layers' if server.version == '3' else '/api/v2/datasets': 'layer'}
+        if path in list_types:
+            return self._list(path, list_types[path], params)
+
+        if path.startswith('/documents/') and path.endswith('/download'):
+            return self._send(b'%PDF-1.4 synthetic document\n' * 1024, 'application/pdf')
+
+        if path.endswith(('/ows', '/wfs')) and dict((k.lower(), v) for k, v in params).get('request') == 'GetFeature':
+            return self._wfs(params)
+
+        self.send_error(404)
+
+    def _list(self, path, res_type, params):
+        server = self.stand_in
+        args = dict(params)
+        page = int(args.get('page', 1))
+        page_size = int(args.get('page_size', server.page_size))
+        include = None
+        if ('exclude[]', '*') in params:
+            include = set(v for k, v in params if k == 'include[]')
+
+        total, objects = server.page(res_type, page, page_size, include)
+        list_name = {'layer': 'layers' if server.version == '3' else 'datasets',
+                     'map': 'maps', 'document': 'documents'}[res_type]
+
+        def page_url(n):
+            query = [(k, v) for k, v in params if k not in ('page', 'page_size')]
+            query.extend((('page', n), ('page_size', page_size)))
+            return f'{server.url}{path}/?{urlencode(query)}'
+
+        self._json({
+            'links': {
+                'next': page_url(page + 1) if page * page_size < total else None,
+                'previous': page_url(page - 1) if page > 1 else None,
+            },
+            'total': total,
+            'page': page,
+            'page_size': page_size,
+            list_name: objects,
+        })
+
+    def _wfs(self, params):
+        rows = ['FID,name,value']
+        rows.extend(f'feature.{i},name {i},{i * 0.5}' for i in range(self.stand_in.wfs_rows))
+        self._send(('\n'.join(rows) + '\n').encode('utf-8'), 'text/csv')
+
+    def _json(self, content):
+        self._send(json.dumps(content).encode('utf-8'), 'application/json')
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def get_uuid(res_type, pk):
+    return str(uuid.uuid5(UUID_NAMESPACE, f'{res_type}-{pk}'))
+
+
+def _load_template():
+    file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'files', 'map01.json')
+    with open(file, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,180 @@
+"""
+End-to-end benchmarks of the GeoNode harvester, run against the local stand-in server.
+
+They are skipped unless the GEONODE_BENCHMARK environment variable is set; the catalogue sizes are read
+from GEONODE_BENCHMARK_SIZES and the timings are written as JSON to GEONODE_BENCHMARK_OUTPUT.
+"""
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+from ckanext.geonode.harvesters import GeoNodeType
+from ckanext.geonode.harvesters.client import GeoNodeClient
+from ckanext.geonode.harvesters.mappers.base import map_content
+from ckanext.geonode.harvesters.mappers.pool import MappingPool
+from ckanext.geonode.harvesters.snapshot import RecordingClient, ReplayGeoNodeClient
+from ckanext.geonode.harvesters.utils import load_wfs_getfeatures
+from ckanext.geonode.tests.benchmark.results import ENV_ENABLED, get_sizes, is_enabled
+from ckanext.geonode.tests.benchmark.server import StandInServer
+
+pytestmark = pytest.mark.skipif(not is_enabled(), reason=f'set {ENV_ENABLED}=1 to run the benchmarks')
+
+SIZES = get_sizes()
+VERSIONS = ['3', '4']
+
+
+def new_server(size, version='4', **kwargs):
+    '''
+    Returns a stand-in server with `size` resources: 70% layers, 20% maps, 10% documents
+    '''
+    maps = size // 5
+    docs = size // 10
+    return StandInServer(layers=size - maps - docs, maps=maps, docs=docs, version=version, **kwargs)
+
+
+@pytest.mark.parametrize('version', VERSIONS)
+@pytest.mark.parametrize('size', SIZES)
+def test_crawl(size, version, benchmark_results):
+    with new_server(size, version) as server:
+        start = time.perf_counter()
+        client = GeoNodeClient(server.url)
+        count = 0
+        for res_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.MAP_TYPE, GeoNodeType.DOC_TYPE):
+            for page, _ in client.get_pages(res_type):
+                count += len(page)
+        seconds = time.perf_counter() - start
+
+        assert count == size
+        benchmark_results.record('crawl', size, seconds, geonode_version=version, requests=server.requests)
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_replay(size, benchmark_results):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'snapshot.jsonl.gz')
+        with new_server(size) as server:
+            client = RecordingClient(GeoNodeClient(server.url), path)
+            for res_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.MAP_TYPE, GeoNodeType.DOC_TYPE):
+                for _ in client.get_pages(res_type):
+                    pass
+            client.close()
+
+        start = time.perf_counter()
+        client = ReplayGeoNodeClient(path)
+        count = 0
+        for res_type in (GeoNodeType.LAYER_TYPE, GeoNodeType.MAP_TYPE, GeoNodeType.DOC_TYPE):
+            for page, _ in client.get_pages(res_type):
+                count += len(page)
+        seconds = time.perf_counter() - start
+
+        assert count == size
+        benchmark_results.record('replay', size, seconds, snapshot_bytes=os.path.getsize(path))
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_mapping(size, benchmark_results):
+    server = new_server(size)
+    contents = [json.dumps(server.resource(res_type, pk))
+                for res_type, count in server.counts.items()
+                for pk in range(1, count + 1)]
+
+    start = time.perf_counter()
+    for content in contents:
+        map_content(content, {})
+    benchmark_results.record('mapping_serial', size, time.perf_counter() - start)
+
+    with MappingPool() as pool:
+        start = time.perf_counter()
+        results = pool.map(contents, {})
+        seconds = time.perf_counter() - start
+        benchmark_results.record('mapping_pool', size, seconds, processes=pool.processes)
+
+    assert not [error for _, _, error in results if error]
+
+
+@pytest.mark.parametrize('rows', [10000, 100000])
+def test_wfs_download(rows, benchmark_results):
+    with StandInServer(wfs_rows=rows) as server:
+        with tempfile.TemporaryFile() as f:
+            start = time.perf_counter()
+            load_wfs_getfeatures(f'{server.url}/geoserver', 'geonode:layer_1', outputfile=f)
+            seconds = time.perf_counter() - start
+            size = f.seek(0, os.SEEK_END)
+
+    benchmark_results.record('wfs_download', rows, seconds, bytes=size)
+
+
+@pytest.fixture
+def harvest_db(clean_db):
+    from ckanext.harvest.model import setup
+    setup()
+
+
+@pytest.mark.usefixtures('with_plugins', 'harvest_db')
+@pytest.mark.parametrize('size', SIZES)
+def test_harvest(size, benchmark_results):
+    from ckanext.harvest.model import HarvestObject
+    from ckanext.harvest.tests.factories import HarvestJobObj, HarvestSourceObj
+    from ckanext.geonode.harvesters.geonode import GeoNodeHarvester
+
+    harvester = GeoNodeHarvester()
+
+    with new_server(size) as server:
+        source = HarvestSourceObj(url=server.url, source_type='geonode')
+        job = HarvestJobObj(source=source)
+
+        start = time.perf_counter()
+        object_ids = harvester.gather_stage(job)
+        benchmark_results.record('gather', size, time.perf_counter() - start)
+        assert len(object_ids) == size
+
+        harvest_objects = [HarvestObject.get(object_id) for object_id in object_ids]
+        for harvest_object in harvest_objects:
+            harvester.fetch_stage(harvest_object)
+
+        with MappingPool() as pool:
+            start = time.perf_counter()
+            harvester.map_objects(harvest_objects, pool)
+            benchmark_results.record('map_objects', size, time.perf_counter() - start, processes=pool.processes)
+
+        start = time.perf_counter()
+        for harvest_object in harvest_objects:
+            harvester.import_stage(harvest_object)
+        benchmark_results.record('import', size, time.perf_counter() - start)
+
+        # second harvest, with 10% of the resources changed
+        server.revision = 1
+        job = HarvestJobObj(source=source)
+        start = time.perf_counter()
+        object_ids = harvester.gather_stage(job)
+        benchmark_results.record('gather_incremental', size, time.perf_counter() - start)
+        assert len(object_ids) == size
+
+
+@pytest.mark.usefixtures('with_plugins', 'harvest_db')
+@pytest.mark.parametrize('size', SIZES)
+def test_bulk_harvest(size, benchmark_results):
+    from ckanext.harvest.tests.factories import HarvestSourceObj
+    from ckanext.geonode.harvesters.bulk import bulk_harvest
+    from ckanext.geonode.harvesters.geonode import GeoNodeHarvester
+
+    harvester = GeoNodeHarvester()
+
+    with new_server(size) as server:
+        source = HarvestSourceObj(url=server.url, source_type='geonode')
+        with MappingPool() as pool:
+            start = time.perf_counter()
+            _, results = bulk_harvest(harvester, source, pool)
+            benchmark_results.record('bulk_harvest', size, time.perf_counter() - start, processes=pool.processes)
+        assert results == {'added': size}
+
+        # the next harvest is incremental
+        server.revision = 1
+        with MappingPool() as pool:
+            start = time.perf_counter()
+            _, results = bulk_harvest(harvester, source, pool)
+            benchmark_results.record('bulk_harvest_incremental', size, time.perf_counter() - start)
+        assert results['not modified'] > 0
@@ -0,0 +1,221 @@
+"""
+Micro-benchmarks of the mapping functions, run on synthetic GeoNode resources of increasing size.
+
+Each benchmark records the operations per second (`objects_per_second`) and the peak memory allocated by
+a single operation (`peak_bytes_per_op`, measured with tracemalloc).
+The CKAN model lookups done by `parse` are stubbed, so no database is needed.
+"""
+import copy
+import json
+import time
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from ckanext.geonode.harvesters import CONFIG_INCLUDE_ALL_LINKS
+from ckanext.geonode.harvesters.mappers import base
+from ckanext.geonode.harvesters.mappers.base import get_bbox, get_extent, parse, parse_common
+from ckanext.geonode.harvesters.mappers.dcatapit import parse_dcatapit_info
+from ckanext.geonode.harvesters.mappers.dynamic import parse_dynamic
+from ckanext.geonode.harvesters import utils
+from ckanext.geonode.harvesters.utils import format_date
+from ckanext.geonode.model.types import Layer
+from ckanext.geonode.tests.benchmark.results import ENV_ENABLED, is_enabled
+from ckanext.geonode.tests.benchmark.server import StandInServer
+
+pytestmark = pytest.mark.skipif(not is_enabled(), reason=f'set {ENV_ENABLED}=1 to run the benchmarks')
+
+# number of keywords, thesaurus keywords and links of the generated resources
+DOCUMENT_SIZES = {'small': 10, 'medium': 100, 'large': 1000}
+
+RULE_COUNTS = [1, 100, 1000]
+
+# resources mapped at once by the batch benchmarks
+BATCH_SIZE = 1000
+
+MIN_SECONDS = 0.5  # minimum duration of a timed run
+MEMORY_RUNS = 20   # operations traced by tracemalloc
+
+
+def generate_layer(items):
+    '''
+    Returns a synthetic layer with `items` keywords, thesaurus keywords and links
+    '''
+    layer = StandInServer(layers=1).resource('layer', 1)
+    tkeyword = layer['tkeywords'][0]
+    layer['keywords'] = [{'name': f'keyword {i}', 'slug': f'keyword-{i}'} for i in range(items)]
+    layer['tkeywords'] = []
+    for i in range(items):
+        keyword = copy.deepcopy(tkeyword)
+        keyword['name'] = f'tk{i}'
+        layer['tkeywords'].append(keyword)
+    layer['links'] = [{'extension': 'png', 'link_type': 'image', 'mime': 'image/png', 'name': f'link {i}',
+                       'url': f'http://geonode.example.org/link/{i}.png'} for i in range(items)]
+    return layer
+
+
+def generate_rules(count):
+    '''
+    Returns `count` dynamic mapping rules, each matching one thesaurus keyword
+    '''
+    return [{'filters': [f"tkeywords[?name=='tk{i}']"],
+             'actions': [{'destination': 'tag', 'value': f'tag{i}'},
+                         {'destination': f'extra{i % 10}', 'source': 'title'}]}
+            for i in range(count)]
+
+
+def measure(benchmark_results, benchmark, func, **info):
+    '''
+    Runs `func` for at least MIN_SECONDS and records the ops/sec and the peak memory allocated by one run
+    '''
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        runs += 1
+        seconds = time.perf_counter() - start
+        if seconds >= MIN_SECONDS:
+            break
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(MEMORY_RUNS):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current)
+    finally:
+        tracemalloc.stop()
+
+    return benchmark_results.record(benchmark, runs, seconds, peak_bytes_per_op=sum(peaks) // len(peaks), **info)
+
+
+@pytest.fixture
+def stub_model():
+    '''
+    Stubs the CKAN model lookups done by `finalize`
+    '''
+    with mock.patch.object(base.model.Package, 'get', return_value=SimpleNamespace(owner_org=None)), \
+            mock.patch.object(base.HarvesterBase, '_gen_new_name', side_effect=lambda title: title.lower()):
+        yield
+
+
+@pytest.mark.usefixtures('stub_model')
+@pytest.mark.parametrize('document', list(DOCUMENT_SIZES))
+def test_parse(document, benchmark_results):
+    content = json.dumps(generate_layer(DOCUMENT_SIZES[document]))
+    harvest_object = SimpleNamespace(content=content, extras=[], source=SimpleNamespace(id='source'),
+                                     package=None, guid='guid')
+    with mock.patch.object(base, 'load_content', return_value=content):
+        measure(benchmark_results, 'parse', lambda: parse(harvest_object, {}, group_validator=lambda name: True),
+                document=document)
+
+
+@pytest.mark.parametrize('include_all_links', [False, True])
+@pytest.mark.parametrize('document', list(DOCUMENT_SIZES))
+def test_parse_common(document, include_all_links, benchmark_results):
+    # a new resource each time, as in the harvest
+    layer_dict = generate_layer(DOCUMENT_SIZES[document])
+    config = {CONFIG_INCLUDE_ALL_LINKS: include_all_links}
+    measure(benchmark_results, 'parse_common', lambda: parse_common(Layer(layer_dict), config),
+            document=document, include_all_links=include_all_links)
+
+
+@pytest.fixture(scope='module')
+def batch_documents():
+    return [generate_layer(DOCUMENT_SIZES['medium']) for _ in range(BATCH_SIZE)]
+
+
+def wrap_batch(documents):
+    '''
+    Returns a batch of wrapped resources and their links, held at once as in a mapping worker
+    '''
+    layers = [Layer(document) for document in documents]
+    return layers, [layer.links() for layer in layers]
+
+
+def test_resource_batch(batch_documents, benchmark_results):
+    measure(benchmark_results, 'resource_batch', lambda: wrap_batch(batch_documents), batch=BATCH_SIZE)
+
+
+@pytest.mark.parametrize('include_all_links', [False, True])
+def test_resource_batch_mapping(include_all_links, batch_documents, benchmark_results):
+    config = {CONFIG_INCLUDE_ALL_LINKS: include_all_links}
+    measure(benchmark_results, 'resource_batch_mapping',
+            lambda: [parse_common(layer, config) for layer in [Layer(document) for document in batch_documents]],
+            batch=BATCH_SIZE, include_all_links=include_all_links)
+
+
+@pytest.mark.parametrize('document', list(DOCUMENT_SIZES))
+def test_parse_dcatapit_info(document, benchmark_results):
+    layer = Layer(generate_layer(DOCUMENT_SIZES[document]))
+    measure(benchmark_results, 'parse_dcatapit_info', lambda: parse_dcatapit_info(layer, {'tags': []}, {}),
+            document=document)
+
+
+@pytest.mark.parametrize('rules', RULE_COUNTS)
+def test_parse_dynamic(rules, benchmark_results):
+    layer = Layer(generate_layer(DOCUMENT_SIZES['medium']))
+    config = {'dynamic_mapping': generate_rules(rules)}
+    measure(benchmark_results, 'parse_dynamic',
+            lambda: parse_dynamic(config, layer, {'tags': [], 'groups': []}, {}, validate_groups=False),
+            rules=rules)
+
+
+@pytest.mark.parametrize('value', [
+    '2021-01-27',
+    '2021-01-27T16:21:00',
+    '2021-01-27T16:21:00Z',
+    '2021-01-27T16:21:00.576521+00:00',
+    '2021-12-17T11:41:54.854696+00:00Z',
+    '2021-01-27 16:21:00',
+])
+def test_format_date(value, benchmark_results):
+    measure(benchmark_results, 'format_date', lambda: format_date(value), value=value)
+    measure(benchmark_results, 'format_date_strptime', lambda: strptime_date(value), value=value)
+
+
+def strptime_date(value, format='%Y-%m-%d'):
+    '''
+    The date normalisation done before the ISO 8601 fast path and the cache, as a baseline
+    '''
+    for dateformat in utils.DATE_FORMATS:
+        try:
+            return datetime.strptime(value, dateformat).strftime(format)
+        except ValueError:
+            continue
+    return None
+
+
+@pytest.mark.parametrize('cache', ['cold', 'warm', 'strptime'])
+def test_format_date_per_object(cache, benchmark_results):
+    '''
+    The dates normalised by the mapping of each object: `date` and `last_updated` (twice, in `parse_common` and
+    `parse_dcatapit_info`) and the temporal extent
+    '''
+    layer = generate_layer(0)
+    layer['temporal_extent_start'] = '2020-01-01T00:00:00Z'
+    layer['temporal_extent_end'] = '2020-12-31T00:00:00Z'
+    values = [layer['date'], layer['date'], layer['last_updated'],
+              layer['temporal_extent_start'], layer['temporal_extent_end']]
+
+    if cache == 'strptime':
+        func = lambda: [strptime_date(value) for value in values]
+    elif cache == 'cold':
+        def func():
+            utils._format_date.cache_clear()
+            return [format_date(value) for value in values]
+    else:
+        func = lambda: [format_date(value) for value in values]
+    measure(benchmark_results, 'format_date_per_object', func, cache=cache)
+
+
+@pytest.mark.parametrize('polygons', [1, 100])
+def test_extent(polygons, benchmark_results):
+    bbox_polys = [generate_layer(0)['ll_bbox_polygon']] * polygons
+    measure(benchmark_results, 'extent', lambda: get_extent(*get_bbox(bbox_polys)), polygons=polygons)
@@ -1,3 +1,5 @@
+import os
+
 import pytest
 
 from ckan.model import Package, Group, PackageExtra, meta, GroupExtra, Member, PackageTag
@@ -18,3 +20,9 @@ def remove_dataset_groups():
         meta.Session.query(cls).delete()
 
     meta.Session.commit()
+
+
+def load_test_file(filename):
+    file = os.path.join(os.path.dirname(__file__), 'files', filename)
+    with open(file, 'r') as f:
+        return f.read()
@@ -0,0 +1,67 @@
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from ckanext.geonode.harvesters import GeoNodeType
+from ckanext.geonode.harvesters import aioclient
+from ckanext.geonode.harvesters.downloader import WFSCSVDownloader
+from ckanext.geonode.harvesters.ratelimit import get_limiter
+from ckanext.geonode.tests.benchmark.server import StandInServer
+
+
+@unittest.skipIf(aioclient.aiohttp is None, 'aiohttp is not installed')
+class AsyncClientTestCase(unittest.TestCase):
+
+    def _start(self, **kwargs):
+        server = StandInServer(**kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_concurrent_downloads(self):
+        server = self._start(layers=1, docs=4, wfs_rows=100, delay=0.1)
+        limiter = get_limiter(server.url)
+        limiter.limit = limiter.max_concurrency = 2
+
+        def download_wfs(_):
+            with tempfile.TemporaryFile() as f:
+                WFSCSVDownloader(f'{server.url}/geoserver', 'geonode:layer_1', 'layer_1.csv',
+                                 async_client=True).download(f)
+                f.seek(0)
+                return len(f.readlines())
+
+        client = aioclient.SyncGeoNodeClient(server.url)
+        with ThreadPoolExecutor(4) as executor:
+            rows = list(executor.map(download_wfs, range(4)))
+            docs = list(executor.map(client.get_document_download, range(1, 5)))
+
+        self.assertEqual([101] * 4, rows)
+        self.assertTrue(all(doc.startswith(b'%PDF') for doc in docs))
+        # the requests of all the threads run concurrently, within the limit of the host
+        self.assertEqual(2, server.max_active)
+        self.assertEqual(0, limiter.in_flight)
+
+    def test_throttling(self):
+        server = self._start(layers=5, page_size=2, throttled=2)
+
+        client = aioclient.SyncGeoNodeClient(server.url, backoff=0)
+        pages = list(client.get_pages(GeoNodeType.DATASET_TYPE))
+
+        self.assertEqual(5, sum(len(page) for page, _ in pages))
+        self.assertEqual(2, client.retried)
+        self.assertEqual(2, client.limiter.throttled_count)
+
+    def test_shutdown(self):
+        server = self._start(docs=1)
+        client = aioclient.SyncGeoNodeClient(server.url)
+        thread = aioclient._thread
+        session = aioclient._session
+
+        aioclient.shutdown()
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(session.closed)
+
+        # the loop and the session are created again by the next request
+        self.assertTrue(client.get_document_download(1).startswith(b'%PDF'))
+        self.assertIsNot(session, aioclient._session)
+        aioclient.shutdown()
@@ -0,0 +1,40 @@
+import unittest
+
+from ckanext.geonode.harvesters.dependencies import layer_keys, map_dependencies
+
+
+class DependenciesTestCase(unittest.TestCase):
+
+    def test_geonode3_maplayers(self):
+        geomap = {
+            'maplayers': [
+                {'name': 'geonode:roads'},
+                {'name': 'geonode:rivers'},
+                {'name': 'geonode:roads'},
+                {'name': None},
+            ]
+        }
+
+        self.assertEqual(['geonode:rivers', 'geonode:roads'], map_dependencies(geomap))
+
+    def test_geonode4_datasets(self):
+        geomap = {
+            'maplayers': [
+                {'name': 'geonode:roads', 'dataset': {'uuid': 'u1', 'alternate': 'geonode:roads'}},
+                {'name': 'osm', 'dataset': None},
+            ],
+            'datasets': [
+                {'uuid': 'u1', 'alternate': 'geonode:roads'},
+                {'uuid': 'u2', 'alternate': 'geonode:rivers'},
+            ]
+        }
+
+        self.assertEqual(['osm', 'u1', 'u2'], map_dependencies(geomap))
+
+    def test_no_layers(self):
+        self.assertEqual([], map_dependencies({'maplayers': None}))
+        self.assertEqual([], map_dependencies({}))
+
+    def test_layer_keys(self):
+        self.assertEqual(['u1', 'geonode:roads'], layer_keys({'uuid': 'u1', 'alternate': 'geonode:roads'}))
+        self.assertEqual(['u1'], layer_keys({'uuid': 'u1'}))
@@ -1,6 +1,5 @@
 import json
 import logging
-import os
 import pytest
 import unittest
 
@@ -11,6 +10,7 @@ from ckan.model.meta import Session
 from ckan.tests import helpers, factories
 
 from ckanext.geonode.harvesters.mappers.dynamic import parse_dynamic, validate_config
+from ckanext.geonode.tests.conftest import load_test_file
 
 
 class DynamicMapperTestCase(unittest.TestCase):
@@ -293,9 +293,3 @@ class DynamicMapperTestCase(unittest.TestCase):
         tags = [t["name"] for t in pkg_dict['tags']]
         self.assertEqual(1, len(tags))
         self.assertSetEqual(set(('foo',)), set(tags))
-
-
-def load_test_file(filename):
-    file = os.path.join(os.path.dirname(__file__), 'files', filename)
-    with open(file, 'r') as f:
-        return f.read()
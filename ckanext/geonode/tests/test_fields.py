@@ -0,0 +1,118 @@
+import json
+import unittest
+
+from ckanext.geonode.harvesters.fields import api_fields, required_paths, get_projection, project
+from ckanext.geonode.tests.conftest import load_test_file
+
+
+class FieldsTestCase(unittest.TestCase):
+
+    def test_static_fields(self):
+        fields = api_fields({})
+
+        for field in ('pk', 'uuid', 'title', 'resource_type', 'tkeywords', 'regions', 'owner'):
+            self.assertIn(field, fields)
+        self.assertNotIn('links', fields)
+        self.assertNotIn('perms', fields)
+
+    def test_links_fields(self):
+        fields = api_fields({'include_all_links': True})
+
+        self.assertIn('links', fields)
+        self.assertIn('alternate', fields)
+
+    def test_config_fields(self):
+        fields = api_fields({
+            'map_fields': ['category'],
+            'group_mapping_fieldname': 'license',
+            'group_mapping': {'x': 'y'},
+        })
+
+        self.assertIn('category', fields)
+        self.assertIn('license', fields)
+
+    def test_dynamic_fields(self):
+        config = {
+            "dynamic_mapping": [
+                {
+                    "filters": [
+                        "restriction_code_type.identifier == 'x'",
+                        "spatial_representation_type[?name=='nz' && thesaurus.uri == 'x']",
+                    ],
+                    "actions": [
+                        {
+                            "source": "group.name",
+                            "destination": "group"
+                        }
+                    ]
+                }
+            ]
+        }
+
+        paths = required_paths(config)
+
+        self.assertIn(('restriction_code_type', 'identifier'), paths)
+        self.assertIn(('spatial_representation_type',), paths)
+        self.assertIn(('group', 'name'), paths)
+        self.assertNotIn(('group',), paths)
+
+    def test_whole_resource(self):
+        config = {
+            "dynamic_mapping": [
+                {
+                    "filters": ["@"],
+                    "actions": [
+                        {
+                            "value": "everything",
+                            "destination": "tag"
+                        }
+                    ]
+                }
+            ]
+        }
+
+        self.assertIsNone(required_paths(config))
+        self.assertIsNone(api_fields(config))
+
+    def test_projection(self):
+        geonode_map = json.loads(load_test_file('map01.json'))
+        config = {
+            "map_fields": ["category"],
+            "dynamic_mapping": [
+                {
+                    "filters": [],
+                    "actions": [
+                        {
+                            "source": "group.name",
+                            "destination": "group"
+                        }
+                    ]
+                }
+            ]
+        }
+
+        projected = project(geonode_map, get_projection(config))
+
+        self.assertNotIn('perms', projected)
+        self.assertNotIn('bbox_polygon', projected)
+        self.assertEqual(geonode_map['category'], projected['category'])
+        self.assertEqual({'name': geonode_map['group']['name']}, projected['group'])
+        self.assertEqual(set(('username', 'first_name', 'last_name')), set(projected['owner'].keys()))
+        self.assertEqual(len(geonode_map['tkeywords']), len(projected['tkeywords']))
+        for tk in projected['tkeywords']:
+            self.assertEqual(set(('name', 'thesaurus')), set(tk.keys()) - set(('i18n',)))
+            self.assertEqual(set(('uri',)), set(tk['thesaurus'].keys()))
+        self.assertLess(len(json.dumps(projected)), len(json.dumps(geonode_map)))
+
+    def test_projection_whole_resource(self):
+        geonode_map = json.loads(load_test_file('map01.json'))
+        config = {
+            "dynamic_mapping": [
+                {
+                    "filters": ["@"],
+                    "actions": []
+                }
+            ]
+        }
+
+        self.assertEqual(geonode_map, project(geonode_map, get_projection(config)))
@@ -0,0 +1,47 @@
+import unittest
+
+from ckanext.geonode.harvesters import NAME_FALLBACK
+from ckanext.geonode.harvesters.mappers.base import map_content
+from ckanext.geonode.harvesters.mappers.pool import MappingPool
+from ckanext.geonode.tests.conftest import load_test_file
+
+
+class MappingTestCase(unittest.TestCase):
+
+    def test_map_content(self):
+        config = {
+            'dynamic_mapping': [
+                {
+                    'filters': [],
+                    'actions': [
+                        {
+                            'value': 'nonexistent_group',
+                            'destination': 'group'
+                        }
+                    ]
+                }
+            ]
+        }
+
+        package_dict, extras = map_content(load_test_file('map01.json'), config)
+
+        # groups are only validated in finalize()
+        self.assertEqual([{'name': 'nonexistent_group'}], package_dict['groups'])
+        self.assertNotIn('name', package_dict)
+        self.assertNotIn('owner_org', package_dict)
+        self.assertIn(NAME_FALLBACK, package_dict)
+        self.assertEqual('c711b892-60bb-11eb-a589-0242c0a83007', extras['guid'])
+
+    def test_pool(self):
+        content = load_test_file('map01.json')
+        expected = map_content(content, {})
+
+        with MappingPool(processes=2) as pool:
+            results = pool.map([content, content, '{not json'], {})
+
+        self.assertEqual(3, len(results))
+        for package_dict, extras, error in results[:2]:
+            self.assertIsNone(error)
+            self.assertEqual(expected, (package_dict, extras))
+        self.assertIsNone(results[2][0])
+        self.assertIsNotNone(results[2][2])
@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import ckanext.geonode.harvesters.metrics as metrics
+from ckanext.geonode.harvesters.metrics import Registry, diff, merge, render, summarize
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_timer(self):
+        registry = Registry()
+        with registry.timer('api_request', host='geonode.org') as timer:
+            timer.bytes = 100
+        with self.assertRaises(ValueError):
+            with registry.timer('api_request', host='geonode.org'):
+                raise ValueError()
+
+        [[stage, labels, (count, seconds, nbytes)]] = registry.snapshot()
+        self.assertEqual('api_request', stage)
+        self.assertEqual({'host': 'geonode.org'}, labels)
+        self.assertEqual(2, count)
+        self.assertEqual(100, nbytes)
+
+    def test_diff(self):
+        registry = Registry()
+        registry.observe('mapping', 1.0, source='s1')
+        registry.observe('import', 1.0, source='s1')
+        before = registry.snapshot()
+        registry.observe('mapping', 0.5, count=2, source='s1')
+        registry.observe('mapping', 0.5, source='s2')
+
+        delta = diff(before, registry.snapshot())
+        self.assertEqual([['mapping', {'source': 's1'}, [2, 0.5, 0]],
+                          ['mapping', {'source': 's2'}, [1, 0.5, 0]]], delta)
+        self.assertEqual({'mapping': {'count': 3, 'seconds': 1.0, 'bytes': 0}}, summarize(delta))
+
+    def test_merge_render(self):
+        snapshot = merge([['api_request', {'host': 'a'}, [1, 0.5, 10]]],
+                         [['api_request', {'host': 'a'}, [2, 1.0, 20]]])
+        self.assertEqual([['api_request', {'host': 'a'}, [3, 1.5, 30]]], snapshot)
+
+        text = render(snapshot)
+        self.assertIn('# TYPE ckanext_geonode_stage_seconds_total counter', text)
+        self.assertIn('ckanext_geonode_stage_calls_total{stage="api_request",host="a"} 3', text)
+        self.assertIn('ckanext_geonode_stage_bytes_total{stage="api_request",host="a"} 30', text)
+
+
+class MetricsFilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        for name, value in (('get_metrics_dir', lambda: self.dir), ('registry', Registry()),
+                            ('_process_file', None), ('_compacted', []), ('_flushed', None)):
+            patcher = mock.patch.object(metrics, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _write(self, filename, count, age=0):
+        path = os.path.join(self.dir, filename)
+        with open(path, 'w') as f:
+            json.dump([['import', {'source': 's1'}, [count, 1.0, 0]]], f)
+        os.utime(path, (time.time() - age, time.time() - age))
+
+    def _count(self):
+        return summarize(metrics.collect())['import']['count']
+
+    def test_file_names(self):
+        metrics.registry.observe('import', 1.0, source='s1')
+        metrics.flush(force=True)
+        # a process of another container with the same pid
+        self._write(f'geonode-otherhost-{os.getpid()}.json', 2)
+
+        own_files = [name for name in os.listdir(self.dir) if name.startswith(f'geonode-{socket.gethostname()}-')]
+        self.assertEqual(1, len(own_files))
+        self.assertEqual(3, self._count())
+
+    def test_compact(self):
+        self._write('geonode-host-dead.json', 2, age=metrics.STALE_AFTER + 60)
+        self._write('geonode-host-alive.json', 3)
+        metrics.registry.observe('import', 1.0, source='s1')
+        metrics.flush(force=True)
+
+        self.assertEqual(6, self._count())
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'geonode-host-dead.json')))
+        self.assertTrue(os.path.exists(os.path.join(self.dir, metrics.COMPACTED_FILE)))
+
+        # the file of this process is compacted by another one while this process is idle
+        metrics._compact(self.dir, None, -1)
+        self.assertEqual(6, self._count())
+        metrics.registry.observe('import', 1.0, source='s1')
+        metrics.flush(force=True)
+        self.assertEqual(7, self._count())
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+from ckanext.geonode.harvesters.profiling import MemoryTracing, SlowestProfiles
+
+
+class SlowestProfilesTestCase(unittest.TestCase):
+
+    def test_keep_slowest(self):
+        slowest = SlowestProfiles()
+        profile_dir = tempfile.mkdtemp()
+
+        for seconds in (3, 1, 2, 5, 0.5):
+            if slowest.offer('job', 2, seconds):
+                path = os.path.join(profile_dir, f'{seconds}.json')
+                open(path, 'w').close()
+                slowest.keep('job', 2, seconds, path)
+
+        self.assertEqual(['3.json', '5.json'], sorted(os.listdir(profile_dir)))
+        # other jobs are tracked on their own
+        self.assertTrue(slowest.offer('other', 2, 0.1))
+
+
+class MemoryTracingTestCase(unittest.TestCase):
+
+    def test_one_measure_at_a_time(self):
+        tracing = MemoryTracing()
+
+        start = tracing.enter()
+        # an import running meanwhile in another thread is not measured
+        other_start = tracing.enter()
+        self.assertIsNone(other_start)
+        data = bytearray(1024 * 1024)
+        self.assertEqual((None, None), tracing.exit(other_start))
+        self.assertTrue(tracemalloc.is_tracing())
+
+        peak, allocations = tracing.exit(start, snapshot=True)
+        self.assertGreaterEqual(peak, len(data))
+        self.assertTrue(allocations)
+        self.assertFalse(tracemalloc.is_tracing())
@@ -0,0 +1,32 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from ckanext.geonode.harvesters.progress import GatherProgress
+
+
+class GatherProgressTestCase(unittest.TestCase):
+
+    def test_eta(self):
+        progress = GatherProgress(SimpleNamespace(id='job', source_id='source'), total=300)
+        with mock.patch('ckanext.geonode.harvesters.progress.state') as state, \
+                mock.patch.object(GatherProgress, 'elapsed', new_callable=mock.PropertyMock, return_value=10.0):
+            progress.page_done(100, 5000)
+            self.assertEqual(10.0, progress.rate)
+            self.assertEqual(20.0, progress.eta)
+
+            progress.publish('finished')
+            _, saved = state.save.call_args[0]
+
+        self.assertEqual('finished', saved['status'])
+        self.assertEqual(100, saved['objects'])
+        self.assertEqual(1, saved['pages'])
+        self.assertEqual(5000, saved['received_bytes'])
+        self.assertEqual(20, saved['eta_seconds'])
+
+    def test_unknown_total(self):
+        progress = GatherProgress(SimpleNamespace(id='job', source_id='source'))
+        with mock.patch('ckanext.geonode.harvesters.progress.state'):
+            progress.page_done(100, 5000)
+        self.assertIsNone(progress.eta)
+        self.assertIsNone(progress.as_dict()['eta_seconds'])
@@ -0,0 +1,59 @@
+import unittest
+from email.message import Message
+from urllib.error import HTTPError
+
+from ckanext.geonode.harvesters.ratelimit import HostLimiter, get_retry_after
+
+
+class HostLimiterTestCase(unittest.TestCase):
+
+    def test_additive_increase(self):
+        limiter = HostLimiter('geonode', concurrency=2, max_concurrency=4, target_latency=1)
+
+        for _ in range(20):
+            with limiter.request():
+                pass
+
+        self.assertEqual(4, limiter.limit)
+        self.assertEqual(0, limiter.in_flight)
+
+    def test_slow_host(self):
+        limiter = HostLimiter('geonode', concurrency=2, max_concurrency=4, target_latency=1)
+
+        for _ in range(20):
+            limiter.acquire()
+            limiter.success(5)
+            limiter.release()
+
+        self.assertEqual(2, limiter.limit)
+
+    def test_multiplicative_decrease(self):
+        limiter = HostLimiter('geonode', concurrency=8, max_concurrency=16)
+
+        with self.assertRaises(HTTPError):
+            with limiter.request():
+                raise HTTPError('http://geonode/api/v2/', 429, 'Too many requests', _headers(), None)
+
+        self.assertEqual(4, limiter.limit)
+        self.assertEqual(1, limiter.throttled_count)
+        self.assertEqual(0, limiter.in_flight)
+
+    def test_retry_after(self):
+        limiter = HostLimiter('geonode', concurrency=2)
+
+        limiter.on_error(HTTPError('http://geonode/api/v2/', 503, 'Unavailable', _headers('30'), None))
+
+        self.assertEqual(1, limiter.limit)
+        self.assertGreater(limiter.try_acquire(), 25)
+
+    def test_retry_after_header(self):
+        self.assertEqual(12, get_retry_after(HTTPError('url', 429, 'msg', _headers('12'), None)))
+        self.assertIsNone(get_retry_after(HTTPError('url', 429, 'msg', _headers(), None)))
+        self.assertIsNone(get_retry_after(HTTPError('url', 429, 'msg', _headers('whenever'), None)))
+
+
+def _headers(retry_after=None):
+    headers = Message()
+    if retry_after:
+        headers['Retry-After'] = retry_after
+    return headers
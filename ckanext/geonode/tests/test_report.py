@@ -0,0 +1,54 @@
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+from ckanext.geonode.harvesters.report import GatherReport, compare, get_report
+
+
+class ReportTestCase(unittest.TestCase):
+
+    def test_gather_report(self):
+        gather_report = GatherReport()
+        gather_report.add_object('layer', 'new')
+        gather_report.add_object('layer', 'unchanged')
+        gather_report.add_object('map', 'dependency_changed')
+        gather_report.add_object('map', 'unchanged')
+        gather_report.add_page('layer', 1000)
+        gather_report.dedup = 1
+
+        values = gather_report.as_dict()
+        self.assertEqual(4, values['gathered'])
+        self.assertEqual({'new': 1, 'changed': 0, 'unchanged': 1, 'dependency_changed': 0, 'pages': 1, 'bytes': 1000},
+                         values['types']['layer'])
+        self.assertEqual({'hits': 2, 'total': 4, 'rate': 0.5}, values['caches']['content_hash'])
+        self.assertEqual(0.25, values['caches']['content_dedup']['rate'])
+
+        self.assertIsNone(GatherReport().as_dict()['caches']['content_hash']['rate'])
+
+    def test_compare(self):
+        comparison = compare(
+            {'version': 1, 'status': 'Finished', 'gather': {'types': {'layer': {'bytes': 100}}, 'retries': 2},
+             'import': {'slowest': [{'seconds': 1.0}]}},
+            {'version': 1, 'status': 'Finished', 'gather': {'types': {'layer': {'bytes': 40}, 'map': {'bytes': 5}},
+                                                            'retries': 2}})
+
+        self.assertEqual({
+            'gather.retries': {'value': 2, 'other': 2, 'delta': 0},
+            'gather.types.layer.bytes': {'value': 100, 'other': 40, 'delta': 60},
+            'gather.types.map.bytes': {'value': None, 'other': 5, 'delta': None},
+        }, comparison)
+
+    def test_stored_report(self):
+        harvest_job = SimpleNamespace(id='job', status='Finished', created=datetime(2024, 1, 1),
+                                      gather_started=None, gather_finished=None, finished=datetime(2024, 1, 2))
+        stored = {'status': 'Running', 'finished': None,
+                  'import': {'slowest': [{'guid': str(n), 'seconds': n} for n in range(100)]}}
+
+        with mock.patch('ckanext.geonode.harvesters.report.state.load', return_value=stored):
+            job_report = get_report(harvest_job, slowest=5)
+
+        # the job is flagged as finished after the report is stored
+        self.assertEqual('Finished', job_report['status'])
+        self.assertEqual('2024-01-02T00:00:00', job_report['finished'])
+        self.assertEqual(5, len(job_report['import']['slowest']))
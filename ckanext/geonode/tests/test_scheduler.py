@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime, timedelta
+
+from ckanext.geonode.harvesters.scheduler import SourceStatus, plan, priority
+
+
+NOW = datetime(2021, 6, 1, 12, 0)
+
+
+def status(source_id, host='geonode.example.org', hours_ago=48, size=100, running=False):
+    last_success = NOW - timedelta(hours=hours_ago) if hours_ago is not None else None
+    return SourceStatus(source_id, source_id, host, last_success, size, running)
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def test_never_harvested_first(self):
+        statuses = [status('old', hours_ago=100), status('never', hours_ago=None, size=0)]
+
+        chosen = plan(statuses, NOW, max_running=1, max_per_host=10)
+
+        self.assertEqual(['never'], [s.source_id for s in chosen])
+
+    def test_size_aware(self):
+        big = status('big', hours_ago=48, size=100000)
+        small = status('small', hours_ago=30, size=10)
+
+        self.assertGreater(priority(small, NOW), priority(big, NOW))
+        chosen = plan([big, small], NOW, max_running=1, max_per_host=10)
+        self.assertEqual(['small'], [s.source_id for s in chosen])
+
+    def test_min_interval(self):
+        statuses = [status('recent', hours_ago=2), status('stale', hours_ago=30)]
+
+        chosen = plan(statuses, NOW, max_running=10, max_per_host=10, min_interval=timedelta(hours=24))
+
+        self.assertEqual(['stale'], [s.source_id for s in chosen])
+
+    def test_failing(self):
+        failing = status('failing', hours_ago=None)._replace(last_attempt=NOW - timedelta(hours=1))
+        failed = status('failed', hours_ago=None)._replace(last_attempt=NOW - timedelta(hours=30))
+        statuses = [failing, failed, status('stale', hours_ago=48)]
+
+        chosen = plan(statuses, NOW, max_running=10, max_per_host=10, min_interval=timedelta(hours=24))
+
+        # the sources that never succeeded wait min_interval after each attempt too
+        self.assertEqual(['stale', 'failed'], [s.source_id for s in chosen])
+
+    def test_resuming(self):
+        statuses = [status('recent', hours_ago=2)._replace(resuming=True), status('done', hours_ago=2)]
+
+        chosen = plan(statuses, NOW, max_running=10, max_per_host=10, min_interval=timedelta(hours=24))
+
+        # the crawl of the recent source was stopped before the end
+        self.assertEqual(['recent'], [s.source_id for s in chosen])
+
+    def test_quotas(self):
+        statuses = [
+            status('running', host='a', running=True),
+            status('a1', host='a', hours_ago=100),
+            status('b1', host='b', hours_ago=90),
+            status('b2', host='b', hours_ago=80),
+            status('c1', host='c', hours_ago=70),
+        ]
+
+        chosen = plan(statuses, NOW, max_running=3, max_per_host=1)
+
+        # one job is already running on host a; the per host quota excludes b2
+        self.assertEqual(['b1', 'c1'], [s.source_id for s in chosen])
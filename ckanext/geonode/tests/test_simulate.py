@@ -0,0 +1,42 @@
+import unittest
+
+from ckanext.geonode.harvesters.simulate import Simulation
+
+
+class SimulationTestCase(unittest.TestCase):
+
+    def test_projection(self):
+        simulation = Simulation()
+        simulation.set_total('layer', 10)
+        simulation.page_done('layer', 0.5, 1000)
+        for _ in range(2):
+            simulation.object_stored('layer', '{"title": "layer"}', 'z:abc')
+        simulation.objects_mapped('layer', 0.25, [
+            ({'resources': [{}, {}], 'groups': [{'name': 'g1'}, {'name': 'g2'}]}, {}, None),
+            (None, None, 'Error mapping content'),
+        ], group_validator=lambda name: name == 'g1')
+        simulation.done()
+
+        results = simulation.as_dict()
+        layer = results['types']['layer']
+        self.assertEqual(2, layer['objects'])
+        self.assertEqual(1, layer['packages'])
+        self.assertEqual(1, layer['mapping_errors'])
+        self.assertEqual(2, layer['resources'])
+        self.assertEqual(1, layer['invalid_groups'])
+        self.assertEqual(10, layer['stored_bytes'])
+
+        self.assertEqual({'objects': 10, 'api_seconds': 2.5, 'received_bytes': 5000, 'stored_bytes': 50,
+                          'mapping_seconds': 1.25, 'packages': 5, 'resources': 10,
+                          'package_bytes': layer['package_bytes'] * 5}, results['projected'])
+        self.assertEqual(10, results['summary']['total'])
+
+    def test_unknown_total(self):
+        simulation = Simulation()
+        simulation.set_total('map', None)
+        simulation.object_stored('map', '{}', '{}')
+
+        results = simulation.as_dict()
+        self.assertIsNone(results['types']['map']['projected'])
+        self.assertIsNone(results['projected'])
+        self.assertIsNone(results['summary']['total'])
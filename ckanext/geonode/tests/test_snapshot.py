@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ckanext.geonode.harvesters import GeoNodeType
+from ckanext.geonode.harvesters.snapshot import DocumentNotInSnapshot, RecordingClient, ReplayGeoNodeClient
+
+
+class PagesClient(object):
+    baseurl = 'http://geonode.example.org'
+    version = '4'
+    fields = ['uuid', 'title']
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get_pages(self, res_type, start_url=None):
+        urls = [f'{self.baseurl}/api/v2/{res_type.api_path}/?page={n}' for n in range(2, len(self.pages) + 1)]
+        for page, next_url in zip(self.pages, urls + [None]):
+            yield page, next_url
+
+    def get_total(self, res_type):
+        return sum(len(page) for page in self.pages)
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'source.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _record(self, pages, complete=True):
+        client = RecordingClient(PagesClient(pages), self.path)
+        client.get_total(GeoNodeType.LAYER_TYPE)
+        recorded = list(client.get_pages(GeoNodeType.LAYER_TYPE))
+        client.close(complete=complete)
+        return recorded
+
+    def test_replay(self):
+        pages = [[{'uuid': 'a'}, {'uuid': 'b'}], [{'uuid': 'c'}]]
+        recorded = self._record(pages)
+
+        client = ReplayGeoNodeClient(self.path, fields=['uuid', 'title'])
+        self.assertEqual('4', client.version)
+        self.assertEqual(3, client.get_total(GeoNodeType.DATASET_TYPE))
+        self.assertEqual(recorded, list(client.get_pages(GeoNodeType.LAYER_TYPE)))
+        self.assertEqual(['a', 'b', 'c'], [res['uuid'] for res in client.get_layers()])
+        self.assertEqual([], list(client.get_maps()))
+        self.assertGreater(client.received_bytes, 0)
+
+        # resumed from the URL of the second page
+        self.assertEqual([recorded[1]], list(client.get_pages(GeoNodeType.LAYER_TYPE, start_url=recorded[0][1])))
+
+        with self.assertRaises(DocumentNotInSnapshot):
+            client.get_document_download(1)
+
+    def test_incomplete(self):
+        self._record([[{'uuid': 'a'}]], complete=False)
+        self.assertEqual([], os.listdir(self.dir))
@@ -0,0 +1,34 @@
+import unittest
+
+import ckanext.geonode.harvesters.storage as storage
+from ckanext.geonode.tests.conftest import load_test_file
+
+
+class StorageTestCase(unittest.TestCase):
+
+    def test_plain(self):
+        doc = load_test_file('map01.json')
+
+        self.assertEqual(doc, storage.encode(doc))
+        self.assertFalse(storage.is_encoded(doc))
+        self.assertEqual(doc, storage.decode(doc))
+
+    def test_zlib(self):
+        doc = load_test_file('map01.json')
+
+        encoded = storage.encode(doc, storage.COMPRESSION_ZLIB)
+
+        self.assertTrue(storage.is_encoded(encoded))
+        self.assertLess(len(encoded), len(doc))
+        self.assertEqual(doc, storage.decode(encoded))
+
+    def test_ref(self):
+        ref = storage.encode_ref('abc')
+
+        self.assertTrue(storage.is_encoded(ref))
+        self.assertEqual('abc', storage.get_ref(ref))
+        self.assertIsNone(storage.get_ref('{}'))
+        self.assertRaises(ValueError, storage.decode, ref)
+
+    def test_compression_check(self):
+        self.assertRaises(ValueError, storage.check_compression, 'lzma')
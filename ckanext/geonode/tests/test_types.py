@@ -0,0 +1,21 @@
+import unittest
+
+from ckanext.geonode.model.types import Layer
+
+
+class GeoNodeResourceTestCase(unittest.TestCase):
+
+    def test_resource(self):
+        layer = Layer({
+            'owner': {'first_name': 'Jane', 'last_name': 'Doe', 'username': 'jdoe'},
+            'poc': {'username': 'poc'},
+            'links': [{'name': 'Atom', 'extension': 'xml', 'url': 'http://geonode.example.org/atom'}],
+        })
+        self.assertEqual('Jane Doe', layer.owner())
+        self.assertEqual('poc', layer.poc())
+        self.assertEqual(['xml'], [link.extension() for link in layer.links()])
+        self.assertEqual([], Layer('{"title": "layer"}').links())
+
+        # no per instance dict
+        with self.assertRaises(AttributeError):
+            layer.other = None
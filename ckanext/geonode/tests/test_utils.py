@@ -0,0 +1,28 @@
+import unittest
+
+from ckanext.geonode.harvesters.utils import format_date, parse_date
+
+
+class FormatDateTestCase(unittest.TestCase):
+
+    def test_formats(self):
+        for value in ('2021-12-17',
+                      '2021-12-17T11:41:54',
+                      '2021-12-17T11:41:54Z',
+                      '2021-12-17T11:41:54.854696Z',
+                      '2021-12-17T11:41:54.854696+00:00',
+                      '2021-12-17T11:41:54.854696+00:00Z',
+                      '2021-12-17 11:41:54',
+                      '2021-12-17T11:41:54.8546+01:00'):
+            self.assertEqual('2021-12-17', format_date(value), value)
+
+        self.assertEqual('17/12/2021 11:41', format_date('2021-12-17T11:41:54.854696+00:00Z', '%d/%m/%Y %H:%M'))
+        self.assertEqual('+0100', format_date('2021-12-17T11:41:54+01:00', '%z'))
+        self.assertEqual('+0000', format_date('2021-12-17T11:41:54.854696+00:00Z', '%z'))
+
+    def test_not_parsed(self):
+        with self.assertLogs('ckanext.geonode.harvesters.utils', 'ERROR'):
+            self.assertIsNone(format_date('17/12/2021'))
+        self.assertIsNone(parse_date('2021-13-01'))
+        with self.assertRaises(TypeError):
+            format_date(None)